@@ -0,0 +1,170 @@
+"""
+This module implements the control logic that decides when actuators should be
+on. An actuator is demanded by its control profile if any of its
+:class:`~actuators.models.ActuatorEffect` instances is pushing a resource
+property towards a set point it has drifted away from by more than the effect's
+threshold. A demanded actuator is then duty cycled according to the
+:attr:`period` and :attr:`pulse_width` of its control profile, and active
+:class:`~recipes.models.ActuatorOverride` instances take precedence over all of
+this.
+"""
+
+#: The shortest duty cycle period (in seconds) that a control profile can have.
+#: Every period produces two transitions, so shorter periods would flood
+#: schedules with transitions that no relay could follow anyway.
+MIN_PERIOD = 1
+
+
+def mean(values):
+    """ Returns the mean of the non-null values in `values` or None """
+    values = [value for value in values if value is not None]
+    if not values:
+        return None
+    return sum(values) / len(values)
+
+
+def effect_is_demanded(effect_on_active, threshold, set_point, reading):
+    """
+    Returns True if an actuator that changes a property by `effect_on_active`
+    when it is on should be turned on given the current `set_point` and
+    `reading` for that property
+    """
+    if set_point is None or reading is None:
+        return False
+    if effect_on_active > 0:
+        return reading < set_point - threshold
+    if effect_on_active < 0:
+        return reading > set_point + threshold
+    return False
+
+
+def is_demanded(effects, set_points, readings):
+    """
+    Returns True if any of `effects` (a dictionary mapping property codes to
+    dictionaries with the keys "effect_on_active" and "threshold") demands
+    that the actuator be turned on. `set_points` and `readings` map property
+    codes to the current set point and reading for that property.
+    """
+    return any(
+        effect_is_demanded(
+            effect['effect_on_active'], effect['threshold'],
+            set_points.get(code), readings.get(code)
+        ) for code, effect in effects.items()
+    )
+
+
+def pulse_value(timestamp, period, pulse_width):
+    """
+    Returns 1 if a demanded actuator duty cycled with the given `period` and
+    `pulse_width` is on at `timestamp` and 0 otherwise. Pulses are aligned to
+    multiples of `period` so that schedules computed at different times agree
+    with each other. A non-positive `period` disables duty cycling.
+    """
+    if period <= 0 or pulse_width >= period:
+        return 1
+    if pulse_width <= 0:
+        return 0
+    return 1 if timestamp % period < pulse_width else 0
+
+
+def pulse_edges(start, end, period, pulse_width):
+    """
+    Yields every time in ``[start, end)`` at which a duty cycled actuator
+    turns on or off
+    """
+    if period <= 0 or pulse_width <= 0 or pulse_width >= period:
+        return
+    cycle_start = start - start % period
+    while cycle_start < end:
+        for edge in (cycle_start, cycle_start + pulse_width):
+            if start <= edge < end:
+                yield edge
+        cycle_start += period
+
+
+def on_time(start, end, period, pulse_width):
+    """
+    Returns the number of seconds in ``[start, end)`` for which a demanded
+    actuator duty cycled with the given `period` and `pulse_width` is on
+    """
+    if period <= 0 or pulse_width >= period:
+        return end - start
+    if pulse_width <= 0:
+        return 0
+    def on_time_until(timestamp):
+        cycles, offset = divmod(timestamp, period)
+        return cycles * pulse_width + min(offset, pulse_width)
+    return on_time_until(end) - on_time_until(start)
+
+
+def get_transitions(start, end, period, pulse_width, demanded, overrides=()):
+    """
+    Returns the on/off pattern of an actuator over ``[start, end)`` as a list
+    of ``(timestamp, value)`` pairs at which the value of the actuator
+    changes. The first pair is always at `start`.
+
+    :param bool demanded: Whether the control profile demands the actuator
+    :param overrides: An iterable of ``(start, end, value)`` triples for the
+        overrides on this actuator that intersect ``[start, end)``
+    """
+    overrides = sorted(overrides)
+    edges = {start}
+    if demanded:
+        edges.update(pulse_edges(start, end, period, pulse_width))
+    for override_start, override_end, value in overrides:
+        edges.update(
+            edge for edge in (override_start, override_end) if
+            start <= edge < end
+        )
+    transitions = []
+    for edge in sorted(edges):
+        value = None
+        for override_start, override_end, override_value in overrides:
+            if override_start <= edge < override_end:
+                value = override_value
+        if value is None:
+            value = pulse_value(edge, period, pulse_width) if demanded else 0
+        if not transitions or transitions[-1][1] != value:
+            transitions.append((edge, value))
+    return transitions
+
+
+def get_schedule(frame, overrides, start, horizon):
+    """
+    Computes the transitions of every actuator in a control frame.
+
+    :param dict frame: The data of a :class:`~resources.frames.ControlFrame`
+    :param dict overrides: Maps actuator urls to lists of ``(start, end,
+        value)`` triples for the overrides intersecting the schedule
+    :param start: The time at which the schedule starts
+    :param horizon: The length of the schedule in seconds
+    :returns: A dictionary mapping actuator urls to lists of ``[offset,
+        value]`` pairs, where `offset` is the number of seconds after `start`
+        at which the actuator should be switched to `value`
+    """
+    end = start + horizon
+    res = {}
+    for resource in frame['resources']:
+        set_points = {}
+        for tray in resource['trays']:
+            for code, value in frame['set_points'].get(tray, {}).items():
+                set_points.setdefault(code, []).append(value)
+        set_points = {
+            code: mean(values) for code, values in set_points.items()
+        }
+        readings = {
+            code: mean(point['value'] for point in points) for code, points
+            in resource['readings'].items()
+        }
+        for actuator in resource['actuators']:
+            profile = actuator['control_profile']
+            demanded = is_demanded(profile['effects'], set_points, readings)
+            transitions = get_transitions(
+                start, end, profile['period'], profile['pulse_width'],
+                demanded, overrides.get(actuator['url'], ())
+            )
+            res[actuator['url']] = [
+                [round(timestamp - start, 3), value] for timestamp, value in
+                transitions
+            ]
+    return res
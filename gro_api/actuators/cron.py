@@ -0,0 +1,22 @@
+import logging
+from django_cron import CronJobBase, Schedule
+from .usage import rollup_usage
+
+logger = logging.getLogger(__name__)
+
+
+class RollupActuatorUsage(CronJobBase):
+    """
+    This job calls :func:`~gro_api.actuators.usage.rollup_usage` every hour to
+    roll up the usage of every actuator over the hours and days that have
+    completed since it last ran.
+    """
+    RUN_EVERY_MINS = 60
+    schedule = Schedule(run_every_mins=RUN_EVERY_MINS)
+    code = 'actuators.rollup_actuator_usage'
+
+    @staticmethod
+    def do():
+        logger.info('Running cron job %s', RollupActuatorUsage.code)
+        count = rollup_usage()
+        logger.info('Created %d actuator usage records', count)
@@ -0,0 +1,78 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from ...models import Actuator, ControlProfile
+from ...simulation import Simulation, SimulationError
+
+class Command(BaseCommand):
+    help = (
+        'Replay the recorded history of the resource containing an actuator '
+        'through the control logic, optionally with the actuator running a '
+        'different control profile'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('actuator', type=int, help='The id of the actuator')
+        parser.add_argument(
+            '--profile', type=int, default=None,
+            help='The id of the control profile to simulate the actuator with'
+        )
+        parser.add_argument(
+            '--start', type=float, default=None,
+            help='The time at which to start (defaults to a day before --end)'
+        )
+        parser.add_argument(
+            '--end', type=float, default=None,
+            help='The time at which to end (defaults to now)'
+        )
+        parser.add_argument(
+            '--step', type=float, default=10,
+            help='The number of seconds between control decisions'
+        )
+
+    def handle(self, *args, **options):
+        if settings.SERVER_TYPE != settings.LEAF:
+            raise CommandError('Simulations can only be run on leaf servers')
+        try:
+            actuator = Actuator.objects.select_related('resource').get(
+                pk=options['actuator']
+            )
+            control_profiles = {}
+            if options['profile'] is not None:
+                control_profiles[actuator.pk] = ControlProfile.objects.get(
+                    pk=options['profile'], actuator_type=actuator.actuator_type
+                )
+        except (Actuator.DoesNotExist, ControlProfile.DoesNotExist) as e:
+            raise CommandError(str(e))
+        end = options['end'] if options['end'] is not None else time.time()
+        start = options['start'] if options['start'] is not None else \
+            end - 24*60*60
+        try:
+            results = Simulation(
+                actuator.resource, start, end, options['step'],
+                control_profiles=control_profiles
+            ).run()
+        except SimulationError as e:
+            raise CommandError(str(e))
+        for actuator_id, result in sorted(results['actuators'].items()):
+            self.stdout.write(
+                'Actuator {}: duty cycle {:.3f} (recorded {:.3f}) with '
+                'profile {}'.format(
+                    actuator_id, result['duty_cycle'],
+                    result['recorded_duty_cycle'], result['control_profile']
+                )
+            )
+        for property_id, result in sorted(results['properties'].items()):
+            if result['time_in_range'] is None:
+                self.stdout.write(
+                    'Property {}: no set points or readings'.format(
+                        property_id
+                    )
+                )
+                continue
+            self.stdout.write(
+                'Property {}: time in range {:.3f} (recorded {:.3f})'.format(
+                    property_id, result['time_in_range'],
+                    result['recorded_time_in_range']
+                )
+            )
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('actuators', '0006_auto_20150902_1801'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ActuatorUsage',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', primary_key=True, serialize=False, auto_created=True)),
+                ('start_timestamp', models.IntegerField()),
+                ('duration', models.IntegerField()),
+                ('covered_time', models.FloatField()),
+                ('value_integral', models.FloatField()),
+                ('on_time', models.FloatField()),
+                ('actuator', models.ForeignKey(related_name='usage+', to='actuators.Actuator')),
+            ],
+            options={
+                'ordering': ['start_timestamp'],
+                'get_latest_by': 'start_timestamp',
+            },
+        ),
+        migrations.AlterIndexTogether(
+            name='actuatorstate',
+            index_together=set([('actuator', 'timestamp')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='actuatorusage',
+            unique_together=set([('actuator', 'start_timestamp', 'duration')]),
+        ),
+    ]
@@ -113,7 +113,26 @@ class ActuatorState(models.Model):
     class Meta:
         ordering = ['timestamp']
         get_latest_by = 'timestamp'
+        index_together = ('actuator', 'timestamp')
 
     actuator = models.ForeignKey(Actuator, related_name='states+')
     timestamp = models.IntegerField(blank=True, default=time.time)
     value = models.FloatField()
+
+
+class ActuatorUsage(models.Model):
+    """
+    The usage of an actuator over a completed hour or day, rolled up from its
+    :class:`ActuatorState` history by :mod:`~actuators.usage`
+    """
+    class Meta:
+        ordering = ['start_timestamp']
+        get_latest_by = 'start_timestamp'
+        unique_together = ('actuator', 'start_timestamp', 'duration')
+
+    actuator = models.ForeignKey(Actuator, related_name='usage+')
+    start_timestamp = models.IntegerField()
+    duration = models.IntegerField()
+    covered_time = models.FloatField()
+    value_integral = models.FloatField()
+    on_time = models.FloatField()
@@ -1,7 +1,10 @@
 from rest_framework import serializers
+from ..gro_api.utils import atomic
 from ..gro_api.serializers import BaseSerializer
+from .control import MIN_PERIOD
 from .models import (
-    ActuatorType, ControlProfile, ActuatorEffect, Actuator, ActuatorState
+    ActuatorType, ControlProfile, ActuatorEffect, Actuator, ActuatorState,
+    ActuatorUsage
 )
 
 
@@ -34,24 +37,124 @@ class ActuatorEffectSerializer(BaseSerializer):
         return data
 
 
+def create_control_profiles(profiles_data):
+    """
+    Creates a control profile for every dictionary of validated data in
+    `profiles_data` in a single transaction. Every profile gets an
+    :class:`~actuators.models.ActuatorEffect` for each property affected by its
+    actuator type. Effects listed under the "effects" key of the data
+    override the default settings for their property. All of the effects are
+    inserted with a single query.
+    """
+    profiles_data = [dict(data) for data in profiles_data]
+    actuator_types = {
+        actuator_type.pk: actuator_type for actuator_type in
+        ActuatorType.objects.filter(pk__in=set(
+            data['actuator_type'].pk for data in profiles_data
+        )).prefetch_related('properties')
+    }
+    profiles = []
+    effects = []
+    with atomic():
+        for data in profiles_data:
+            effects_data = {
+                effect['property'].pk: effect for effect in
+                data.pop('effects', [])
+            }
+            # bulk_create doesn't set primary keys on every backend, so the
+            # profiles themselves have to be created one at a time
+            profile = ControlProfile.objects.create(**data)
+            profiles.append(profile)
+            actuator_type = actuator_types[profile.actuator_type_id]
+            for property in actuator_type.properties.all():
+                effects_data.setdefault(property.pk, {'property': property})
+            for effect_data in effects_data.values():
+                effects.append(
+                    ActuatorEffect(control_profile=profile, **effect_data)
+                )
+        ActuatorEffect.objects.bulk_create(effects)
+    return profiles
+
+
+class ControlProfileListSerializer(serializers.ListSerializer):
+    def create(self, validated_data):
+        return create_control_profiles(validated_data)
+
+
+class ControlProfileEffectSerializer(ActuatorEffectSerializer):
+    """
+    An :class:`~actuators.models.ActuatorEffect` nested in the control profile
+    it belongs to
+    """
+    control_profile = serializers.HyperlinkedRelatedField(
+        view_name='controlprofile-detail', read_only=True
+    )
+
+    def validate(self, data):
+        # The control profile is validated by the parent serializer
+        return data
+
+
 class ControlProfileSerializer(BaseSerializer):
     class Meta:
         model = ControlProfile
         exclude = ('properties',)
+        list_serializer_class = ControlProfileListSerializer
 
-    effects = ActuatorEffectSerializer(many=True, read_only=True)
+    effects = ControlProfileEffectSerializer(many=True, required=False)
 
-    def create(self, validated_data):
-        actuator_type = validated_data['actuator_type']
-        instance = super().create(validated_data)
-        try:
-            for property in actuator_type.properties.all():
-                ActuatorEffect.objects.create(
-                    control_profile=instance, property=property
+    def validate_period(self, val):
+        if 0 < val < MIN_PERIOD:
+            raise serializers.ValidationError(
+                'A control profile must either have a period of at least {} '
+                'seconds or no period at all (0)'.format(MIN_PERIOD)
+            )
+        return val
+
+    def validate(self, data):
+        actuator_type = data.get(
+            'actuator_type', getattr(self.instance, 'actuator_type', None)
+        )
+        correct_type = actuator_type.resource_effect.resource_type
+        properties = set()
+        for effect in data.get('effects', []):
+            if effect['property'].resource_type_id != correct_type.pk:
+                raise serializers.ValidationError(
+                    'An actuator cannot affect a property on a resource type '
+                    'than the one it affects.'
                 )
-        except:
-            instance.delete()
-            raise
+            if effect['property'].pk in properties:
+                raise serializers.ValidationError(
+                    'A control profile can only have one effect for a given '
+                    'property.'
+                )
+            properties.add(effect['property'].pk)
+        return data
+
+    def create(self, validated_data):
+        return create_control_profiles([validated_data])[0]
+
+    def update(self, instance, validated_data):
+        effects_data = validated_data.pop('effects', None)
+        with atomic():
+            instance = super().update(instance, validated_data)
+            if effects_data is not None:
+                effects = {
+                    effect.property_id: effect for effect in
+                    instance.effects.all()
+                }
+                new_effects = []
+                for effect_data in effects_data:
+                    effect = effects.get(effect_data['property'].pk)
+                    if effect is None:
+                        new_effects.append(ActuatorEffect(
+                            control_profile=instance, **effect_data
+                        ))
+                        continue
+                    for attr, value in effect_data.items():
+                        setattr(effect, attr, value)
+                    effect.save()
+                ActuatorEffect.objects.bulk_create(new_effects)
         return instance
 
 
@@ -112,3 +215,17 @@ class ActuatorSerializer(BaseSerializer):
 class ActuatorStateSerializer(BaseSerializer):
     class Meta:
         model = ActuatorState
+
+
+class ActuatorUsageSerializer(BaseSerializer):
+    class Meta:
+        model = ActuatorUsage
+
+    average_value = serializers.SerializerMethodField()
+    duty_cycle = serializers.SerializerMethodField()
+
+    def get_average_value(self, obj):
+        return obj.covered_time and obj.value_integral / obj.covered_time
+
+    def get_duty_cycle(self, obj):
+        return obj.covered_time and obj.on_time / obj.covered_time
@@ -0,0 +1,310 @@
+"""
+This module replays recorded history through the control logic in
+:mod:`~actuators.control` so that changes to a control profile can be
+evaluated before they are applied to a live farm.
+
+A simulation covers every actuator installed in a single resource. It steps
+through the recorded history at a fixed interval and, at every step, decides
+whether each actuator is demanded given the recorded set points and the
+simulated readings. The loop is closed with a simple model of the resource:
+while an actuator is on, every property it affects changes by the
+:attr:`effect_on_active` of the actuator's current effect on that property per
+second. The simulated reading of a property is therefore the recorded reading
+plus the accumulated difference between what the actuators did in the
+simulation and what they actually did according to their recorded
+:class:`~actuators.models.ActuatorState` history.
+
+All of the history is loaded up front in a fixed number of queries and
+resampled onto the simulation steps with a single merge pass per series, so
+a simulation runs much faster than real time.
+"""
+from collections import defaultdict
+from django.db.models import Max, Prefetch, Q
+from ..layout.models import get_tray_locations
+from ..sensors.models import SensingPoint
+from ..sensors.history import get_data_point_history
+from ..recipes.set_points import get_set_point_history
+from .models import Actuator, ActuatorEffect, ActuatorState
+from .control import mean, is_demanded, on_time
+
+
+class SimulationError(Exception):
+    pass
+
+
+def sample(points, times):
+    """
+    Samples the function described by the time-ordered points in `points` at
+    every one of the increasing `times`. Every point is either a
+    ``(timestamp, value)`` pair, meaning that the function is `value` from
+    `timestamp` until the next point, or a ``(timestamp, value, slope)``
+    triple, meaning that it changes by `slope` per second from there. The
+    value before the first point is None.
+    """
+    res = []
+    point = None
+    i = 0
+    for timestamp in times:
+        while i < len(points) and points[i][0] <= timestamp:
+            point = points[i]
+            i += 1
+        if point is None or point[1] is None:
+            res.append(None)
+        elif len(point) > 2 and point[2]:
+            res.append(point[1] + point[2] * (timestamp - point[0]))
+        else:
+            res.append(point[1])
+    return res
+
+
+def sample_mean(series, times):
+    """
+    Samples every list of points in `series` at `times` and returns the mean
+    of the samples at each time
+    """
+    samples = [sample(points, times) for points in series]
+    return [mean(values) for values in zip(*samples)] if samples else \
+        [None] * len(times)
+
+
+class Simulation:
+    """
+    A replay of the recorded history of a resource through the control logic.
+
+    :param resource: The :class:`~resources.models.Resource` to simulate
+    :param start: The time at which the simulation starts
+    :param end: The time at which the simulation ends
+    :param step: The number of seconds between control decisions
+    :param dict control_profiles: Maps actuator ids to the
+        :class:`~actuators.models.ControlProfile` instances with which they
+        should be simulated. Actuators not in this dictionary are simulated
+        with their current control profile.
+    """
+    #: The largest number of control decisions in a single simulation
+    max_steps = 100000
+
+    def __init__(self, resource, start, end, step=10, control_profiles=None):
+        if step <= 0:
+            raise SimulationError('The step must be a positive duration')
+        if start >= end:
+            raise SimulationError('The simulation must start before it ends')
+        if (end - start) / step > self.max_steps:
+            raise SimulationError(
+                'A simulation can contain at most {} steps'.format(
+                    self.max_steps
+                )
+            )
+        self.resource = resource
+        self.start = start
+        self.end = end
+        self.step = step
+        self.control_profiles = control_profiles or {}
+
+    def get_times(self):
+        times = []
+        timestamp = self.start
+        while timestamp < self.end:
+            times.append(timestamp)
+            timestamp += self.step
+        return times
+
+    def get_actuators(self):
+        effects = ActuatorEffect.objects.order_by('pk')
+        return list(Actuator.objects.filter(
+            resource=self.resource
+        ).select_related('control_profile').prefetch_related(
+            Prefetch('control_profile__effects', queryset=effects)
+        ).order_by('pk'))
+
+    def get_reading_history(self):
+        """
+        Returns a dictionary mapping property ids to lists of the recorded
+        readings of every active sensing point measuring that property in the
+        resource
+        """
+        sensing_points = dict(SensingPoint.objects.filter(
+            sensor__resource=self.resource, is_active=True
+        ).values_list('pk', 'property_id'))
+        history = get_data_point_history(
+            sensing_points.keys(), self.start, self.end
+        )
+        res = defaultdict(list)
+        for point_id, property_id in sensing_points.items():
+            res[property_id].append(history[point_id])
+        return res
+
+    def get_set_point_history(self):
+        """
+        Returns a dictionary mapping property ids to lists of the set point
+        histories of every tray served by the resource
+        """
+        location = (self.resource.location_type_id, self.resource.location_id)
+        tray_ids = [
+            tray_id for tray_id, locations in get_tray_locations().items() if
+            location in locations
+        ]
+        res = defaultdict(list)
+        history = get_set_point_history(tray_ids, self.start, self.end)
+        for tray_history in history.values():
+            for property_id, points in tray_history.items():
+                res[property_id].append(points)
+        return res
+
+    def get_state_history(self, actuators):
+        """
+        Returns a dictionary mapping actuator ids to the recorded states of
+        that actuator
+        """
+        actuator_ids = [actuator.pk for actuator in actuators]
+        initial = ActuatorState.objects.filter(
+            actuator_id__in=actuator_ids, timestamp__lt=self.start
+        ).values('actuator_id').annotate(latest=Max('timestamp'))
+        query = Q(timestamp__gte=self.start, timestamp__lte=self.end)
+        for row in initial:
+            query |= Q(actuator_id=row['actuator_id'], timestamp=row['latest'])
+        states = ActuatorState.objects.filter(
+            query, actuator_id__in=actuator_ids
+        ).order_by('timestamp', 'pk').values_list(
+            'actuator_id', 'timestamp', 'value'
+        )
+        res = defaultdict(list)
+        for actuator_id, timestamp, value in states:
+            res[actuator_id].append((timestamp, value))
+        return res
+
+    def run(self):
+        """
+        Runs the simulation and returns a dictionary with the results. It maps
+        "actuators" to a dictionary mapping actuator ids to their simulated
+        and recorded duty cycles, and "properties" to a dictionary mapping
+        property ids to the fraction of the time the simulated and recorded
+        readings of that property were within the control deadband (the
+        largest effect threshold on the property) of the set point.
+        """
+        times = self.get_times()
+        actuators = self.get_actuators()
+        profiles = {
+            actuator.pk: self.control_profiles.get(
+                actuator.pk, actuator.control_profile
+            ) for actuator in actuators
+        }
+        effects = {
+            actuator.pk: {
+                effect.property_id: effect for effect in
+                profiles[actuator.pk].effects.all()
+            } for actuator in actuators
+        }
+        # The response of the resource to each actuator is taken from the
+        # effects of the profile the actuator is actually running
+        responses = {
+            actuator.pk: {
+                effect.property_id: effect.effect_on_active for effect in
+                actuator.control_profile.effects.all()
+            } for actuator in actuators
+        }
+        property_ids = set()
+        for actuator_effects in effects.values():
+            property_ids.update(actuator_effects.keys())
+        deadbands = {
+            property_id: max(
+                actuator_effects[property_id].threshold for actuator_effects
+                in effects.values() if property_id in actuator_effects
+            ) for property_id in property_ids
+        }
+        reading_history = self.get_reading_history()
+        set_point_history = self.get_set_point_history()
+        readings = {
+            property_id: sample_mean(reading_history[property_id], times) for
+            property_id in property_ids
+        }
+        set_points = {
+            property_id: sample_mean(set_point_history[property_id], times)
+            for property_id in property_ids
+        }
+        state_history = self.get_state_history(actuators)
+        recorded_values = {
+            actuator.pk: sample(state_history[actuator.pk], times) for
+            actuator in actuators
+        }
+
+        offsets = dict.fromkeys(property_ids, 0)
+        simulated_on_time = dict.fromkeys(effects.keys(), 0)
+        recorded_on_time = dict.fromkeys(effects.keys(), 0)
+        simulated_in_range = dict.fromkeys(property_ids, 0)
+        recorded_in_range = dict.fromkeys(property_ids, 0)
+        controlled_time = dict.fromkeys(property_ids, 0)
+        for i, timestamp in enumerate(times):
+            duration = min(self.step, self.end - timestamp)
+            current_set_points = {}
+            current_readings = {}
+            for property_id in property_ids:
+                set_point = set_points[property_id][i]
+                reading = readings[property_id][i]
+                current_set_points[property_id] = set_point
+                if reading is not None:
+                    reading += offsets[property_id]
+                current_readings[property_id] = reading
+                if set_point is None or reading is None:
+                    continue
+                deadband = deadbands[property_id]
+                controlled_time[property_id] += duration
+                if abs(reading - set_point) <= deadband:
+                    simulated_in_range[property_id] += duration
+                if abs(readings[property_id][i] - set_point) <= deadband:
+                    recorded_in_range[property_id] += duration
+            for actuator in actuators:
+                profile = profiles[actuator.pk]
+                actuator_effects = {
+                    property_id: {
+                        'effect_on_active': effect.effect_on_active,
+                        'threshold': effect.threshold,
+                    } for property_id, effect in
+                    effects[actuator.pk].items()
+                }
+                simulated = 0
+                if is_demanded(
+                        actuator_effects, current_set_points,
+                        current_readings):
+                    simulated = on_time(
+                        timestamp, timestamp + duration, profile.period,
+                        profile.pulse_width
+                    )
+                recorded_value = recorded_values[actuator.pk][i]
+                recorded = duration if recorded_value and \
+                    recorded_value > 0 else 0
+                simulated_on_time[actuator.pk] += simulated
+                recorded_on_time[actuator.pk] += recorded
+                for property_id, response in responses[actuator.pk].items():
+                    if property_id in offsets:
+                        offsets[property_id] += response * (
+                            simulated - recorded
+                        )
+
+        total_time = self.end - self.start
+        return {
+            'actuators': {
+                actuator.pk: {
+                    'control_profile': profiles[actuator.pk].pk,
+                    'duty_cycle': simulated_on_time[actuator.pk] / total_time,
+                    'recorded_duty_cycle':
+                        recorded_on_time[actuator.pk] / total_time,
+                } for actuator in actuators
+            },
+            'properties': {
+                property_id: {
+                    'controlled_time': controlled_time[property_id],
+                    'time_in_range': self.fraction(
+                        simulated_in_range[property_id],
+                        controlled_time[property_id]
+                    ),
+                    'recorded_time_in_range': self.fraction(
+                        recorded_in_range[property_id],
+                        controlled_time[property_id]
+                    ),
+                } for property_id in property_ids
+            },
+        }
+
+    @staticmethod
+    def fraction(part, total):
+        return part / total if total else None
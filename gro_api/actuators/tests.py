@@ -1,9 +1,13 @@
+from django.test import TestCase
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import Group
 from ..gro_api.test import APITestCase, run_with_any_layout
 from ..resources.models import ResourceType, ResourceProperty, ResourceEffect
-from .models import ActuatorType, ControlProfile, Actuator
+from .models import ActuatorType, ControlProfile, Actuator, ActuatorState
 from .serializers import ActuatorTypeSerializer, ActuatorSerializer
+from .control import effect_is_demanded, on_time, get_transitions
+from .simulation import sample
+from .usage import HOUR, get_usage, rollup_usage
 
 class ActuatorAuthMixin:
     @classmethod
@@ -97,6 +101,66 @@ class ActuatorTypeTestCase(ActuatorAuthMixin, APITestCase):
         self.assertEqual(res.status_code, 400)
 
 
+class ControlProfileTestCase(ActuatorAuthMixin, APITestCase):
+    @run_with_any_layout
+    def test_bulk_creation(self):
+        heater_id = ActuatorType.objects.get_by_natural_key(
+            'Relay-Controlled Air Heater'
+        ).pk
+        air_temp_id = ResourceProperty.objects.get_by_natural_key('A', 'TM').pk
+        air_temp_url = self.url_for_object('resourceProperty', air_temp_id)
+        heater_url = self.url_for_object('actuatorType', heater_id)
+        data = [{
+            'name': 'Slow Heater',
+            'actuator_type': heater_url,
+            'period': 60,
+            'pulse_width': 10,
+        }, {
+            'name': 'Fast Heater',
+            'actuator_type': heater_url,
+            'period': 10,
+            'pulse_width': 5,
+            'effects': [{
+                'property': air_temp_url,
+                'effect_on_active': 1,
+                'threshold': 0.5,
+            }],
+        }]
+        res = self.client.post(
+            self.url_for_object('controlProfile') + '?many=true', data=data
+        )
+        self.assertEqual(res.status_code, 201)
+        slow_profile, fast_profile = res.data
+        self.assertEqual(len(slow_profile['effects']), 1)
+        self.assertEqual(slow_profile['effects'][0]['threshold'], 0)
+        self.assertEqual(len(fast_profile['effects']), 1)
+        self.assertTrue(
+            fast_profile['effects'][0]['property'].endswith(air_temp_url)
+        )
+        self.assertEqual(fast_profile['effects'][0]['threshold'], 0.5)
+        # Effects on properties of other resource types are rejected
+        water_ec_id = ResourceProperty.objects.get_by_natural_key('W', 'EC').pk
+        data[0]['name'] = 'Other Heater'
+        data[1]['name'] = 'Bad Heater'
+        data[1]['effects'][0]['property'] = self.url_for_object(
+            'resourceProperty', water_ec_id
+        )
+        res = self.client.post(
+            self.url_for_object('controlProfile') + '?many=true', data=data
+        )
+        self.assertEqual(res.status_code, 400)
+        self.assertFalse(
+            ControlProfile.objects.filter(name='Other Heater').exists()
+        )
+        # Periods too short for any relay to follow are rejected
+        data = dict(data[0], name='Flickering Heater', period=0.001)
+        res = self.client.post(self.url_for_object('controlProfile'), data)
+        self.assertEqual(res.status_code, 400)
+        data['period'] = 0
+        res = self.client.post(self.url_for_object('controlProfile'), data)
+        self.assertEqual(res.status_code, 201)
+
+
 class ActuatorTestCase(ActuatorAuthMixin, APITestCase):
     @run_with_any_layout
     def test_visible_fields(self):
@@ -186,6 +250,181 @@ class ActuatorTestCase(ActuatorAuthMixin, APITestCase):
         res = self.client.put(actuator['url'], data=actuator_info)
         self.assertEqual(res.status_code, 400)
 
+    def create_heater(self):
+        """ Installs a heater in a new air resource in the enclosure """
+        air_id = ResourceType.objects.get_by_natural_key('A').pk
+        resource_info = {
+            'resource_type': self.url_for_object('resourceType', air_id),
+            'location': self.url_for_object('enclosure', 1)
+        }
+        res = self.client.post(
+            self.url_for_object('resource'), data=resource_info
+        )
+        self.assertEqual(res.status_code, 201)
+        heater_id = ActuatorType.objects.get_by_natural_key(
+            'Relay-Controlled Air Heater'
+        ).pk
+        control_profile_id = ControlProfile.objects.get_by_natural_key(
+            'Relay-Controlled Air Heater', 'Default Profile'
+        ).pk
+        actuator_info = {
+            'actuator_type': self.url_for_object('actuatorType', heater_id),
+            'control_profile': self.url_for_object(
+                'controlProfile', control_profile_id
+            ),
+            'resource': res.data['url'],
+        }
+        res = self.client.post(
+            self.url_for_object('actuator'), data=actuator_info
+        )
+        self.assertEqual(res.status_code, 201)
+        return res.data
+
+    @run_with_any_layout
+    def test_actuator_schedule(self):
+        actuator_url = self.create_heater()['url']
+        schedule_url = self.url_for_object('actuator') + 'schedule/'
+        res = self.client.get(schedule_url, {'horizon': 30})
+        self.assertEqual(res.status_code, 200)
+        # Nothing demands the heater, so it should stay off
+        self.assertEqual(res.data['actuators'][actuator_url], [[0, 0]])
+        res = self.client.get(schedule_url, {'horizon': -1})
+        self.assertEqual(res.status_code, 400)
+
+    @run_with_any_layout
+    def test_actuator_usage(self):
+        actuator_url = self.create_heater()['url']
+        actuator = Actuator.objects.get(pk=actuator_url.split('/')[-2])
+        # On for the first 15 minutes of every hour for 3 hours, then off
+        start = 1000 * HOUR
+        for hour in range(3):
+            hour_start = start + hour * HOUR
+            ActuatorState.objects.create(
+                actuator=actuator, timestamp=hour_start, value=1
+            )
+            ActuatorState.objects.create(
+                actuator=actuator, timestamp=hour_start + HOUR // 4, value=0
+            )
+        usage_url = self.url_for_object('actuator') + 'usage/'
+        res = self.client.get(
+            usage_url, {'start': start - HOUR, 'end': start + 3 * HOUR}
+        )
+        self.assertEqual(res.status_code, 200)
+        usage = res.data['actuators'][0]
+        self.assertEqual(usage['actuator'], actuator_url)
+        self.assertEqual(usage['covered_time'], 3 * HOUR)
+        self.assertEqual(usage['on_time'], 3 * HOUR // 4)
+        self.assertEqual(usage['duty_cycle'], 0.25)
+        # Rolled up hours should give the same answer as the raw history
+        expected = get_usage(start + HOUR // 2, start + 5 * HOUR)
+        self.assertTrue(rollup_usage(until=start + 4 * HOUR))
+        actual = get_usage(start + HOUR // 2, start + 5 * HOUR)
+        self.assertEqual(
+            actual[actuator.pk].to_json(), expected[actuator.pk].to_json()
+        )
+        res = self.client.get(usage_url, {'start': start, 'end': start})
+        self.assertEqual(res.status_code, 400)
+
+    @run_with_any_layout
+    def test_usage_rollup_cost(self):
+        from django.db import connection
+        actuator_url = self.create_heater()['url']
+        actuator = Actuator.objects.get(pk=actuator_url.split('/')[-2])
+        # On for the first 15 minutes of every hour for 2 days
+        start = 1000 * HOUR
+        ActuatorState.objects.bulk_create([
+            ActuatorState(
+                actuator=actuator, timestamp=start + hour * HOUR + offset,
+                value=value
+            ) for hour in range(48) for offset, value in (
+                (0, 1), (HOUR // 4, 0)
+            )
+        ])
+
+        def count_steps(until):
+            """
+            Returns the number of (batches of) virtual machine instructions
+            SQLite runs to roll up usage until `until`
+            """
+            steps = []
+            connection.connection.set_progress_handler(
+                lambda: steps.append(1), 100
+            )
+            try:
+                self.assertEqual(rollup_usage(until=until), 1)
+            finally:
+                connection.connection.set_progress_handler(None, 100)
+            return len(steps)
+
+        rollup_usage(until=start + 2 * HOUR)
+        early_steps = count_steps(start + 3 * HOUR)
+        rollup_usage(until=start + 46 * HOUR)
+        late_steps = count_steps(start + 47 * HOUR)
+        # Rolling up an hour doesn't rescan the history before it
+        self.assertLess(late_steps, early_steps * 1.5)
+        usage = get_usage(start + 46 * HOUR, start + 47 * HOUR)[actuator.pk]
+        self.assertEqual(usage.covered_time, HOUR)
+        self.assertEqual(usage.on_time, HOUR // 4)
+
+    @run_with_any_layout
+    def test_control_simulation(self):
+        actuator_url = self.create_heater()['url']
+        actuator = Actuator.objects.get(pk=actuator_url.split('/')[-2])
+        start = 1000 * HOUR
+        ActuatorState.objects.create(
+            actuator=actuator, timestamp=start - 10, value=1
+        )
+        ActuatorState.objects.create(
+            actuator=actuator, timestamp=start + HOUR // 2, value=0
+        )
+        simulate_url = self.url_for_object(
+            'controlProfile', actuator.control_profile_id
+        ) + 'simulate/'
+        res = self.client.get(simulate_url, {
+            'actuator': actuator.pk, 'start': start, 'end': start + HOUR
+        })
+        self.assertEqual(res.status_code, 200)
+        result = res.data['actuators'][actuator_url]
+        self.assertEqual(result['recorded_duty_cycle'], 0.5)
+        # Nothing demands the heater without set points or readings
+        self.assertEqual(result['duty_cycle'], 0)
+        res = self.client.get(simulate_url, {'start': start})
+        self.assertEqual(res.status_code, 400)
+
+
+class ControlLogicTestCase(TestCase):
+    def test_effect_is_demanded(self):
+        self.assertTrue(effect_is_demanded(1, 1, 20, 18))
+        self.assertFalse(effect_is_demanded(1, 1, 20, 19.5))
+        self.assertTrue(effect_is_demanded(-1, 1, 20, 22))
+        self.assertFalse(effect_is_demanded(-1, 1, 20, 18))
+        self.assertFalse(effect_is_demanded(1, 1, None, 18))
+
+    def test_transitions(self):
+        self.assertEqual(
+            get_transitions(100, 120, 10, 4, True),
+            [(100, 1), (104, 0), (110, 1), (114, 0)]
+        )
+        self.assertEqual(
+            get_transitions(100, 120, 10, 4, True, [(105, 108, 1)]),
+            [(100, 1), (104, 0), (105, 1), (108, 0), (110, 1), (114, 0)]
+        )
+        self.assertEqual(get_transitions(100, 120, 0, 0, True), [(100, 1)])
+        self.assertEqual(get_transitions(100, 120, 10, 4, False), [(100, 0)])
+
+    def test_on_time(self):
+        self.assertEqual(on_time(100, 120, 10, 4), 8)
+        self.assertEqual(on_time(102, 113, 10, 4), 5)
+        self.assertEqual(on_time(100, 120, 0, 0), 20)
+        self.assertEqual(on_time(100, 120, 10, 0), 0)
+
+    def test_sample(self):
+        points = [(10, 1), (20, 2), (20, 3), (30, 4)]
+        self.assertEqual(
+            sample(points, [0, 10, 15, 20, 35]), [None, 1, 1, 3, 4]
+        )
+
+
 class ActuatorStateTestCase(APITestCase):
     # TODO: Test state routes
     pass
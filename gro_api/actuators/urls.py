@@ -1,6 +1,6 @@
 from .views import (
     ActuatorTypeViewSet, ControlProfileViewSet, ActuatorEffectViewSet,
-    ActuatorViewSet, ActuatorStateViewSet
+    ActuatorViewSet, ActuatorStateViewSet, ActuatorUsageViewSet
 )
 
 def contribute_to_router(router):
@@ -9,3 +9,4 @@ def contribute_to_router(router):
     router.register(r'actuatorEffect', ActuatorEffectViewSet)
     router.register(r'actuator', ActuatorViewSet)
     router.register(r'actuatorState', ActuatorStateViewSet)
+    router.register(r'actuatorUsage', ActuatorUsageViewSet)
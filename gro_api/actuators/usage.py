@@ -0,0 +1,251 @@
+"""
+This module computes time-weighted actuator usage statistics from the
+:class:`~actuators.models.ActuatorState` history. Every state is taken to last
+until the next state recorded for the same actuator, so the statistics are
+computed in SQL by pairing each state with its successor (the equivalent of
+``LEAD(timestamp)`` over the states of an actuator ordered by time). Only the
+states in the window and the last state of every actuator before it are read,
+so the cost of a window doesn't grow with the history before it. Completed
+hours and days are rolled up into :class:`~actuators.models.ActuatorUsage`
+records so that long reports don't have to rescan the raw history.
+"""
+import time
+import logging
+from collections import defaultdict
+from django.db import connection
+from django.db.models import Max, Min, Sum
+from ..gro_api.utils import atomic
+from .models import Actuator, ActuatorState, ActuatorUsage
+
+logger = logging.getLogger(__name__)
+
+HOUR = 60 * 60
+DAY = 24 * HOUR
+
+USAGE_QUERY = """
+SELECT actuator_id, SUM(duration), SUM(duration * value),
+       SUM(CASE WHEN value > 0 THEN duration ELSE 0 END)
+FROM (
+    SELECT actuator_id, value,
+           (CASE WHEN next_timestamp IS NULL OR next_timestamp > %s
+                 THEN %s ELSE next_timestamp END) -
+           (CASE WHEN timestamp < %s
+                 THEN %s ELSE timestamp END) AS duration
+    FROM (
+        SELECT state.actuator_id, state.value, state.timestamp, (
+            SELECT next_state.timestamp FROM {table} next_state
+            WHERE next_state.actuator_id = state.actuator_id AND
+                  next_state.timestamp >= state.timestamp AND (
+                      next_state.timestamp > state.timestamp OR
+                      next_state.id > state.id
+                  )
+            ORDER BY next_state.timestamp LIMIT 1
+        ) AS next_timestamp
+        FROM {actuator_table} actuator CROSS JOIN {table} state
+        WHERE state.actuator_id = actuator.id AND
+              state.timestamp < %s AND state.timestamp >= COALESCE((
+                  SELECT MAX(carry_state.timestamp) FROM {table} carry_state
+                  WHERE carry_state.actuator_id = actuator.id AND
+                        carry_state.timestamp <= %s
+              ), %s) {actuator_filter}
+    ) paired_states
+    WHERE next_timestamp IS NULL OR next_timestamp > %s
+) clipped_states
+WHERE duration > 0
+GROUP BY actuator_id
+"""
+
+
+class Usage:
+    """
+    Usage statistics for a single actuator over some window of time.
+
+    :param float covered_time: The number of seconds in the window for which
+        the state of the actuator is known
+    :param float value_integral: The integral of the value of the actuator
+        over the covered time
+    :param float on_time: The number of seconds for which the actuator had a
+        positive value
+    """
+    def __init__(self, covered_time=0, value_integral=0, on_time=0):
+        self.covered_time = covered_time
+        self.value_integral = value_integral
+        self.on_time = on_time
+
+    def __add__(self, other):
+        return Usage(
+            self.covered_time + other.covered_time,
+            self.value_integral + other.value_integral,
+            self.on_time + other.on_time
+        )
+
+    @property
+    def average_value(self):
+        """ The time-weighted average value of the actuator """
+        if not self.covered_time:
+            return None
+        return self.value_integral / self.covered_time
+
+    @property
+    def duty_cycle(self):
+        """ The fraction of the covered time for which the actuator was on """
+        if not self.covered_time:
+            return None
+        return self.on_time / self.covered_time
+
+    def to_json(self):
+        return {
+            'covered_time': self.covered_time,
+            'on_time': self.on_time,
+            'average_value': self.average_value,
+            'duty_cycle': self.duty_cycle,
+        }
+
+
+def get_raw_usage(start, end, actuator_ids=None):
+    """
+    Computes the usage of the actuators with ids in `actuator_ids` (defaults
+    to all actuators) over ``[start, end)`` directly from the state history.
+    Returns a dictionary mapping actuator ids to :class:`Usage` instances.
+    Actuators for which no state is known in the window are left out.
+    """
+    end = min(end, time.time())
+    if start >= end:
+        return {}
+    actuator_filter = ''
+    actuator_params = []
+    if actuator_ids is not None:
+        actuator_params = list(actuator_ids)
+        if not actuator_params:
+            return {}
+        actuator_filter = 'AND actuator.id IN ({})'.format(
+            ', '.join(['%s'] * len(actuator_params))
+        )
+    # The parameters in the order in which they appear in the query
+    params = [end, end, start, start, end, start, start] + \
+        actuator_params + [start]
+    query = USAGE_QUERY.format(
+        table=connection.ops.quote_name(ActuatorState._meta.db_table),
+        actuator_table=connection.ops.quote_name(Actuator._meta.db_table),
+        actuator_filter=actuator_filter
+    )
+    cursor = connection.cursor()
+    try:
+        cursor.execute(query, params)
+        rows = cursor.fetchall()
+    finally:
+        cursor.close()
+    return {
+        actuator_id: Usage(covered_time, value_integral, on_time) for
+        actuator_id, covered_time, value_integral, on_time in rows
+    }
+
+
+def get_rolled_up_until():
+    """
+    Returns the time up to which hourly usage has been rolled up, or None if
+    nothing has been rolled up yet
+    """
+    last_hour = ActuatorUsage.objects.filter(duration=HOUR).aggregate(
+        last=Max('start_timestamp')
+    )['last']
+    return None if last_hour is None else last_hour + HOUR
+
+
+def get_usage(start, end, actuator_ids=None):
+    """
+    Computes the usage of the actuators with ids in `actuator_ids` (defaults
+    to all actuators) over ``[start, end)``. Whole hours that have already been
+    rolled up are read from :class:`~actuators.models.ActuatorUsage` and only
+    the remaining edges of the window are computed from the state history.
+    """
+    res = defaultdict(Usage)
+    rolled_up_until = get_rolled_up_until()
+    rolled_start = start + (-start % HOUR)
+    rolled_end = min(end - end % HOUR, rolled_up_until or rolled_start)
+    if rolled_start >= rolled_end:
+        windows = [(start, end)]
+    else:
+        windows = [(start, rolled_start), (rolled_end, end)]
+        records = ActuatorUsage.objects.filter(
+            duration=HOUR, start_timestamp__gte=rolled_start,
+            start_timestamp__lt=rolled_end
+        )
+        if actuator_ids is not None:
+            records = records.filter(actuator_id__in=actuator_ids)
+        totals = records.values('actuator_id').annotate(
+            covered_time=Sum('covered_time'),
+            value_integral=Sum('value_integral'), on_time=Sum('on_time')
+        )
+        for row in totals:
+            res[row['actuator_id']] += Usage(
+                row['covered_time'], row['value_integral'], row['on_time']
+            )
+    for window_start, window_end in windows:
+        raw_usage = get_raw_usage(window_start, window_end, actuator_ids)
+        for actuator_id, usage in raw_usage.items():
+            res[actuator_id] += usage
+    return dict(res)
+
+
+def rollup_usage(until=None):
+    """
+    Rolls up the usage of every actuator for every complete hour and day
+    before `until` (defaults to the current time) that has not been rolled up
+    yet. Returns the number of records created.
+    """
+    if until is None:
+        until = time.time()
+    until = int(until - until % HOUR)
+    start = get_rolled_up_until()
+    if start is None:
+        first_state = ActuatorState.objects.aggregate(
+            first=Min('timestamp')
+        )['first']
+        if first_state is None:
+            return 0
+        start = first_state - first_state % HOUR
+    records = []
+    with atomic():
+        for hour_start in range(start, until, HOUR):
+            hour_usage = get_raw_usage(hour_start, hour_start + HOUR)
+            for actuator_id, usage in hour_usage.items():
+                records.append(ActuatorUsage(
+                    actuator_id=actuator_id, start_timestamp=hour_start,
+                    duration=HOUR, covered_time=usage.covered_time,
+                    value_integral=usage.value_integral,
+                    on_time=usage.on_time
+                ))
+            hour_end = hour_start + HOUR
+            if hour_end % DAY == 0:
+                records.extend(rollup_day(hour_end - DAY, records))
+        ActuatorUsage.objects.bulk_create(records)
+    logger.debug('Created %d actuator usage records', len(records))
+    return len(records)
+
+
+def rollup_day(day_start, pending_records):
+    """
+    Returns the daily :class:`~actuators.models.ActuatorUsage` records for the
+    day starting at `day_start`, computed from the hourly records for that day
+    that are either already saved or in `pending_records`
+    """
+    day_end = day_start + DAY
+    totals = defaultdict(Usage)
+    saved_records = ActuatorUsage.objects.filter(
+        duration=HOUR, start_timestamp__gte=day_start,
+        start_timestamp__lt=day_end
+    )
+    for record in list(saved_records) + pending_records:
+        if record.duration == HOUR and \
+                day_start <= record.start_timestamp < day_end:
+            totals[record.actuator_id] += Usage(
+                record.covered_time, record.value_integral, record.on_time
+            )
+    return [
+        ActuatorUsage(
+            actuator_id=actuator_id, start_timestamp=day_start, duration=DAY,
+            covered_time=usage.covered_time,
+            value_integral=usage.value_integral, on_time=usage.on_time
+        ) for actuator_id, usage in totals.items()
+    ]
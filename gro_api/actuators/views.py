@@ -1,20 +1,34 @@
 import time
 import django_filters
+from collections import defaultdict
+from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
+from rest_framework import status
+from rest_framework.reverse import reverse
 from rest_framework.response import Response
-from rest_framework.viewsets import ModelViewSet
-from rest_framework.decorators import detail_route
-from rest_framework.exceptions import APIException
+from rest_framework.viewsets import ModelViewSet, ReadOnlyModelViewSet
+from rest_framework.decorators import detail_route, list_route
+from rest_framework.exceptions import (
+    APIException, NotFound, ValidationError
+)
 from rest_framework.permissions import DjangoModelPermissionsOrAnonReadOnly
+from rest_framework.utils.field_mapping import get_detail_view_name
 from ..gro_api.permissions import EnforceReadOnly
 from ..gro_api.filters import HistoryFilterMixin
+from ..resources.models import ResourceProperty, Resource
+from ..resources.frames import ControlFrame
+from ..recipes.models import ActuatorOverride
 from .models import (
-    ActuatorType, ControlProfile, ActuatorEffect, Actuator, ActuatorState
+    ActuatorType, ControlProfile, ActuatorEffect, Actuator, ActuatorState,
+    ActuatorUsage
 )
 from .serializers import (
     ActuatorTypeSerializer, ControlProfileSerializer, ActuatorEffectSerializer,
-    ActuatorSerializer, ActuatorStateSerializer
+    ActuatorSerializer, ActuatorStateSerializer, ActuatorUsageSerializer
 )
+from .control import get_schedule
+from .usage import get_usage
+from .simulation import Simulation, SimulationError
 
 
 class ActuatorTypeViewSet(ModelViewSet):
@@ -25,11 +39,93 @@ class ActuatorTypeViewSet(ModelViewSet):
 
 
 class ControlProfileViewSet(ModelViewSet):
-    """ A profile that holds the control settings for an actuator """
+    """
+    A profile that holds the control settings for an actuator. Pass `many` in
+    the query string to create a list of profiles at once. The `effects` of a
+    new profile default to no effect on every property affected by its
+    actuator type, and can be set by listing them with the profile.
+    """
     queryset = ControlProfile.objects.all()
     serializer_class = ControlProfileSerializer
     permission_classes = [EnforceReadOnly, DjangoModelPermissionsOrAnonReadOnly]
 
+    def create(self, request, *args, **kwargs):
+        many = request.query_params.get('many', False)
+        serializer = self.get_serializer(data=request.data, many=many)
+        serializer.is_valid(raise_exception=True)
+        self.perform_create(serializer)
+        headers = self.get_success_headers(serializer.data)
+        return Response(
+            serializer.data, status=status.HTTP_201_CREATED, headers=headers
+        )
+
+    @detail_route(methods=["get"])
+    def simulate(self, request, pk=None):
+        """
+        Replay the recorded history of the resource containing `actuator`
+        between `start` and `end` (defaults to the last 24 hours) with the
+        actuator running this profile, making a control decision every `step`
+        seconds (defaults to 10). Reports the simulated and recorded duty
+        cycle of every actuator in the resource and the fraction of the time
+        every controlled property stayed within its deadband. Simulations read
+        the local database and are only available on leaf servers.
+        """
+        if settings.SERVER_TYPE != settings.LEAF:
+            raise NotFound('Simulations can only be run on leaf servers')
+        instance = self.get_object()
+        try:
+            actuator_id = int(request.query_params['actuator'])
+            end = float(request.query_params.get('end', time.time()))
+            start = float(request.query_params.get('start', end - 24*60*60))
+            step = float(request.query_params.get('step', 10))
+        except KeyError:
+            raise ValidationError('`actuator` is required')
+        except ValueError:
+            raise ValidationError(
+                '`actuator` must be an actuator id and `start`, `end` and '
+                '`step` must be numbers'
+            )
+        try:
+            actuator = Actuator.objects.select_related('resource').get(
+                pk=actuator_id
+            )
+        except ObjectDoesNotExist:
+            raise ValidationError('No actuator with id {}'.format(actuator_id))
+        if actuator.actuator_type_id != instance.actuator_type_id:
+            raise ValidationError(
+                'Selected control profile does not work for the selected '
+                'actuator type.'
+            )
+        try:
+            results = Simulation(
+                actuator.resource, start, end, step,
+                control_profiles={actuator.pk: instance}
+            ).run()
+        except SimulationError as e:
+            raise ValidationError(str(e))
+        property_codes = ResourceProperty.objects.get_codes()
+        def url_for(model, pk):
+            return reverse(
+                get_detail_view_name(model), kwargs={'pk': pk},
+                request=request
+            )
+        return Response({
+            'start': start,
+            'end': end,
+            'step': step,
+            'actuators': {
+                url_for(Actuator, actuator_id): dict(
+                    result, control_profile=url_for(
+                        ControlProfile, result['control_profile']
+                    )
+                ) for actuator_id, result in results['actuators'].items()
+            },
+            'properties': {
+                property_codes[property_id]: result for property_id, result
+                in results['properties'].items()
+            },
+        })
+
 
 class ActuatorEffectViewSet(ModelViewSet):
     """
@@ -66,6 +162,114 @@ class ActuatorViewSet(ModelViewSet):
         serializer = self.get_serializer(queryset, many=True)
         return Response(serializer.data)
 
+    #: The longest schedule (in seconds) that can be requested at once
+    max_schedule_horizon = 3600
+
+    @list_route(methods=["get"])
+    def schedule(self, request):
+        """
+        Get the on/off transitions of a set of actuators for the next `horizon`
+        seconds (defaults to 60). Pass one or more `actuator` ids to select the
+        actuators (defaults to all of them). Transitions combine the duty
+        cycle of each actuator's control profile, whether its effects are
+        demanded by the current set points and readings, and any overrides.
+        Each actuator maps to a list of `[offset, value]` pairs, where
+        `offset` is the number of seconds after `start` at which the actuator
+        should be switched to `value`.
+        """
+        try:
+            horizon = float(request.query_params.get('horizon', 60))
+            actuator_ids = [
+                int(pk) for pk in request.query_params.getlist('actuator')
+            ]
+        except ValueError:
+            raise ValidationError(
+                '`horizon` must be a number of seconds and `actuator` must be '
+                'an actuator id'
+            )
+        if not 0 < horizon <= self.max_schedule_horizon:
+            raise ValidationError(
+                '`horizon` must be positive and at most {} seconds'.format(
+                    self.max_schedule_horizon
+                )
+            )
+        actuators = self.get_queryset()
+        if actuator_ids:
+            actuators = actuators.filter(pk__in=actuator_ids)
+        actuator_ids = list(actuators.values_list('pk', flat=True))
+        start = int(time.time())
+        end = start + horizon
+        frame = ControlFrame(
+            Resource.objects.filter(actuators__in=actuator_ids).distinct(),
+            request=request
+        )
+        overrides = defaultdict(list)
+        for override in ActuatorOverride.objects.filter(
+                actuator_id__in=actuator_ids, start_timestamp__lt=end,
+                end_timestamp__gt=start):
+            url = frame.url_for(Actuator, override.actuator_id)
+            overrides[url].append((
+                override.start_timestamp, override.end_timestamp,
+                override.value
+            ))
+        schedule = get_schedule(
+            frame.get_data(start), overrides, start, horizon
+        )
+        selected_urls = set(
+            frame.url_for(Actuator, pk) for pk in actuator_ids
+        )
+        return Response({
+            'start': start,
+            'horizon': horizon,
+            'actuators': {
+                url: transitions for url, transitions in schedule.items() if
+                url in selected_urls
+            }
+        })
+
+    @list_route(methods=["get"])
+    def usage(self, request):
+        """
+        Get the time-weighted usage of a set of actuators between `start` and
+        `end` (defaults to the last 24 hours). Pass one or more `actuator` ids
+        to select the actuators (defaults to all of them). Each actuator's
+        state is assumed to hold until its next recorded state. For every
+        actuator, `covered_time` is the number of seconds in the window for
+        which its state is known, `on_time` is the number of seconds for which
+        its value was positive, `duty_cycle` is the ratio of the two and
+        `average_value` is its time-weighted average value.
+        """
+        try:
+            end = float(request.query_params.get('end', time.time()))
+            start = float(request.query_params.get('start', end - 24*60*60))
+            actuator_ids = [
+                int(pk) for pk in request.query_params.getlist('actuator')
+            ]
+        except ValueError:
+            raise ValidationError(
+                '`start` and `end` must be timestamps and `actuator` must be '
+                'an actuator id'
+            )
+        if start >= end:
+            raise ValidationError('`start` must be before `end`')
+        actuators = self.get_queryset()
+        if actuator_ids:
+            actuators = actuators.filter(pk__in=actuator_ids)
+        actuator_ids = list(actuators.values_list('pk', flat=True))
+        usage = get_usage(start, end, actuator_ids)
+        return Response({
+            'start': start,
+            'end': end,
+            'actuators': [
+                dict(
+                    usage[pk].to_json(), actuator=reverse(
+                        get_detail_view_name(Actuator), kwargs={'pk': pk},
+                        request=request
+                    )
+                ) for pk in actuator_ids if pk in usage
+            ]
+        })
+
     # TODO: Remove this once frontend switches to new override endpoint
     @detail_route(methods=["post"])
     def override(self, request, pk=None):
@@ -133,3 +337,27 @@ class ActuatorStateViewSet(ModelViewSet):
             ])
         else:
             serializer.save()
+
+
+class ActuatorUsageFilter(django_filters.FilterSet):
+    min_time = django_filters.NumberFilter(
+        name='start_timestamp', lookup_type='gte'
+    )
+    max_time = django_filters.NumberFilter(
+        name='start_timestamp', lookup_type='lte'
+    )
+
+    class Meta:
+        model = ActuatorUsage
+        fields = ['actuator', 'duration', 'min_time', 'max_time']
+
+
+class ActuatorUsageViewSet(ReadOnlyModelViewSet):
+    """
+    The usage of an actuator over a completed hour (`duration` = 3600) or day
+    (`duration` = 86400). These records are rolled up periodically from the
+    state history of the actuator.
+    """
+    queryset = ActuatorUsage.objects.all()
+    serializer_class = ActuatorUsageSerializer
+    filter_class = ActuatorUsageFilter
@@ -11,3 +11,7 @@ class Command(BaseCommand):
         caches['default'].delete(Enclosure.get_cache_key())
         from gro_api.gro_api.utils import system_layout
         system_layout.clear_cache()
+        from gro_api.resources.catalog import catalog_cache
+        catalog_cache.invalidate()
+        from gro_api.layout.tree import invalidate_cache
+        invalidate_cache()
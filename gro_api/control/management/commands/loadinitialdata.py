@@ -7,6 +7,12 @@ class Command(BaseCommand):
         self.apps_loaded = {}
         for app_config in apps.get_app_configs():
             self.load_app_data(app_config)
+        # Fixtures don't invalidate the caches of other processes object by
+        # object, so do it once for all of them
+        from gro_api.resources.catalog import catalog_cache
+        catalog_cache.invalidate()
+        from gro_api.layout.tree import invalidate_cache
+        invalidate_cache()
 
     def load_app_data(self, app_config):
         if self.apps_loaded.get(app_config.label, False):
@@ -2,6 +2,7 @@ from slugify import slugify
 from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.contrib.auth import get_user_model
+from ..gro_api.utils import system_layout, get_layout_cache
 from ..gro_api.test import (
     APITestCase, run_with_layouts, run_with_any_layout
 )
@@ -87,6 +88,13 @@ class FarmLayoutTestCase(FarmAuthMixin, APITestCase):
         self.assertEqual(res.data['layout'], None)
         res = self.client.put(farm_url, farm_info)
         self.assertEqual(res.status_code, 200)
+        # The layout is remembered by this process once it is set
+        self.assertEqual(system_layout.current_value, 'tray')
+        self.assertEqual(system_layout.local_value, 'tray')
+        get_layout_cache().delete(system_layout.cache_key)
+        self.assertEqual(system_layout.current_value, 'tray')
+        system_layout.clear_cache()
+        self.assertEqual(system_layout.local_value, None)
         # We shouldn't be able to change the layout
         farm_info['layout'] = 'bay'
         res = self.client.put(farm_url, farm_info)
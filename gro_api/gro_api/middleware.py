@@ -10,7 +10,7 @@ from django.core.cache.backends.locmem import LocMemCache
 from rest_framework.views import APIView
 from rest_framework.exceptions import APIException
 from rest_framework.permissions import AllowAny
-from .utils import system_layout
+from .utils import system_layout, bump_pending_stamps
 
 _request_cache = {}
 
@@ -38,6 +38,17 @@ class RequestCacheMiddleware:
             _request_cache[currentThread()].clear()
 
 
+class VersionStampMiddleware:
+    """
+    Bumps the version stamps that were bumped inside of an atomic block while
+    handling the request again, now that the block has committed or rolled
+    back
+    """
+    def process_response(self, request, response):
+        bump_pending_stamps()
+        return response
+
+
 class FarmRoutingMiddleware:
     """
     Saves the name of the farm being accessed in the per-request cache during
@@ -43,8 +43,12 @@ class DynamicOptions(Options):
     def fields_map(self):
         return Options.fields_map.func(self)
 
-    def _populate_dynamic_directed_relation_graph(self):
-        dynamic_related_objects_graph = defaultdict(lambda: defaultdict(list))
+    def _populate_dynamic_directed_relation_graph(self, layout):
+        # The graph is built for a single layout at a time because the models
+        # that dynamic fields point to depend on the layout, so building it for
+        # the layout of the current farm only would leave it empty for the
+        # others
+        dynamic_related_objects_graph = defaultdict(list)
 
         all_models = self.apps.get_models(include_auto_created=True)
         all_dynamic_models = tuple(model for model in all_models if
@@ -60,21 +64,22 @@ class DynamicOptions(Options):
                 getattr(f, 'is_dynamic', False)
             )
             for f in fields_with_dynamic_relations:
-                for layout in system_layout.allowed_values:
-                    with system_layout.as_value(layout):
-                        if f.rel.to and not isinstance(f.rel.to, str):
-                            dynamic_related_objects_graph[f.rel.to._meta][layout].append(f)
+                with system_layout.as_value(layout):
+                    if f.rel.to and not isinstance(f.rel.to, str):
+                        dynamic_related_objects_graph[f.rel.to._meta].append(f)
         for model in all_dynamic_models:
-            model._meta.__dict__['_dynamic_relation_tree'] = \
-                dynamic_related_objects_graph[model._meta]
-        return self.__dict__['_dynamic_relation_tree']
+            model._meta.__dict__.setdefault('_dynamic_relation_tree', {})[
+                layout
+            ] = dynamic_related_objects_graph[model._meta]
+        return self.__dict__['_dynamic_relation_tree'][layout]
 
     @property
     def _dynamic_relation_tree(self):
-        if '_dynamic_relation_tree' not in self.__dict__:
-            self._populate_dynamic_directed_relation_graph()
-        dynamic_relation_tree = self.__dict__['_dynamic_relation_tree']
-        return dynamic_relation_tree[system_layout.current_value]
+        layout = system_layout.current_value
+        dynamic_relation_tree = self.__dict__.get('_dynamic_relation_tree', {})
+        if layout not in dynamic_relation_tree:
+            return self._populate_dynamic_directed_relation_graph(layout)
+        return dynamic_relation_tree[layout]
 
     @property
     def _relation_tree(self):
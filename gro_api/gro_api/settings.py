@@ -107,6 +107,7 @@ INSTALLED_APPS = GRO_API_APPS + FRAMEWORK_APPS
 WSGI_APPLICATION = 'gro_api.gro_api.wsgi.application'
 
 MIDDLEWARE_CLASSES = (
+    'gro_api.gro_api.middleware.VersionStampMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -228,6 +229,11 @@ if SERVER_TYPE == LEAF:
 else:
     raise NotImplementedError()
 
+# Version stamps for state cached in every worker process (see
+# gro_api.gro_api.utils.VersionStamp)
+
+VERSION_STAMP_ROOT = os.path.join(BASE_DIR, 'versions')
+
 # Logging
 
 LOGGING = {
@@ -333,6 +339,9 @@ REST_FRAMEWORK['TEST_REQUEST_DEFAULT_FORMAT'] = 'json'
 
 CRON_CLASSES = (
     'gro_api.farms.cron.UpdateFarmIp',
+    'gro_api.actuators.cron.RollupActuatorUsage',
+    'gro_api.recipes.cron.UpdateRecipeAdherence',
+    'gro_api.recipes.cron.CompactSetPoints',
 )
 
 # Sites
@@ -78,13 +78,16 @@ class TestSuite(unittest.TestSuite):
             self.unconfigured_tests.append(test)
 
     def run_test(self, test, result, debug):
+        # The previous class has to be torn down before the class of this test
+        # is set up, or this test would run inside of the transaction of the
+        # previous class
+        self._tearDownPreviousClass(test, result)
         self._handleClassSetUp(test, result)
+        result._previousTestClass = test.__class__
         if not debug:
             test(result)
         else:
             test.debug()
-        self._tearDownPreviousClass(test, result)
-        result._previousTestClass = test.__class__
 
     def run_unconfigured_tests(self, result, debug):
         result.stream.writeln('\nRunning tests on unconfigured farm')
@@ -93,6 +96,8 @@ class TestSuite(unittest.TestSuite):
                 break
             ClearCaches()()
             self.run_test(test, result, debug)
+        self._tearDownPreviousClass(None, result)
+        result._previousTestClass = None
         return result
 
     def run_configured_tests(self, layout, result, debug):
@@ -102,6 +107,8 @@ class TestSuite(unittest.TestSuite):
                 break
             ClearCaches()()
             self.run_test(test, result, debug)
+        self._tearDownPreviousClass(None, result)
+        result._previousTestClass = None
         return result
 
     def run(self, result, debug=False):
@@ -1,6 +1,8 @@
+import tempfile
 from .settings import *
 SETUP_WITH_LAYOUT = None
 LOGGING['handlers']['console']['level'] = 'WARNING'
 # We're going to be causing some 4xx's on purpose, and we don't want django to
 # complain every time
 LOGGING['loggers']['django.request']['level'] = 'ERROR'
+VERSION_STAMP_ROOT = os.path.join(tempfile.gettempdir(), 'gro_api_versions')
@@ -0,0 +1,113 @@
+import copy
+from django.test import TestCase, TransactionTestCase
+from .utils import (
+    system_layout, LayoutValues, get_layout_values, LayoutDependentAttribute,
+    LayoutDependentCachedProperty, VersionStamp, atomic
+)
+
+
+class LayoutDependentObject:
+    value = LayoutDependentAttribute('value')
+    items = LayoutDependentAttribute('items', default=list)
+
+    def __init__(self):
+        self.num_computations = 0
+
+    @LayoutDependentCachedProperty
+    def computed(self):
+        self.num_computations += 1
+        return 'computed for {}'.format(system_layout.current_value)
+
+
+class LayoutDescriptorTestCase(TestCase):
+    def test_values_per_layout(self):
+        obj = LayoutDependentObject()
+        with system_layout.as_value('aisle'):
+            obj.value = 1
+        with system_layout.as_value('tray'):
+            obj.value = 2
+        with system_layout.as_value('aisle'):
+            self.assertEqual(obj.value, 1)
+        with system_layout.as_value('tray'):
+            self.assertEqual(obj.value, 2)
+
+    def test_missing_value(self):
+        obj = LayoutDependentObject()
+        with system_layout.as_value('aisle'):
+            obj.value = 1
+        with system_layout.as_value('tray'):
+            with self.assertRaises(AttributeError):
+                obj.value
+            self.assertFalse(hasattr(obj, 'value'))
+
+    def test_default(self):
+        obj = LayoutDependentObject()
+        with system_layout.as_value('aisle'):
+            obj.items.append(1)
+            self.assertEqual(obj.items, [1])
+        # Every layout gets its own default
+        with system_layout.as_value('tray'):
+            self.assertEqual(obj.items, [])
+
+    def test_get_layout_values(self):
+        obj = LayoutDependentObject()
+        values = get_layout_values(obj, '_layout_value')
+        self.assertIsInstance(values, LayoutValues)
+        self.assertEqual(values.owner, id(obj))
+        self.assertIs(get_layout_values(obj, '_layout_value'), values)
+        values['aisle'] = 1
+        # A copy of the object gets a copy of the values
+        other = copy.copy(obj)
+        other_values = get_layout_values(other, '_layout_value')
+        self.assertIsNot(other_values, values)
+        self.assertEqual(other_values.owner, id(other))
+        self.assertEqual(other_values, {'aisle': 1})
+
+    def test_copy(self):
+        obj = LayoutDependentObject()
+        with system_layout.as_value('aisle'):
+            obj.value = 1
+            other = copy.copy(obj)
+            self.assertEqual(other.value, 1)
+            other.value = 2
+            self.assertEqual(obj.value, 1)
+            self.assertEqual(other.value, 2)
+        with system_layout.as_value('tray'):
+            other.value = 3
+            with self.assertRaises(AttributeError):
+                obj.value
+
+    def test_cached_property(self):
+        obj = LayoutDependentObject()
+        with system_layout.as_value('aisle'):
+            self.assertEqual(obj.computed, 'computed for aisle')
+            self.assertEqual(obj.computed, 'computed for aisle')
+            self.assertEqual(obj.num_computations, 1)
+        with system_layout.as_value('tray'):
+            self.assertEqual(obj.computed, 'computed for tray')
+            self.assertEqual(obj.num_computations, 2)
+        with system_layout.as_value('aisle'):
+            self.assertEqual(obj.computed, 'computed for aisle')
+            self.assertEqual(obj.num_computations, 2)
+            with self.assertRaises(NotImplementedError):
+                obj.computed = 'changed'
+
+
+class VersionStampTestCase(TransactionTestCase):
+    # Only touches version stamps, so no tables have to be flushed
+    available_apps = ['django.contrib.staticfiles']
+
+    def test_bump_in_atomic_block(self):
+        # Runs outside of a request, like a cron job or a management command
+        stamp = VersionStamp('test')
+        with atomic():
+            with atomic():
+                stamp.bump()
+            version = stamp.current_value
+            self.assertIsNotNone(version)
+            self.assertIn(stamp, VersionStamp.pending)
+        self.assertNotIn(stamp, VersionStamp.pending)
+        self.assertNotEqual(stamp.current_value, version)
+        # Outside of an atomic block, stamps are only bumped once
+        stamp.bump()
+        self.assertNotIn(stamp, VersionStamp.pending)
@@ -1,4 +1,7 @@
+import os
+import binascii
 from contextlib import contextmanager
+from django.db import transaction
 from django.db.utils import OperationalError
 from django.conf import settings
 from django.utils.functional import cached_property
@@ -12,6 +15,91 @@ else:
     get_layout_cache = get_request_cache
 
 
+class VersionStamp:
+    """
+    A version number for some shared state that every process serving this
+    farm can check cheaply. The stamp is a file in
+    :setting:`VERSION_STAMP_ROOT` holding a random token that is overwritten
+    whenever the state changes, so a process can tell that its copy of the
+    state is stale by comparing the token with the one it saw when it built
+    that copy. This works across uWSGI workers, which don't share the local
+    memory cache. Tokens always have the same length and are overwritten in
+    place, because replacing a file forces a flush to disk on some file
+    systems. A process that reads a token while it is being written only sees
+    a value that differs from both the old and the new token, so it reloads
+    its copy one more time than it has to.
+
+    Changes made inside of a transaction are invisible to other processes
+    until it commits, so another process could rebuild its copy from the old
+    state in between a bump and the commit and keep it. Stamps bumped inside
+    of an atomic block are therefore bumped again by
+    :func:`bump_pending_stamps` once the block is over, which :func:`atomic`
+    and :class:`~gro_api.middleware.VersionStampMiddleware` take care of.
+
+    :param str name: The name of the shared state
+    """
+    #: Stamps bumped inside of an atomic block
+    pending = set()
+
+    def __init__(self, name):
+        self.name = name
+
+    @property
+    def path(self):
+        return os.path.join(settings.VERSION_STAMP_ROOT, self.name)
+
+    @property
+    def current_value(self):
+        """
+        An opaque value that changes every time :meth:`bump` is called, or
+        None if it has never been called
+        """
+        try:
+            with open(self.path) as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def bump(self):
+        """
+        Marks the shared state as changed. Inside of an atomic block, the
+        stamp is also marked to be bumped again by :func:`bump_pending_stamps`.
+        """
+        if transaction.get_connection().in_atomic_block:
+            VersionStamp.pending.add(self)
+        os.makedirs(settings.VERSION_STAMP_ROOT, exist_ok=True)
+        fd = os.open(self.path, os.O_WRONLY | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, binascii.hexlify(os.urandom(8)))
+        finally:
+            os.close(fd)
+
+
+def bump_pending_stamps():
+    """
+    Bumps the stamps that were bumped inside of an atomic block again, unless
+    this is still called inside of one
+    """
+    if transaction.get_connection().in_atomic_block:
+        return
+    while VersionStamp.pending:
+        VersionStamp.pending.pop().bump()
+
+
+@contextmanager
+def atomic():
+    """
+    Works like :func:`django.db.transaction.atomic`, but bumps the pending
+    version stamps once the outermost block is over. Code that may run outside
+    of a request (e.g. in cron jobs) should open its atomic blocks with this.
+    """
+    try:
+        with transaction.atomic():
+            yield
+    finally:
+        bump_pending_stamps()
+
+
 class Singleton(type):
     def __init__(cls, name, bases, attrs):
         super().__init__(name, bases, attrs)
@@ -36,27 +124,39 @@ class SystemLayout(metaclass=Singleton):
         if hasattr(settings, 'SETUP_WITH_LAYOUT'):
             self.use_mock_value = True
             self.mock_value = settings.SETUP_WITH_LAYOUT
+        # The layout of a leaf farm can't be changed once it is set, and
+        # setting it reloads every worker, so once this process has seen it,
+        # it never has to read it again
+        self.local_value = None
 
     @property
     def current_value(self):
         if self.use_mock_value:
             return self.mock_value
+        if self.local_value is not None:
+            return self.local_value
         cache = get_layout_cache()
         if self.cache_key in cache:
-            return cache.get(self.cache_key)
-        from ..farms.models import Farm
-        try:
-            val = Farm.get_solo().layout
+            val = cache.get(self.cache_key)
+        else:
+            from ..farms.models import Farm
+            try:
+                val = Farm.get_solo().layout
+            except OperationalError:
+                return None
             cache.set(self.cache_key, val)
-            return val
-        except OperationalError:
-            return None
+        if settings.SERVER_TYPE == settings.LEAF:
+            # Root servers serve many farms, so their layout is only ever
+            # cached for the current request
+            self.local_value = val
+        return val
 
     def clear_cache(self):
         assert settings.SERVER_TYPE == settings.LEAF, (
             'The layout cache only ever needs to be cached on leaf servers '
             'when the server is reconfigured with a new layout'
         )
+        self.local_value = None
         get_layout_cache().delete(self.cache_key)
 
     @property
@@ -82,6 +182,29 @@ class SystemLayout(metaclass=Singleton):
 system_layout = SystemLayout()
 
 
+class LayoutValues(dict):
+    """
+    Maps farm layouts to the values of a layout-dependent descriptor on a
+    single instance. Instances can be shallow copied (Django copies model
+    fields, for example), so the values remember which instance they belong to
+    and copies start with a copy of the values of the original.
+    """
+    __slots__ = ('owner',)
+
+
+def get_layout_values(instance, attname):
+    """
+    Returns the :class:`LayoutValues` stored on `instance` under `attname`,
+    creating them if they don't exist yet
+    """
+    values = instance.__dict__.get(attname)
+    if values is None or values.owner != id(instance):
+        values = LayoutValues(values or ())
+        values.owner = id(instance)
+        instance.__dict__[attname] = values
+    return values
+
+
 class LayoutDependentAttribute:
     """
     A descriptor that behaves like an attribute but stores a different value
@@ -93,24 +216,30 @@ class LayoutDependentAttribute:
         # can't give the argument a default value, and we have to use a general
         # dict
         self.name = name
+        self.attname = '_layout_{}'.format(name)
+        self.default = None
         if 'default' in kwargs:
             default = kwargs.pop('default')
             self.default = default if callable(default) else lambda: default
         assert len(kwargs) == 0
 
-    @property
-    def internal_name(self):
-        return "_{}_{}".format(system_layout.current_value, self.name)
-
     def __get__(self, instance, instance_type=None):
         if instance is None:
             return self
-        if not hasattr(instance, self.internal_name):
-            setattr(instance, self.internal_name, self.default())
-        return getattr(instance, self.internal_name)
+        values = get_layout_values(instance, self.attname)
+        layout = system_layout.current_value
+        try:
+            return values[layout]
+        except KeyError:
+            if self.default is None:
+                raise AttributeError(self.name)
+            value = values[layout] = self.default()
+            return value
 
     def __set__(self, instance, value):
-        setattr(instance, self.internal_name, value)
+        get_layout_values(instance, self.attname)[
+            system_layout.current_value
+        ] = value
 
 
 class LayoutDependentCachedProperty:
@@ -121,19 +250,20 @@ class LayoutDependentCachedProperty:
     """
     def __init__(self, func):
         self.name = func.__name__
+        self.attname = '_layout_{}'.format(self.name)
         self.func = func
         self.__doc__ = getattr(func, '__doc__')
 
-    @property
-    def internal_name(self):
-        return "_{}_{}".format(system_layout.current_value, self.name)
-
     def __get__(self, instance, instance_type=None):
         if instance is None:
             return self
-        if not hasattr(instance, self.internal_name):
-            setattr(instance, self.internal_name, self.func(instance))
-        return getattr(instance, self.internal_name)
+        values = get_layout_values(instance, self.attname)
+        layout = system_layout.current_value
+        try:
+            return values[layout]
+        except KeyError:
+            value = values[layout] = self.func(instance)
+            return value
 
     def __set__(self, instance, value):
         # We define this function only so that instances of this class will be
@@ -1,9 +1,10 @@
 import time
 from django.db import models
 from django.db.utils import OperationalError
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.core.exceptions import ObjectDoesNotExist
 from django.contrib.contenttypes.fields import GenericRelation
+from django.contrib.contenttypes.models import ContentType
 from django.dispatch import receiver
 from ..gro_api.utils import system_layout
 from ..gro_api.fields import LayoutForeignKey
@@ -185,3 +186,60 @@ for layout in system_layout.allowed_values:
         if entity.name not in dynamic_models:
             model = generate_model_from_entity(entity)
             dynamic_models[entity.name] = model
+
+
+def get_layout_model(entity_name):
+    """ Returns the model class for the layout entity named `entity_name` """
+    if entity_name == 'Enclosure':
+        return Enclosure
+    if entity_name == 'Tray':
+        return Tray
+    return dynamic_models[entity_name]
+
+
+def get_tray_locations():
+    """
+    Returns a dictionary mapping the id of every :class:`Tray` in the farm to
+    the set of ``(content type id, object id)`` pairs identifying the tray
+    itself and every layout object above it. A resource serves a tray if the
+    resource's location is in this set. This runs one query per level of the
+    layout tree.
+    """
+    schema = all_schemata[system_layout.current_value]
+    parents = {}
+    for entity_name in schema.dynamic_entities:
+        model = dynamic_models[entity_name]
+        parents[entity_name] = dict(model.objects.values_list('pk', 'parent_id'))
+    content_type_ids = {
+        entity_name: ContentType.objects.get_for_model(
+            get_layout_model(entity_name)
+        ).pk for entity_name in schema.entities
+    }
+    res = {}
+    for tray_id, parent_id in Tray.objects.values_list('pk', 'parent_id'):
+        locations = {(content_type_ids['Tray'], tray_id)}
+        entity_name = schema.entities['Tray'].parent
+        obj_id = parent_id
+        while obj_id is not None:
+            locations.add((content_type_ids[entity_name], obj_id))
+            if entity_name == 'Enclosure':
+                break
+            obj_id = parents[entity_name].get(obj_id)
+            entity_name = schema.entities[entity_name].parent
+        res[tray_id] = locations
+    return res
+
+
+def invalidate_layout_tree(sender, raw=False, **kwargs):
+    from .tree import clear_cache, invalidate_cache
+    if raw:
+        # Objects are being loaded from a fixture. Other processes are told
+        # once all of the initial data has been loaded.
+        clear_cache()
+    else:
+        invalidate_cache()
+
+for model in [Model3D, Enclosure, Tray, PlantSite, Resource] + \
+        list(dynamic_models.values()):
+    post_save.connect(invalidate_layout_tree, sender=model)
+    post_delete.connect(invalidate_layout_tree, sender=model)
@@ -0,0 +1,77 @@
+"""
+This module describes the plant sites of tray layouts and trays as compact
+grids instead of one object per site.
+
+A grid is a list of strings, one per row, with one character per column:
+
+``.``
+    There is no plant site in the cell
+``o``
+    There is an empty plant site in the cell
+``x``
+    There is a plant in the plant site in the cell (only used for trays)
+
+so a 2x3 tray with plants in its first column looks like ``["xoo", "x.o"]``.
+Harvested plants are removed from their sites, so a site is occupied exactly
+when it has a plant.
+"""
+from collections import OrderedDict
+from .models import Tray
+
+NO_SITE = '.'
+EMPTY = 'o'
+OCCUPIED = 'x'
+
+
+def encode_grid(num_rows, num_cols, cells):
+    """
+    Returns the grid of a tray (layout) with `num_rows` rows and `num_cols`
+    columns, where `cells` maps ``(row, col)`` pairs to the character of the
+    cell. Cells outside of the grid are ignored.
+    """
+    return [
+        ''.join(cells.get((row, col), NO_SITE) for col in range(num_cols))
+        for row in range(num_rows)
+    ]
+
+
+def decode_grid(grid):
+    """
+    Returns a dictionary mapping the ``(row, col)`` pair of every plant site
+    in `grid` to whether there is a plant in it
+    """
+    return {
+        (row, col): cell == OCCUPIED for row, cells in enumerate(grid) for
+        col, cell in enumerate(cells) if cell != NO_SITE
+    }
+
+
+def get_layout_grid(tray_layout):
+    """ Returns the grid of the :class:`~layout.models.TrayLayout` """
+    return encode_grid(tray_layout.num_rows, tray_layout.num_cols, {
+        (site.row, site.col): EMPTY for site in tray_layout.plant_sites.all()
+    })
+
+
+def get_occupancy(tray_ids=None):
+    """
+    Returns an ordered dictionary mapping the ids of the trays in `tray_ids`
+    (defaults to all of them) to the grid of their plant sites. The sites of
+    every tray and the plants in them are read in a single query.
+    """
+    trays = Tray.objects.order_by('pk')
+    if tray_ids is not None:
+        trays = trays.filter(pk__in=tray_ids)
+    sizes = OrderedDict()
+    cells = {}
+    for tray_id, num_rows, num_cols, row, col, plant_id in trays.values_list(
+            'pk', 'num_rows', 'num_cols', 'plant_sites__row',
+            'plant_sites__col', 'plant_sites__plant'):
+        sizes[tray_id] = (num_rows, num_cols)
+        tray_cells = cells.setdefault(tray_id, {})
+        if row is not None:
+            tray_cells[(row, col)] = OCCUPIED if plant_id else EMPTY
+    return OrderedDict(
+        (tray_id, encode_grid(num_rows, num_cols, cells[tray_id])) for
+        tray_id, (num_rows, num_cols) in sizes.items()
+    )
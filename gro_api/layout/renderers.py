@@ -0,0 +1,20 @@
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from .tree import pack_scene
+
+
+class SceneRenderer(BaseRenderer):
+    """
+    Renders a scene graph in the binary format described in
+    :func:`layout.tree.pack_scene`. Errors are still rendered as JSON.
+    """
+    media_type = 'application/octet-stream'
+    format = 'bin'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        response = (renderer_context or {}).get('response')
+        if response is not None and response.exception:
+            response['Content-Type'] = JSONRenderer.media_type
+            return JSONRenderer().render(data)
+        return pack_scene(data)
@@ -20,17 +20,39 @@ a ``description`` attribute, which descriptes what the entity is, and a
 tree, respectively.
 
 For some examples of schema files, see the ``layout/schemata`` directory.
+
+Parsing and validating the schema files is slow, and every process imports
+this module, so validated schemata are compiled into a JSON file at
+:data:`COMPILED_SCHEMATA_PATH` (``schemata.json`` in the directory of this
+project, unless the ``GRO_API_COMPILED_SCHEMATA`` environment variable is
+set). The compiled file is only used if none of the schema files have changed
+since it was written.
 """
 
 import os
-import yaml
+import json
+import tempfile
 import voluptuous
 from slugify import slugify
 
 __all__ = [
-    'all_schemata', 'Entity', 'Schema', 'register_schema'
+    'all_schemata', 'Entity', 'Schema', 'register_schema', 'load_schemata'
 ]
 
+SCHEMATA_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# The compiled schemata are trusted as they are, so they are kept in the
+# directory of this project (like the version stamps) rather than in a shared
+# temporary directory that anyone could write to
+COMPILED_SCHEMATA_PATH = os.environ.get(
+    'GRO_API_COMPILED_SCHEMATA', os.path.join(
+        os.path.dirname(os.path.dirname(SCHEMATA_DIR)), 'schemata.json'
+    )
+)
+
+#: Incremented whenever the compiled representation of a schema changes
+COMPILED_SCHEMATA_VERSION = 1
+
 
 def to_slug(string):
     """
@@ -52,6 +74,16 @@ class Entity:
         all_attrs = self.schema(all_attrs)
         self.__dict__.update(all_attrs)
 
+    @classmethod
+    def from_compiled(cls, attrs):
+        """
+        Creates an entity from the attributes of an entity that has already
+        been validated, without validating them again
+        """
+        entity = cls.__new__(cls)
+        entity.__dict__.update(attrs)
+        return entity
+
 
 class Schema:
     schema = voluptuous.Schema({
@@ -91,6 +123,37 @@ class Schema:
             setattr(self, entity.name, entity)
         self.check()
 
+    def to_compiled(self):
+        """
+        Returns the attributes of this schema as a JSON-serializable
+        dictionary that :meth:`from_compiled` can load without validating
+        """
+        return {
+            'name': self.name,
+            'short_description': self.short_description,
+            'long_description': self.long_description,
+            'entities': [vars(entity) for entity in self.entities.values()],
+            'dynamic_entities': list(self.dynamic_entities),
+        }
+
+    @classmethod
+    def from_compiled(cls, attrs):
+        """ Creates a schema from the result of :meth:`to_compiled` """
+        schema = cls.__new__(cls)
+        schema.name = attrs['name']
+        schema.short_description = attrs['short_description']
+        schema.long_description = attrs['long_description']
+        schema.entities = {}
+        for entity_attrs in attrs['entities']:
+            entity = Entity.from_compiled(entity_attrs)
+            schema.entities[entity.name] = entity
+            setattr(schema, entity.name, entity)
+        schema.dynamic_entities = {
+            entity_name: schema.entities[entity_name] for entity_name in
+            attrs['dynamic_entities']
+        }
+        return schema
+
     def check(self):
         # A dictionary of all of the entities without children. It is
         # initialized to the full set of entities and should be emptied by the
@@ -140,13 +203,69 @@ def register_schema(schema):
         )
     all_schemata[schema.name] = schema
 
+
+def get_signature(file_paths):
+    """
+    Returns a value that changes whenever any of the files in `file_paths` is
+    modified, added or removed
+    """
+    signature = [COMPILED_SCHEMATA_VERSION]
+    for file_path in file_paths:
+        stat = os.stat(file_path)
+        signature.append([file_path, stat.st_mtime_ns, stat.st_size])
+    return signature
+
+
+def load_schemata(schemata_dir=SCHEMATA_DIR,
+                  compiled_path=COMPILED_SCHEMATA_PATH):
+    """
+    Returns a list of the schemata defined by the YAML files in
+    `schemata_dir`, reading them from the compiled schemata at `compiled_path`
+    if the files haven't changed since it was written and rewriting it
+    otherwise
+    """
+    file_paths = sorted(
+        os.path.join(schemata_dir, filename) for filename in
+        os.listdir(schemata_dir) if os.path.splitext(filename)[1] == '.yaml'
+    )
+    signature = get_signature(file_paths)
+    try:
+        with open(compiled_path, 'r') as compiled_file:
+            compiled = json.load(compiled_file)
+        if compiled['signature'] == signature:
+            return [
+                Schema.from_compiled(attrs) for attrs in compiled['schemata']
+            ]
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    # Only processes that compile the schemata need the YAML parser
+    import yaml
+    schemata = []
+    for file_path in file_paths:
+        with open(file_path, 'r') as schema_file:
+            schemata.append(Schema(yaml.load(schema_file)))
+    compiled = {
+        'signature': signature,
+        'schemata': [schema.to_compiled() for schema in schemata],
+    }
+    # Processes starting at the same time may all compile the schemata, so
+    # the compiled file is replaced atomically
+    try:
+        fd, temp_path = tempfile.mkstemp(
+            dir=os.path.dirname(compiled_path) or None
+        )
+        try:
+            with os.fdopen(fd, 'w') as temp_file:
+                json.dump(compiled, temp_file)
+            os.chmod(temp_path, 0o644)
+            os.replace(temp_path, compiled_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+    except OSError:
+        pass
+    return schemata
+
 # Load all of the schema files from this directory
-for filename in os.listdir(os.path.dirname(__file__)):
-    file_ext = os.path.splitext(filename)[1]
-    # Only process yaml files
-    if not file_ext == '.yaml':
-        continue
-    file_path = os.path.join(os.path.dirname(__file__), filename)
-    with open(file_path, 'r') as schema_file:
-        schema = yaml.load(schema_file)
-    register_schema(Schema(schema))
+for schema in load_schemata():
+    register_schema(schema)
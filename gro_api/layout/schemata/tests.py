@@ -1,6 +1,10 @@
+import os
+import json
+import shutil
+import tempfile
 from voluptuous import Invalid, SchemaError
 from django.test import TestCase
-from . import all_schemata, Entity, Schema, register_schema
+from . import all_schemata, Entity, Schema, register_schema, load_schemata
 
 
 class InvalidSchemaTestCase(TestCase):
@@ -103,3 +107,44 @@ class InvalidSchemaTestCase(TestCase):
         register_schema(schema1)
         with self.assertRaises(ValueError):
             register_schema(schema2)
+
+
+class CompiledSchemataTestCase(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.compiled_path = os.path.join(self.temp_dir, 'schemata.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_compiled_schemata(self):
+        schemata = load_schemata(compiled_path=self.compiled_path)
+        self.assertEqual(
+            sorted(schema.name for schema in schemata),
+            sorted(name for name in all_schemata if name != 'test')
+        )
+        compiled = [schema.to_compiled() for schema in schemata]
+        for schema in schemata:
+            self.assertEqual(
+                Schema.from_compiled(schema.to_compiled()).to_compiled(),
+                schema.to_compiled()
+            )
+            self.assertEqual(
+                schema.Tray.parent, all_schemata[schema.name].Tray.parent
+            )
+        # The compiled file is used as long as the schema files don't change
+        with open(self.compiled_path) as compiled_file:
+            data = json.load(compiled_file)
+        data['schemata'][0]['long_description'] = 'Compiled'
+        with open(self.compiled_path, 'w') as compiled_file:
+            json.dump(data, compiled_file)
+        schemata = load_schemata(compiled_path=self.compiled_path)
+        self.assertEqual(schemata[0].long_description, 'Compiled')
+        # Otherwise the schema files are compiled again
+        data['signature'][-1][1] -= 1
+        with open(self.compiled_path, 'w') as compiled_file:
+            json.dump(data, compiled_file)
+        schemata = load_schemata(compiled_path=self.compiled_path)
+        self.assertEqual(
+            [schema.to_compiled() for schema in schemata], compiled
+        )
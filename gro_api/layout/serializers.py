@@ -1,8 +1,12 @@
+from django.db.models import F
 from rest_framework import serializers
 from rest_framework.utils.field_mapping import get_detail_view_name
+from ..gro_api.utils import atomic
 from ..gro_api.serializers import BaseSerializer
 from ..farms.models import Farm
 from ..resources.models import Resource
+from .spatial import Box, BoxIndex
+from .occupancy import get_layout_grid
 from .models import (
     Model3D, TrayLayout, PlantSiteLayout, Enclosure, Tray, PlantSite,
     dynamic_models
@@ -21,6 +25,10 @@ class TrayLayoutSerializer(BaseSerializer):
     condition = serializers.ChoiceField(
         ('all', 'odd', 'even', 'none'), write_only=True, required=False
     )
+    grid = serializers.SerializerMethodField()
+
+    def get_grid(self, instance):
+        return get_layout_grid(instance)
 
     def create_sites(self, instance, condition):
         if condition == 'all':
@@ -45,8 +53,7 @@ class TrayLayoutSerializer(BaseSerializer):
         PlantSiteLayout.objects.bulk_create(sites)
 
     def clear_sites(self, instance):
-        for site in instance.plant_sites.all():
-            site.delete()
+        instance.plant_sites.all().delete()
 
     def create(self, validated_data):
         condition = validated_data.pop('condition', 'none')
@@ -74,7 +81,9 @@ class ResourcesMixin:
     """
     :class:`cityfarm_api.serializers.BaseSerializer` doesn't know how to
     automatically serialize generic relations, so we treat them as serializer
-    methods and implement the getter in this mixin for reuse
+    methods and implement the getter in this mixin for reuse. The layout
+    viewsets prefetch the resources of every object they serialize, which
+    ``obj.resources.all()`` reads instead of querying the database.
     """
     resources_view_name = get_detail_view_name(Resource)
 
@@ -102,14 +111,14 @@ class EnclosureSerializer(BaseSerializer, ResourcesMixin):
 
 
 class LayoutObjectSerializer(BaseSerializer, ResourcesMixin):
-    def create(self, validated_data):
-        instance = super().create(validated_data)
+    @classmethod
+    def set_default_name(cls, instance):
+        """ Names `instance` after the farm if it has no name """
         if not instance.name:
             instance.name = "{} {} {}".format(
-                Farm.get_solo().name, self.Meta.model.__name__, instance.pk
+                Farm.get_solo().name, cls.Meta.model.__name__, instance.pk
             )
-            instance.save()
-        return instance
+            instance.save(update_fields=['name'])
 
     def validate(self, attrs):
         """ Ensure that this object fits inside it's parent """
@@ -133,37 +142,79 @@ class LayoutObjectSerializer(BaseSerializer, ResourcesMixin):
             )
         return attrs
 
-    def ranges_overlap(range1, range2):
-        return (range1[1] > range2[0]) and (range1[0] < range2[1])
-
-    def check_for_overlap(self, attrs, others):
-        this_x_range = (attrs['x'], attrs['x'] + attrs['length'])
-        this_y_range = (attrs['y'], attrs['y'] + attrs['width'])
-        this_z_range = (attrs['z'], attrs['z'] + attrs['height'])
-        for other in others:
-            other_x_range = (other.x, other.x + other.length)
-            other_y_range = (other.y, other.y + other.width)
-            other_z_range = (other.z, other.z + other.height)
-            if self.ranges_overlap(other_x_range, this_x_range) \
-                    and self.ranges_overlap(other_y_range, this_y_range) \
-                    and self.ranges_overlap(other_z_range, this_z_range):
-                raise ValidationError(
+    @staticmethod
+    def get_sibling_index(parent):
+        """
+        Returns a :class:`~layout.spatial.BoxIndex` of the children of
+        `parent`
+        """
+        return BoxIndex(
+            Box(*values) for values in parent.children.values_list(
+                'pk', 'x', 'y', 'z', 'length', 'width', 'height'
+            )
+        )
+
+    @staticmethod
+    def find_sibling_overlap(parent, box, exclude=None):
+        """
+        Returns whether `box` overlaps any of the children of `parent` other
+        than the one with the primary key `exclude`. The range filters let
+        the database skip the siblings that are nowhere near `box`.
+        """
+        (x1, x2), (y1, y2), (z1, z2) = box.ranges
+        siblings = parent.children.annotate(
+            max_x=F('x') + F('length'), max_y=F('y') + F('width'),
+            max_z=F('z') + F('height')
+        ).filter(
+            x__lt=x2, max_x__gt=x1, y__lt=y2, max_y__gt=y1, z__lt=z2,
+            max_z__gt=z1
+        )
+        if exclude is not None:
+            siblings = siblings.exclude(pk=exclude)
+        return siblings.exists()
+
+    def check_for_overlaps(self, attrs_list, exclude=None):
+        """
+        Ensures that none of the objects described by the dictionaries of
+        attributes in `attrs_list` overlap each other or an existing object
+        with the same parent, ignoring the existing object with the primary
+        key `exclude`.
+
+        A single object is checked with one query for the siblings near it.
+        For many objects at once (e.g. from :class:`TrayProvisionSerializer`),
+        every parent is only loaded once into an index, and every object is
+        only compared with the siblings near it.
+        """
+        if len(attrs_list) == 1:
+            attrs = attrs_list[0]
+            box = Box.from_attrs(attrs)
+            if self.find_sibling_overlap(attrs['parent'], box, exclude):
+                raise serializers.ValidationError(
                     'Entity cannot overlap with another entity of the same '
                     'type'
                 )
+            return
+        indexes = {}
+        for attrs in attrs_list:
+            parent = attrs['parent']
+            if parent.pk not in indexes:
+                indexes[parent.pk] = self.get_sibling_index(parent)
+            box = Box.from_attrs(attrs)
+            if indexes[parent.pk].find_overlap(box, exclude=exclude):
+                raise serializers.ValidationError(
+                    'Entity cannot overlap with another entity of the same '
+                    'type'
+                )
+            indexes[parent.pk].add(box)
 
     def create(self, validated_data):
-        parent = validated_data['parent']
-        others = parent.children.all()
-        self.check_for_overlap(validated_data, others)
-        return super().create(validated_data)
+        self.check_for_overlaps([validated_data])
+        instance = super().create(validated_data)
+        self.set_default_name(instance)
+        return instance
 
     def update(self, instance, validated_data):
-        parent = validated_data['parent']
-        others = (
-            child for child in parent.children.all() if child.pk != instance.pk
-        )
-        self.check_for_overlap(validated_data, others)
+        self.check_for_overlaps([validated_data], exclude=instance.pk)
         return super().update(instance, validated_data)
 
 
@@ -177,25 +228,30 @@ class TraySerializer(LayoutObjectSerializer):
     )
     resources = serializers.SerializerMethodField()
 
-    def create_sites(self, instance, layout):
-        for layout_site in layout.plant_sites.all():
-            plant_site = PlantSite(
-                parent=instance, row=layout_site.row, col=layout_site.col
-            )
-            plant_site.save()
+    @staticmethod
+    def create_sites(trays, layout):
+        """
+        Creates a plant site in every tray in `trays` for every site in the
+        :class:`~layout.models.TrayLayout` `layout`, in a single query
+        """
+        layout_sites = list(layout.plant_sites.values_list('row', 'col'))
+        PlantSite.objects.bulk_create([
+            PlantSite(parent=tray, row=row, col=col) for tray in trays for
+            row, col in layout_sites
+        ])
 
     def clear_sites(self, instance):
-        for plant_site in instance.plant_sites.all():
-            plant_site.delete()
+        instance.plant_sites.all().delete()
 
     def create(self, validated_data):
         layout = validated_data.pop('layout', None)
         if layout is not None:
             validated_data['num_rows'] = layout.num_rows
             validated_data['num_cols'] = layout.num_cols
-        instance = super().create(validated_data)
-        if layout is not None:
-            self.create_sites(instance, layout)
+        with atomic():
+            instance = super().create(validated_data)
+            if layout is not None:
+                self.create_sites([instance], layout)
         return instance
 
     def update(self, instance, validated_data):
@@ -203,13 +259,71 @@ class TraySerializer(LayoutObjectSerializer):
         if layout is not None:
             validated_data['num_rows'] = layout.num_rows
             validated_data['num_cols'] = layout.num_cols
-        instance = super().update(instance, validated_data)
-        if layout is not None:
-            self.clear_sites(instance)
-            self.create_sites(instance, layout)
+        with atomic():
+            instance = super().update(instance, validated_data)
+            if layout is not None:
+                self.clear_sites(instance)
+                self.create_sites([instance], layout)
         return instance
 
 
+class TrayPositionSerializer(serializers.Serializer):
+    """ The position, size and (optionally) name of a single tray """
+    name = serializers.CharField(max_length=100, required=False, default='')
+    x = serializers.FloatField(default=0)
+    y = serializers.FloatField(default=0)
+    z = serializers.FloatField(default=0)
+    length = serializers.FloatField(default=0)
+    width = serializers.FloatField(default=0)
+    height = serializers.FloatField(default=0)
+
+
+class TrayProvisionSerializer(serializers.Serializer):
+    """
+    Creates many `trays` under the same `parent` at once, all with the plant
+    sites of the same tray `layout`
+    """
+    layout = serializers.HyperlinkedRelatedField(
+        view_name='traylayout-detail', queryset=TrayLayout.objects.all(),
+        required=False
+    )
+    trays = TrayPositionSerializer(many=True)
+
+    def get_fields(self):
+        fields = super().get_fields()
+        # The parent model of trays depends on the layout of the farm
+        fields['parent'] = TraySerializer().get_fields()['parent']
+        return fields
+
+    def validate(self, data):
+        if not data['trays']:
+            raise serializers.ValidationError('No trays were given')
+        tray_serializer = TraySerializer()
+        tray_attrs = [
+            tray_serializer.validate(dict(attrs, parent=data['parent'])) for
+            attrs in data['trays']
+        ]
+        tray_serializer.check_for_overlaps(tray_attrs)
+        data['trays'] = tray_attrs
+        return data
+
+    def create(self, validated_data):
+        layout = validated_data.get('layout', None)
+        trays = []
+        with atomic():
+            for attrs in validated_data['trays']:
+                tray = Tray(**attrs)
+                if layout is not None:
+                    tray.num_rows = layout.num_rows
+                    tray.num_cols = layout.num_cols
+                tray.save()
+                TraySerializer.set_default_name(tray)
+                trays.append(tray)
+            if layout is not None:
+                TraySerializer.create_sites(trays, layout)
+        return trays
+
+
 class PlantSiteSerializer(BaseSerializer):
     class Meta:
         model = PlantSite
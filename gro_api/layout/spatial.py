@@ -0,0 +1,148 @@
+"""
+This module defines :class:`BoxIndex`, an in-memory spatial index of the
+axis-aligned boxes occupied by the children of a single layout object. It is
+used to check that layout objects don't overlap their siblings without
+comparing every new object with every sibling.
+
+Boxes are hashed into a uniform 3D grid whose cell size on each axis is the
+average size of the indexed boxes on that axis, so a query only has to test
+the boxes in the cells it touches.
+"""
+import math
+from collections import defaultdict
+
+
+class Box:
+    """
+    An axis-aligned box. `key` identifies the object occupying the box (e.g.
+    its primary key) and may be None for objects that don't exist yet.
+    """
+    __slots__ = ('key', 'x', 'y', 'z', 'length', 'width', 'height')
+
+    def __init__(self, key, x, y, z, length, width, height):
+        self.key = key
+        self.x = x
+        self.y = y
+        self.z = z
+        self.length = length
+        self.width = width
+        self.height = height
+
+    @classmethod
+    def from_attrs(cls, attrs, key=None):
+        """ Creates a box from a dictionary of layout object attributes """
+        return cls(
+            key, attrs['x'], attrs['y'], attrs['z'], attrs['length'],
+            attrs['width'], attrs['height']
+        )
+
+    @property
+    def ranges(self):
+        return (
+            (self.x, self.x + self.length), (self.y, self.y + self.width),
+            (self.z, self.z + self.height)
+        )
+
+    @staticmethod
+    def ranges_overlap(range1, range2):
+        return (range1[1] > range2[0]) and (range1[0] < range2[1])
+
+    def overlaps(self, other):
+        return all(
+            self.ranges_overlap(this_range, other_range) for
+            this_range, other_range in zip(self.ranges, other.ranges)
+        )
+
+
+class BoxIndex:
+    """
+    A spatial index of a set of :class:`Box` instances.
+
+    :param boxes: The boxes to index
+    """
+    #: Boxes that would span more cells than this are not hashed into the
+    #: grid and are tested against every query instead
+    max_cells_per_box = 64
+
+    def __init__(self, boxes=()):
+        boxes = list(boxes)
+        self.cell_size = tuple(
+            self.get_cell_size([size for size in sizes if size > 0]) for
+            sizes in zip(*(
+                (box.length, box.width, box.height) for box in boxes
+            ))
+        ) if boxes else (1, 1, 1)
+        self.cells = defaultdict(list)
+        self.large_boxes = []
+        for box in boxes:
+            self.add(box)
+
+    @staticmethod
+    def get_cell_size(sizes):
+        return sum(sizes) / len(sizes) if sizes else 1
+
+    def get_cells(self, box):
+        """
+        Returns a list of the grid cells that `box` touches, or None if there
+        are more than :attr:`max_cells_per_box` of them
+        """
+        cell_ranges = []
+        count = 1
+        for (start, end), cell_size in zip(box.ranges, self.cell_size):
+            first = math.floor(start / cell_size)
+            last = max(first, math.ceil(end / cell_size) - 1)
+            cell_ranges.append(range(first, last + 1))
+            count *= last - first + 1
+        if count > self.max_cells_per_box:
+            return None
+        return [
+            (i, j, k) for i in cell_ranges[0] for j in cell_ranges[1] for k in
+            cell_ranges[2]
+        ]
+
+    def add(self, box):
+        """ Adds `box` to the index """
+        cells = self.get_cells(box)
+        if cells is None:
+            self.large_boxes.append(box)
+            return
+        for cell in cells:
+            self.cells[cell].append(box)
+
+    def remove(self, key):
+        """ Removes every box with the key `key` from the index """
+        self.large_boxes = [box for box in self.large_boxes if box.key != key]
+        for cell, boxes in self.cells.items():
+            self.cells[cell] = [box for box in boxes if box.key != key]
+
+    def get_candidates(self, box):
+        """ Returns the boxes that are near enough to `box` to overlap it """
+        cells = self.get_cells(box)
+        if cells is None:
+            return self.all_boxes()
+        res = {}
+        for cell in cells:
+            for candidate in self.cells.get(cell, ()):
+                res[id(candidate)] = candidate
+        for candidate in self.large_boxes:
+            res[id(candidate)] = candidate
+        return list(res.values())
+
+    def all_boxes(self):
+        res = {id(box): box for box in self.large_boxes}
+        for boxes in self.cells.values():
+            for box in boxes:
+                res[id(box)] = box
+        return list(res.values())
+
+    def find_overlap(self, box, exclude=None):
+        """
+        Returns a box in the index that overlaps `box`, or None if there is
+        none. Boxes with the key `exclude` are ignored.
+        """
+        for candidate in self.get_candidates(box):
+            if exclude is not None and candidate.key == exclude:
+                continue
+            if candidate.overlaps(box):
+                return candidate
+        return None
@@ -1,4 +1,5 @@
 from django.conf import settings
+from django.test import TestCase
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import Group
 from django.utils.functional import cached_property
@@ -8,6 +9,7 @@ from ..gro_api.test import (
     APITestCase, run_with_layouts, run_with_all_layouts
 )
 from .schemata import all_schemata
+from .spatial import Box, BoxIndex
 
 class LayoutAuthMixin:
     @classmethod
@@ -101,10 +103,265 @@ class TrayCRUDTestCase(LayoutAuthMixin, APITestCase):
     @run_with_layouts('tray')
     def test_tray_creation_given_tray(self, parent=None):
         parent_url = parent or self.url_for_object('enclosure', 1)
-        tray_info  = dict(generic_obj_info)
+        tray_info  = dict(generic_obj_info, height=0.5)
         tray_info['parent'] = parent_url
         res = self.client.post(self.url_for_object('tray'), tray_info)
         self.assertEqual(res.status_code, 201)
         res = self.client.get(self.url_for_object('tray'))
         self.assertEqual(res.status_code, 200)
         self.assertEqual(len(res.data['results']), 1)
+        # Siblings can't overlap, but they can touch
+        res = self.client.post(self.url_for_object('tray'), tray_info)
+        self.assertEqual(res.status_code, 400)
+        tray_info['z'] = 0.5
+        res = self.client.post(self.url_for_object('tray'), tray_info)
+        self.assertEqual(res.status_code, 201)
+        # A tray doesn't overlap itself, but can't be moved onto a sibling
+        tray_url = res.data['url']
+        res = self.client.put(tray_url, tray_info)
+        self.assertEqual(res.status_code, 200)
+        tray_info['z'] = 0.25
+        res = self.client.put(tray_url, tray_info)
+        self.assertEqual(res.status_code, 400)
+
+
+class LayoutTreeTestCase(LayoutAuthMixin, APITestCase):
+    @run_with_layouts('aisle')
+    def test_layout_tree(self):
+        from .models import PlantSite
+        tree_url = self.url_for_object('enclosure') + 'tree/'
+        res = self.client.get(tree_url)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data['children'], [])
+        obj_info = dict(generic_obj_info)
+        obj_info['parent'] = self.url_for_object('enclosure', 1)
+        aisle_url = self.client.post(
+            self.url_for_object('aisle'), obj_info
+        ).data['url']
+        obj_info['parent'] = aisle_url
+        bay_url = self.client.post(
+            self.url_for_object('bay'), obj_info
+        ).data['url']
+        obj_info['parent'] = bay_url
+        res = self.client.post(self.url_for_object('tray'), obj_info)
+        self.assertEqual(res.status_code, 201)
+        tray_url = res.data['url']
+        res = self.client.get(tree_url)
+        self.assertEqual(res.status_code, 200)
+        aisle = res.data['children'][0]
+        self.assertEqual(aisle['url'], aisle_url)
+        bay = aisle['children'][0]
+        self.assertEqual(bay['url'], bay_url)
+        tray = bay['children'][0]
+        self.assertEqual(tray['url'], tray_url)
+        self.assertEqual(tray['children'], [])
+        # The tree is cached until the layout changes
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(tree_url).data, res.data)
+        PlantSite.objects.create(
+            parent_id=int(tray_url.split('/')[-2]), row=0, col=0
+        )
+        res = self.client.get(tree_url)
+        plant_sites = res.data['children'][0]['children'][0]['children'][0][
+            'children'
+        ]
+        self.assertEqual(len(plant_sites), 1)
+        self.assertEqual(plant_sites[0]['row'], 0)
+
+    @run_with_layouts('aisle')
+    def test_scene(self):
+        from .models import Enclosure, Tray, PlantSite, dynamic_models
+        from .tree import unpack_scene
+        scene_url = self.url_for_object('enclosure') + 'scene/'
+        aisle = dynamic_models['Aisle'].objects.create(
+            parent=Enclosure.get_solo(), x=1, length=4, width=2, height=2
+        )
+        bay = dynamic_models['Bay'].objects.create(
+            parent=aisle, x=1, y=1, length=1, width=1, height=1
+        )
+        tray = Tray.objects.create(
+            parent=bay, z=0.5, length=1, width=1, height=0.5, num_rows=2,
+            num_cols=2
+        )
+        site = PlantSite.objects.create(parent=tray, row=1, col=0)
+        res = self.client.get(scene_url)
+        self.assertEqual(res.status_code, 200)
+        scene = res.data
+        self.assertEqual(scene['entities'], [
+            'Enclosure', 'Aisle', 'Bay', 'Tray', 'PlantSite'
+        ])
+        nodes = {
+            (scene['entities'][node[0]], node[1]): dict(
+                zip(scene['fields'], node)
+            ) for node in scene['nodes']
+        }
+        tray_node = nodes[('Tray', tray.pk)]
+        self.assertEqual(
+            [tray_node[key] for key in ('x', 'y', 'z')], [2, 1, 0.5]
+        )
+        self.assertEqual(
+            scene['nodes'][tray_node['parent']][:2],
+            [scene['entities'].index('Bay'), bay.pk]
+        )
+        site_node = nodes[('PlantSite', site.pk)]
+        self.assertEqual(
+            [site_node[key] for key in ('x', 'y', 'z', 'length', 'width')],
+            [2, 1.5, 1, 0.5, 0.5]
+        )
+        enclosure_node = nodes[('Enclosure', 1)]
+        self.assertEqual(
+            [enclosure_node[key] for key in ('max_x', 'max_y', 'max_z')],
+            [5, 2, 2]
+        )
+        # The scene is cached until the layout changes
+        with self.assertNumQueries(0):
+            self.client.get(scene_url)
+        res = self.client.get(scene_url, {'format': 'bin'})
+        self.assertEqual(res['Content-Type'], 'application/octet-stream')
+        self.assertEqual(unpack_scene(res.content), scene)
+
+
+class LayoutResourcesTestCase(LayoutAuthMixin, APITestCase):
+    @run_with_layouts('aisle')
+    def test_resources_are_prefetched(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from ..resources.models import ResourceType, Resource
+        from .models import Enclosure, dynamic_models
+        Aisle = dynamic_models['Aisle']
+        air = ResourceType.objects.get_by_natural_key('A')
+        aisle_list_url = self.url_for_object('aisle')
+        query_counts = []
+        for i in range(3):
+            aisle = Aisle.objects.create(
+                parent=Enclosure.get_solo(), x=i, length=1
+            )
+            Resource.objects.create(
+                index=i + 1, resource_type=air, location=aisle
+            )
+            with CaptureQueriesContext(connection) as queries:
+                res = self.client.get(aisle_list_url)
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(len(res.data['results'][i]['resources']), 1)
+            query_counts.append(len(queries))
+        self.assertEqual(query_counts[0], query_counts[-1])
+
+
+class BoxIndexTestCase(TestCase):
+    def test_find_overlap(self):
+        # A rack of 10 x 10 trays stacked 5 high
+        boxes = [
+            Box((x, y, z), x, y, z, 1, 1, 0.5) for x in range(10) for y in
+            range(10) for z in range(5)
+        ]
+        index = BoxIndex(boxes)
+        self.assertIsNone(index.find_overlap(Box(None, 0, 0, 4.5, 1, 1, 1)))
+        overlap = index.find_overlap(Box(None, 3.5, 3.5, 0.25, 0.1, 0.1, 0.1))
+        self.assertEqual(overlap.key, (3, 3, 0))
+        self.assertLess(
+            len(index.get_candidates(Box(None, 3, 3, 0, 1, 1, 0.5))), 30
+        )
+        self.assertIsNone(index.find_overlap(
+            Box(None, 3, 3, 0, 1, 1, 0.5), exclude=(3, 3, 0)
+        ))
+        # Boxes bigger than a whole grid region are still found
+        self.assertIsNotNone(
+            index.find_overlap(Box(None, -1, -1, -1, 20, 20, 20))
+        )
+        index.add(Box('big', 0, 0, 10, 100, 100, 100))
+        self.assertEqual(
+            index.find_overlap(Box(None, 50, 50, 50, 1, 1, 1)).key, 'big'
+        )
+        index.remove('big')
+        self.assertIsNone(index.find_overlap(Box(None, 50, 50, 50, 1, 1, 1)))
+
+
+class TrayProvisionTestCase(LayoutAuthMixin, APITestCase):
+    @run_with_layouts('tray')
+    def test_provision_trays(self):
+        from .models import TrayLayout, PlantSiteLayout, Tray, PlantSite
+        tray_layout = TrayLayout.objects.create(
+            name='2x3', num_rows=2, num_cols=3
+        )
+        PlantSiteLayout.objects.bulk_create([
+            PlantSiteLayout(parent=tray_layout, row=row, col=col) for row in
+            range(2) for col in range(3)
+        ])
+        provision_url = self.url_for_object('tray') + 'provision/'
+        data = {
+            'parent': self.url_for_object('enclosure', 1),
+            'layout': self.url_for_object('trayLayout', tray_layout.pk),
+            'trays': [
+                dict(generic_obj_info, x=i, name='Tray {}'.format(i)) for i
+                in range(3)
+            ] + [dict(generic_obj_info, x=3)]
+        }
+        res = self.client.post(provision_url, data, format='json')
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(len(res.data), 4)
+        self.assertEqual(res.data[0]['name'], 'Tray 0')
+        self.assertTrue(res.data[3]['name'])
+        self.assertEqual(res.data[3]['num_rows'], 2)
+        self.assertEqual(PlantSite.objects.count(), 24)
+        # Nothing is created if any of the trays overlap
+        data['trays'] = [
+            dict(generic_obj_info, x=10), dict(generic_obj_info, x=10.5)
+        ]
+        res = self.client.post(provision_url, data, format='json')
+        self.assertEqual(res.status_code, 400)
+        data['trays'] = [dict(generic_obj_info, x=3.5)]
+        res = self.client.post(provision_url, data, format='json')
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(Tray.objects.count(), 4)
+        # Changing the layout of a tray replaces its plant sites
+        tray = dict(generic_obj_info, x=0, name='Tray 0')
+        tray['parent'] = data['parent']
+        tray['layout'] = data['layout']
+        tray_url = self.url_for_object(
+            'tray', Tray.objects.get(name='Tray 0').pk
+        )
+        res = self.client.put(tray_url, tray)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(PlantSite.objects.count(), 24)
+
+
+class TrayOccupancyTestCase(LayoutAuthMixin, APITestCase):
+    @run_with_layouts('tray')
+    def test_tray_occupancy(self):
+        from ..plants.models import PlantModel, PlantType, Plant
+        from .models import Tray, PlantSite
+        from .occupancy import decode_grid
+        data = {
+            'name': 'Checkerboard', 'num_rows': 2, 'num_cols': 3,
+            'condition': 'even'
+        }
+        res = self.client.post(self.url_for_object('trayLayout'), data)
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(res.data['grid'], ['o.o', '.o.'])
+        provision_url = self.url_for_object('tray') + 'provision/'
+        res = self.client.post(provision_url, {
+            'parent': self.url_for_object('enclosure', 1),
+            'layout': res.data['url'],
+            'trays': [dict(generic_obj_info, x=i) for i in range(2)]
+        }, format='json')
+        self.assertEqual(res.status_code, 201)
+        tray_id = Tray.objects.order_by('pk').first().pk
+        plant_type = PlantType.objects.create(
+            common_name='Basil', latin_name='Ocimum basilicum',
+            model=PlantModel.objects.create(name='Basil')
+        )
+        Plant.objects.create(
+            index=1, plant_type=plant_type,
+            site=PlantSite.objects.get(parent=tray_id, row=1, col=1)
+        )
+        res = self.client.get(self.url_for_object('tray') + 'occupancy/')
+        self.assertEqual(res.status_code, 200)
+        grids = sorted(res.data.values())
+        self.assertEqual(grids, [['o.o', '.o.'], ['o.o', '.x.']])
+        self.assertEqual(decode_grid(grids[1]), {
+            (0, 0): False, (0, 2): False, (1, 1): True
+        })
+        res = self.client.get(
+            self.url_for_object('tray') + 'occupancy/', {'tray': tray_id}
+        )
+        self.assertEqual(list(res.data.values()), [['o.o', '.x.']])
@@ -0,0 +1,269 @@
+"""
+This module builds a nested description of the whole layout tree of the farm
+(the :class:`~layout.models.Enclosure`, every dynamic entity of the current
+schema, every :class:`~layout.models.Tray` and every
+:class:`~layout.models.PlantSite`) in one query per level of the tree plus one
+query for the resources in it.
+
+It also builds the scene graph of the farm: a flat list of every object in the
+tree with its absolute position (layout objects store their position relative
+to their parent) and the bounding box of the object and everything in it.
+Plant sites are placed on the top face of their tray, in the cell given by
+their row (along the width of the tray) and column (along its length).
+
+Trees and scenes are cached in every process until any layout object or
+resource changes. Changes made through the ORM bump a shared
+:class:`~gro_api.utils.VersionStamp` so that every worker process rebuilds its
+tree and scene the next time they are read.
+"""
+import struct
+from collections import defaultdict
+from django.contrib.contenttypes.models import ContentType
+from rest_framework.reverse import reverse
+from rest_framework.utils.field_mapping import get_detail_view_name
+from ..gro_api.utils import system_layout, VersionStamp
+from ..resources.models import Resource
+from .schemata import all_schemata
+from .models import Model3D, Enclosure, Tray, PlantSite, get_layout_model
+
+stamp = VersionStamp('layout_tree')
+
+#: Maps ``(layout, base url)`` pairs to ``(version, tree)`` pairs, where
+#: `version` is the value of :data:`stamp` when `tree` was built
+_trees = {}
+
+#: Maps layouts to ``(version, scene)`` pairs, where `version` is the value of
+#: :data:`stamp` when `scene` was built
+_scenes = {}
+
+#: The fields of every layout object included in the tree
+FIELDS = ('pk', 'name', 'x', 'y', 'z', 'length', 'width', 'height', 'model_id')
+
+
+def get_entity_names(schema):
+    """
+    Returns the names of the entities in `schema` from the top of the layout
+    tree (the enclosure) to the bottom (trays)
+    """
+    children = {
+        entity.parent: entity.name for entity in schema.entities.values() if
+        entity.parent is not None
+    }
+    res = ['Enclosure']
+    while res[-1] in children:
+        res.append(children[res[-1]])
+    return res
+
+
+def build_layout_tree(request):
+    """
+    Returns the layout tree of the farm as nested dictionaries, with urls
+    built for `request`
+    """
+    schema = all_schemata[system_layout.current_value]
+    entity_names = get_entity_names(schema)
+    def url_for(model, pk):
+        return reverse(
+            get_detail_view_name(model), kwargs={'pk': pk}, request=request
+        )
+    content_types = {
+        entity_name: ContentType.objects.get_for_model(
+            get_layout_model(entity_name)
+        ) for entity_name in entity_names
+    }
+    resources = defaultdict(list)
+    for pk, location_type_id, location_id in Resource.objects.filter(
+            location_type__in=list(content_types.values())
+    ).order_by('pk').values_list('pk', 'location_type_id', 'location_id'):
+        resources[(location_type_id, location_id)].append(
+            url_for(Resource, pk)
+        )
+    # Maps the ids of the objects on the level above the current one to the
+    # lists of their children
+    parent_children = None
+    root = None
+    for entity_name in entity_names:
+        model = get_layout_model(entity_name)
+        content_type_id = content_types[entity_name].pk
+        fields = FIELDS
+        if model is Tray:
+            fields += ('num_rows', 'num_cols')
+        if model is not Enclosure:
+            fields += ('parent_id',)
+        level_children = defaultdict(list)
+        for values in model.objects.order_by('pk').values(*fields):
+            pk = values.pop('pk')
+            parent_id = values.pop('parent_id', None)
+            model_id = values.pop('model_id')
+            node = dict(values)
+            node['url'] = url_for(model, pk)
+            node['model'] = url_for(Model3D, model_id) if model_id else None
+            node['resources'] = resources[(content_type_id, pk)]
+            node['children'] = level_children[pk]
+            if model is Enclosure:
+                root = node
+            else:
+                parent_children[parent_id].append(node)
+        parent_children = level_children
+    plant_sites = PlantSite.objects.order_by('pk').values_list(
+        'pk', 'parent_id', 'row', 'col'
+    )
+    for pk, parent_id, row, col in plant_sites:
+        parent_children[parent_id].append({
+            'url': url_for(PlantSite, pk), 'row': row, 'col': col
+        })
+    return root
+
+
+def get_layout_tree(request):
+    """
+    Returns the layout tree of the farm for `request`, building it only if
+    the layout has changed since it was last built by this process
+    """
+    key = (system_layout.current_value, request.build_absolute_uri('/'))
+    version = stamp.current_value
+    cached = _trees.get(key)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    tree = build_layout_tree(request)
+    _trees[key] = (version, tree)
+    return tree
+
+
+#: The fields of every node in a scene
+SCENE_FIELDS = (
+    'entity', 'pk', 'parent', 'x', 'y', 'z', 'length', 'width', 'height',
+    'min_x', 'min_y', 'min_z', 'max_x', 'max_y', 'max_z'
+)
+
+#: The binary layout of a scene header: the length of the entity names and
+#: the number of nodes
+SCENE_HEADER = struct.Struct('<HI')
+
+#: The binary layout of a scene node. Coordinates are single precision.
+SCENE_NODE = struct.Struct('<BIi12f')
+
+
+def build_scene():
+    """
+    Returns the scene graph of the farm as a dictionary with the names of the
+    `entities` in it from the top of the tree to the bottom and a list of
+    `nodes`. Every node is a list of the values of :data:`SCENE_FIELDS`, where
+    `entity` is an index in `entities` and `parent` is the index of the node of
+    the parent of the object (-1 for the enclosure). Parents always come
+    before their children.
+    """
+    schema = all_schemata[system_layout.current_value]
+    entity_names = get_entity_names(schema)
+    nodes = []
+    # Maps the indices of the nodes of trays to the size of their grids
+    grids = {}
+    # Maps the ids of the objects on the level above the current one to the
+    # indices of their nodes
+    parent_indices = None
+    for entity_index, entity_name in enumerate(entity_names):
+        model = get_layout_model(entity_name)
+        fields = ('pk', 'x', 'y', 'z', 'length', 'width', 'height')
+        if model is Tray:
+            fields += ('num_rows', 'num_cols')
+        if model is not Enclosure:
+            fields += ('parent_id',)
+        level_indices = {}
+        for values in model.objects.order_by('pk').values_list(*fields):
+            pk, x, y, z, length, width, height = values[:7]
+            parent_index = -1
+            if model is not Enclosure:
+                parent_index = parent_indices[values[-1]]
+                parent = nodes[parent_index]
+                x, y, z = x + parent[3], y + parent[4], z + parent[5]
+            level_indices[pk] = len(nodes)
+            nodes.append([
+                entity_index, pk, parent_index, x, y, z, length, width,
+                height, x, y, z, x + length, y + width, z + height
+            ])
+            if model is Tray:
+                grids[len(nodes) - 1] = values[7:9]
+        parent_indices = level_indices
+    entity_names.append('PlantSite')
+    entity_index = len(entity_names) - 1
+    for pk, parent_id, row, col in PlantSite.objects.order_by(
+            'pk').values_list('pk', 'parent_id', 'row', 'col'):
+        parent_index = parent_indices[parent_id]
+        tray = nodes[parent_index]
+        num_rows, num_cols = grids[parent_index]
+        length = tray[6] / max(num_cols, 1)
+        width = tray[7] / max(num_rows, 1)
+        x = tray[3] + col * length
+        y = tray[4] + row * width
+        z = tray[5] + tray[8]
+        nodes.append([
+            entity_index, pk, parent_index, x, y, z, length, width, 0,
+            x, y, z, x + length, y + width, z
+        ])
+    # Children come after their parents, so walking the nodes backwards grows
+    # every bounding box by the boxes of the objects in it
+    for node in reversed(nodes):
+        if node[2] < 0:
+            continue
+        parent = nodes[node[2]]
+        for i in range(9, 12):
+            parent[i] = min(parent[i], node[i])
+        for i in range(12, 15):
+            parent[i] = max(parent[i], node[i])
+    return {'entities': entity_names, 'fields': SCENE_FIELDS, 'nodes': nodes}
+
+
+def get_scene():
+    """
+    Returns the scene graph of the farm, building it only if the layout has
+    changed since it was last built by this process
+    """
+    key = system_layout.current_value
+    version = stamp.current_value
+    cached = _scenes.get(key)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    scene = build_scene()
+    _scenes[key] = (version, scene)
+    return scene
+
+
+def pack_scene(scene):
+    """
+    Returns `scene` as bytes: a :data:`SCENE_HEADER`, the entity names
+    separated by newlines and encoded as UTF-8, and a :data:`SCENE_NODE` for
+    every node
+    """
+    entities = '\n'.join(scene['entities']).encode('utf-8')
+    return b''.join(
+        [SCENE_HEADER.pack(len(entities), len(scene['nodes'])), entities] +
+        [SCENE_NODE.pack(*node) for node in scene['nodes']]
+    )
+
+
+def unpack_scene(data):
+    """ Returns the scene packed into `data` by :func:`pack_scene` """
+    entities_length, num_nodes = SCENE_HEADER.unpack_from(data)
+    offset = SCENE_HEADER.size
+    entities = data[offset:offset + entities_length].decode('utf-8')
+    offset += entities_length
+    end = offset + num_nodes * SCENE_NODE.size
+    return {
+        'entities': entities.split('\n'),
+        'fields': SCENE_FIELDS,
+        'nodes': [
+            list(node) for node in SCENE_NODE.iter_unpack(data[offset:end])
+        ]
+    }
+
+
+def clear_cache():
+    """ Clears the cached trees and scenes of this process only """
+    _trees.clear()
+    _scenes.clear()
+
+
+def invalidate_cache():
+    """ Clears the cached trees and scenes of every process """
+    clear_cache()
+    stamp.bump()
@@ -1,15 +1,21 @@
-import time
-from django.core.exceptions import ObjectDoesNotExist
+from rest_framework import status
 from rest_framework.response import Response
 from rest_framework.viewsets import ModelViewSet
-from rest_framework.decorators import detail_route
+from rest_framework.reverse import reverse
+from rest_framework.decorators import detail_route, list_route
+from rest_framework.exceptions import ValidationError
+from rest_framework.settings import api_settings
+from rest_framework.utils.field_mapping import get_detail_view_name
 from ..gro_api.viewsets import SingletonModelViewSet
-from ..recipes.models import SetPoint
+from ..recipes.set_points import get_current_set_points, get_set_points_at
 from ..resources.models import ResourceProperty
+from .tree import get_layout_tree, get_scene
+from .occupancy import get_occupancy
+from .renderers import SceneRenderer
 from .serializers import (
     Model3DSerializer, TrayLayoutSerializer, PlantSiteLayoutSerializer,
-    EnclosureSerializer, TraySerializer, PlantSiteSerializer,
-    dynamic_serializers
+    EnclosureSerializer, TraySerializer, TrayProvisionSerializer,
+    PlantSiteSerializer, dynamic_serializers
 )
 from .models import (
     Model3D, TrayLayout, PlantSiteLayout, Enclosure, Tray, PlantSite,
@@ -25,7 +31,7 @@ class Model3DViewSet(ModelViewSet):
 
 class TrayLayoutViewSet(ModelViewSet):
     """ The arrangement of plant sites in a tray """
-    queryset = TrayLayout.objects.all()
+    queryset = TrayLayout.objects.prefetch_related('plant_sites')
     serializer_class = TrayLayoutSerializer
 
 
@@ -38,14 +44,40 @@ class PlantSiteLayoutViewSet(ModelViewSet):
 class EnclosureViewSet(SingletonModelViewSet):
     """ The top-level object in the layout tree """
     model = Enclosure
-    queryset = Enclosure.objects.all()
+    queryset = Enclosure.objects.prefetch_related('resources')
     serializer_class = EnclosureSerializer
 
+    @list_route(methods=["get"])
+    def tree(self, request):
+        """
+        Get the whole layout tree of the farm at once. Every layout object has
+        the `url`, `name`, position, size, `model` and `resources` it has in
+        its own endpoint, plus a list of its `children`. Trays also have
+        `num_rows` and `num_cols`, and their children are their plant sites.
+        The tree is cached until a layout object or resource changes.
+        """
+        return Response(get_layout_tree(request))
+
+    @list_route(methods=["get"], renderer_classes=(
+        api_settings.DEFAULT_RENDERER_CLASSES + [SceneRenderer]
+    ))
+    def scene(self, request):
+        """
+        Get the scene graph of the farm: the absolute position and size of
+        every layout object and plant site, and the bounding box of everything
+        in it. `nodes` lists the values of `fields` for every object, where
+        `entity` is an index in `entities` and `parent` is the index of the
+        node of its parent (-1 for the enclosure). Pass `format=bin` to get
+        the scene as packed binary records instead of JSON. The scene is
+        cached until a layout object or resource changes.
+        """
+        return Response(get_scene())
+
 
 class TrayViewSet(ModelViewSet):
     """ The lowest level in the layout tree; contains plant sites """
     model = Tray
-    queryset = Tray.objects.all()
+    queryset = Tray.objects.prefetch_related('resources')
     serializer_class = TraySerializer
 
     def retrieve(self, request, *args, **kwargs):
@@ -57,36 +89,158 @@ class TrayViewSet(ModelViewSet):
     def list(self, request, *args, **kwargs):
         queryset = self.filter_queryset(self.get_queryset())
 
-        for instance in queryset:
+        # Only the trays being serialized need to be updated, and evaluating
+        # the page once lets them share the prefetched resources
+        page = self.paginate_queryset(queryset)
+        instances = page if page is not None else list(queryset)
+        for instance in instances:
             instance.update_current_recipe_run()
 
-        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(instances, many=True)
         if page is not None:
-            serializer = self.get_serializer(page, many=True)
             return self.get_paginated_response(serializer.data)
-
-        serializer = self.get_serializer(queryset, many=True)
         return Response(serializer.data)
 
+    @list_route(methods=["post"])
+    def provision(self, request):
+        """
+        Create many `trays` under the same `parent` in one request. Every tray
+        is given as its position and size (and optionally its name; trays are
+        named after the farm by default). If a tray `layout` is given, every
+        tray gets its plant sites. Either every tray is created or, if any of
+        them doesn't fit in the parent or overlaps another tray, none are.
+        ---
+        request_serializer: gro_api.layout.serializers.TrayProvisionSerializer
+        response_serializer: gro_api.layout.serializers.TraySerializer
+        """
+        serializer = TrayProvisionSerializer(
+            data=request.data, context={'request': request}
+        )
+        serializer.is_valid(raise_exception=True)
+        trays = serializer.save()
+        response_serializer = self.get_serializer(trays, many=True)
+        return Response(
+            response_serializer.data, status=status.HTTP_201_CREATED
+        )
+
+    @list_route(methods=["get"])
+    def occupancy(self, request):
+        """
+        Get the plant sites of every tray at once, as a dictionary mapping tray
+        urls to grids with one string per row and one character per column:
+        "." if there is no plant site in the cell, "o" if there is an empty
+        plant site and "x" if there is a plant in it. Pass one or more `tray`
+        ids to select the trays (defaults to all of them).
+        """
+        try:
+            tray_ids = [
+                int(pk) for pk in request.query_params.getlist('tray')
+            ]
+        except ValueError:
+            raise ValidationError('`tray` must be a tray id')
+        occupancy = get_occupancy(tray_ids or None)
+        view_name = get_detail_view_name(Tray)
+        return Response({
+            reverse(view_name, kwargs={'pk': tray_id}, request=request): grid
+            for tray_id, grid in occupancy.items()
+        })
+
     @detail_route(methods=["get"])
     def set_points(self, request, pk=None):
         """
         Get a dictionary mapping resource property codes to current set point
-        values
+        values. Properties set by recipe runs that have ended map to null.
         """
         tray = self.get_object()
-        set_points = {}
-        for property in ResourceProperty.objects.all():
-            try:
-                set_point = SetPoint.objects.filter(
-                    tray=tray, property=property, timestamp__lt=time.time()
-                ).latest()
-            except ObjectDoesNotExist:
-                continue
-            else:
-                code = ''.join(set_point.property.natural_key())
-                set_points[code] = set_point.value
-        return Response(set_points)
+        property_codes = ResourceProperty.objects.get_codes()
+        set_points = get_current_set_points(
+            [tray.pk], include_ended=True
+        )[tray.pk]
+        return Response({
+            property_codes[property_id]: value for property_id, value in
+            set_points.items()
+        })
+
+    @list_route(methods=["get"])
+    def current_set_points(self, request):
+        """
+        Get the current set points of every tray at once, as a dictionary
+        mapping tray urls to dictionaries mapping resource property codes to
+        current set point values. Trays with no recipe running map to empty
+        dictionaries.
+        """
+        tray_ids = list(self.get_queryset().values_list('pk', flat=True))
+        property_codes = ResourceProperty.objects.get_codes()
+        set_points = get_current_set_points(tray_ids)
+        view_name = get_detail_view_name(Tray)
+        return Response({
+            reverse(
+                view_name, kwargs={'pk': tray_id}, request=request
+            ): {
+                property_codes[property_id]: value for property_id, value in
+                set_points.get(tray_id, {}).items()
+            } for tray_id in tray_ids
+        })
+
+    #: The largest number of timestamps that can be looked up at once
+    max_set_point_timestamps = 10000
+
+    @list_route(methods=["get"])
+    def historical_set_points(self, request):
+        """
+        Get the set points of a set of trays at each of the given `timestamp`
+        values (pass one or more). Pass one or more `tray` ids to select the
+        trays (defaults to all of them) and one or more `property` codes (e.g.
+        "ATM") to select the resource properties (defaults to all of them).
+        Returns the sorted `timestamps` and a dictionary mapping tray urls to
+        dictionaries mapping property codes to lists of set points aligned with
+        `timestamps`, with null wherever no recipe was setting the property.
+        """
+        try:
+            timestamps = sorted(set(
+                float(timestamp) for timestamp in
+                request.query_params.getlist('timestamp')
+            ))
+            tray_ids = [
+                int(pk) for pk in request.query_params.getlist('tray')
+            ]
+        except ValueError:
+            raise ValidationError(
+                '`timestamp` must be a timestamp and `tray` must be a tray id'
+            )
+        if not timestamps:
+            raise ValidationError('`timestamp` is required')
+        if len(timestamps) > self.max_set_point_timestamps:
+            raise ValidationError(
+                'At most {} timestamps can be looked up at once'.format(
+                    self.max_set_point_timestamps
+                )
+            )
+        property_codes = ResourceProperty.objects.get_codes()
+        codes = set(request.query_params.getlist('property'))
+        unknown_codes = codes - set(property_codes.values())
+        if unknown_codes:
+            raise ValidationError('Invalid resource property "{}"'.format(
+                '", "'.join(sorted(unknown_codes))
+            ))
+        trays = self.get_queryset()
+        if tray_ids:
+            trays = trays.filter(pk__in=tray_ids)
+        tray_ids = list(trays.values_list('pk', flat=True))
+        set_points = get_set_points_at(tray_ids, timestamps)
+        view_name = get_detail_view_name(Tray)
+        return Response({
+            'timestamps': timestamps,
+            'trays': {
+                reverse(
+                    view_name, kwargs={'pk': tray_id}, request=request
+                ): {
+                    property_codes[property_id]: values for property_id, values
+                    in set_points[tray_id].items() if
+                    not codes or property_codes[property_id] in codes
+                } for tray_id in tray_ids
+            }
+        })
 
 
 class PlantSiteViewSet(ModelViewSet):
@@ -100,7 +254,7 @@ for model_name in dynamic_models.keys():
     Model = dynamic_models[model_name]
     Serializer = dynamic_serializers[model_name]
     viewset_attrs = {
-        'queryset': Model.objects.all(),
+        'queryset': Model.objects.prefetch_related('resources', 'children'),
         'serializer_class': Serializer,
         '__doc__': Model.__doc__,
     }
@@ -0,0 +1,243 @@
+"""
+This module scores how closely a tray tracked the recipe run on it by
+comparing the set points of the run with the readings of the sensing points
+of every resource serving the tray.
+
+Both series are step or piecewise linear functions of time, so they are
+aligned by merging their change points into a single sorted list of
+segments. Within a segment the reading is constant and the set point is
+linear, so each segment is scored by its error at the midpoint and weighted
+by its duration. A reading is within tolerance of its set point if it is
+within the control deadband of the actuators serving the tray (or within
+:data:`TOLERANCE` of the operating range of properties no actuator controls).
+
+Scoring is incremental: the running totals are stored in a
+:class:`~recipes.models.RecipeRunAdherence` record along with the time up to
+which they are complete, and every update only reads the history recorded
+since then. Once a run has ended, its report is read straight from that
+record.
+"""
+import json
+import time
+from django.db.models import Max, Q
+from ..layout.models import get_tray_locations
+from ..resources.models import ResourceProperty, Resource
+from ..sensors.models import SensingPoint
+from ..sensors.history import get_data_point_history
+from ..actuators.models import Actuator, ActuatorEffect
+from ..actuators.simulation import sample, sample_mean
+from .models import RecipeRunAdherence
+
+#: The largest difference between a reading and its set point, as a fraction
+#: of the operating range of the property, that counts as within tolerance
+#: for properties that no actuator serving the tray controls
+TOLERANCE = 0.05
+
+
+class PropertyAdherence:
+    """
+    The running totals for a single property of a recipe run.
+
+    :param float tolerance: The largest error that counts as within tolerance
+    :param float controlled_time: The number of seconds for which both a set
+        point and a reading were known
+    :param float in_tolerance_time: The number of seconds of the controlled
+        time for which the reading was within tolerance of the set point
+    :param float error_integral: The integral of the reading minus the set
+        point over the controlled time
+    :param float absolute_error_integral: The integral of the absolute error
+    :param float squared_error_integral: The integral of the squared error
+    :param float worst_deviation: The error with the largest magnitude
+    :param worst_deviation_timestamp: The time at which `worst_deviation`
+        occurred
+    """
+    def __init__(
+            self, tolerance, controlled_time=0, in_tolerance_time=0,
+            error_integral=0, absolute_error_integral=0,
+            squared_error_integral=0, worst_deviation=None,
+            worst_deviation_timestamp=None):
+        self.tolerance = tolerance
+        self.controlled_time = controlled_time
+        self.in_tolerance_time = in_tolerance_time
+        self.error_integral = error_integral
+        self.absolute_error_integral = absolute_error_integral
+        self.squared_error_integral = squared_error_integral
+        self.worst_deviation = worst_deviation
+        self.worst_deviation_timestamp = worst_deviation_timestamp
+
+    def add(self, timestamp, duration, error):
+        """
+        Adds a segment of `duration` seconds starting at `timestamp` over
+        which the error was `error`
+        """
+        self.controlled_time += duration
+        if abs(error) <= self.tolerance:
+            self.in_tolerance_time += duration
+        self.error_integral += error * duration
+        self.absolute_error_integral += abs(error) * duration
+        self.squared_error_integral += error * error * duration
+        if self.worst_deviation is None or \
+                abs(error) > abs(self.worst_deviation):
+            self.worst_deviation = error
+            self.worst_deviation_timestamp = timestamp
+
+    def to_report(self):
+        if not self.controlled_time:
+            return {
+                'tolerance': self.tolerance, 'controlled_time': 0,
+                'time_in_tolerance': None, 'mean_error': None,
+                'mean_absolute_error': None, 'rms_error': None,
+                'worst_deviation': None, 'worst_deviation_timestamp': None,
+            }
+        return {
+            'tolerance': self.tolerance,
+            'controlled_time': self.controlled_time,
+            'time_in_tolerance':
+                self.in_tolerance_time / self.controlled_time,
+            'mean_error': self.error_integral / self.controlled_time,
+            'mean_absolute_error':
+                self.absolute_error_integral / self.controlled_time,
+            'rms_error':
+                (self.squared_error_integral / self.controlled_time) ** 0.5,
+            'worst_deviation': self.worst_deviation,
+            'worst_deviation_timestamp': self.worst_deviation_timestamp,
+        }
+
+
+def get_resource_ids(tray_id):
+    """ Returns a list of the ids of the resources serving tray `tray_id` """
+    locations = get_tray_locations().get(tray_id, set())
+    if not locations:
+        return []
+    query = Q()
+    for location_type_id, location_id in locations:
+        query |= Q(
+            location_type_id=location_type_id, location_id=location_id
+        )
+    return list(Resource.objects.filter(query).values_list('pk', flat=True))
+
+
+def get_tolerances(resource_ids, property_ids):
+    """
+    Returns a dictionary mapping every id in `property_ids` to the tolerance
+    for that property in the resources with ids in `resource_ids`. This is
+    the control deadband (the largest effect threshold on the property) of
+    the actuators in the resources, as in
+    :class:`~actuators.simulation.Simulation`, or a fraction of the operating
+    range of the property if no actuator controls it.
+    """
+    res = {
+        prop.pk: TOLERANCE * (
+            prop.max_operating_value - prop.min_operating_value
+        ) for prop in ResourceProperty.objects.filter(
+            pk__in=list(property_ids)
+        )
+    }
+    control_profile_ids = Actuator.objects.filter(
+        resource__in=resource_ids
+    ).values_list('control_profile_id', flat=True)
+    deadbands = ActuatorEffect.objects.filter(
+        control_profile__in=list(control_profile_ids),
+        property__in=list(property_ids)
+    ).values('property_id').annotate(deadband=Max('threshold'))
+    for row in deadbands:
+        res[row['property_id']] = row['deadband']
+    return res
+
+
+def score(set_points, readings, start, end, totals):
+    """
+    Adds the error between the set point history `set_points` and the list of
+    reading histories `readings` (see :func:`~actuators.simulation.sample`)
+    over ``[start, end)`` to the :class:`PropertyAdherence` `totals`
+    """
+    times = set([start])
+    for points in [set_points] + readings:
+        times.update(
+            point[0] for point in points if start < point[0] < end
+        )
+    times = sorted(times)
+    ends = times[1:] + [end]
+    midpoints = [
+        (segment_start + segment_end) / 2 for segment_start, segment_end in
+        zip(times, ends)
+    ]
+    set_point_values = sample(set_points, midpoints)
+    reading_values = sample_mean(readings, times)
+    for timestamp, segment_end, set_point, reading in zip(
+            times, ends, set_point_values, reading_values):
+        if set_point is None or reading is None:
+            continue
+        totals.add(timestamp, segment_end - timestamp, reading - set_point)
+
+
+def update_adherence(run, until=None):
+    """
+    Brings the adherence totals of the recipe run `run` up to date with the
+    history recorded until `until` (defaults to the current time) and returns
+    its :class:`~recipes.models.RecipeRunAdherence` record. Raises
+    :class:`~recipes.compiler.RecipeCompileError` if the recipe of the run
+    can't be compiled.
+    """
+    if until is None:
+        until = time.time()
+    adherence, _ = RecipeRunAdherence.objects.get_or_create(
+        recipe_run=run, defaults={'processed_until': run.start_timestamp}
+    )
+    start = adherence.processed_until
+    end = int(min(until, run.end_timestamp))
+    if start >= end:
+        return adherence
+    program = run.recipe.get_program()
+    totals = {
+        int(property_id): PropertyAdherence(**values) for property_id, values
+        in json.loads(adherence.data).items()
+    }
+    resource_ids = get_resource_ids(run.tray_id)
+    # Tolerances are fixed when a property is first scored so that every part
+    # of a run is scored the same way
+    new_property_ids = set(program.timelines.keys()) - set(totals.keys())
+    for property_id, tolerance in get_tolerances(
+            resource_ids, new_property_ids).items():
+        totals[property_id] = PropertyAdherence(tolerance)
+    sensing_points = dict(SensingPoint.objects.filter(
+        sensor__resource__in=resource_ids,
+        property__in=list(program.timelines.keys()), is_active=True
+    ).values_list('pk', 'property_id'))
+    history = get_data_point_history(sensing_points.keys(), start, end)
+    for property_id, property_totals in totals.items():
+        set_points = [
+            (run.start_timestamp + offset, value, slope) for
+            offset, value, slope in program.timelines[property_id]
+        ]
+        readings = [
+            history[point_id] for point_id, point_property_id in
+            sensing_points.items() if point_property_id == property_id
+        ]
+        score(set_points, readings, start, end, property_totals)
+    adherence.data = json.dumps({
+        property_id: vars(property_totals) for property_id, property_totals
+        in totals.items()
+    })
+    adherence.processed_until = end
+    adherence.save()
+    return adherence
+
+
+def get_adherence_report(run, until=None):
+    """
+    Returns the adherence report of the recipe run `run` as of `until`
+    (defaults to the current time), updating its totals first. The report
+    maps "properties" to a dictionary mapping property ids to the scores of
+    that property, "processed_until" to the time up to which the report is
+    complete, and "complete" to whether that covers the whole run.
+    """
+    adherence = update_adherence(run, until)
+    return {
+        'processed_until': adherence.processed_until,
+        'complete': adherence.processed_until >= run.end_timestamp,
+        'properties': {
+            int(property_id): PropertyAdherence(**values).to_report() for
+            property_id, values in json.loads(adherence.data).items()
+        },
+    }
@@ -0,0 +1,306 @@
+"""
+This module compiles recipe files into :class:`RecipeProgram` instances.
+
+A recipe file consists of one command per line. Every command starts with a
+time string of the form ``dd:hh:mm:ss`` giving the time (relative to the start
+of the recipe run) at which the command takes effect, followed by the command
+itself and its arguments. Anything after a ``#`` is a comment. The following
+commands are supported:
+
+``SXYY <value>``
+    Set the set point for the property with code ``YY`` of the resource type
+    with code ``X`` to ``value``
+
+``RXYY <value> <dd:hh:mm:ss>``
+    Ramp the set point for the property linearly from its current value to
+    ``value`` over the given duration. A later command for the same property
+    interrupts the ramp.
+
+``IXYY <value>``
+    Set the set point for the property to ``value`` and interpolate it
+    linearly towards the value of the next command for the same property,
+    which is reached at the time of that command
+
+``GHAR``
+    Harvest the tray, ending the recipe run. Anything after this command is
+    ignored.
+
+Recipes are compiled once, when they are uploaded, and the compiled program is
+stored with the recipe so that starting a run never has to parse the file
+again.
+"""
+import json
+from bisect import bisect_right
+from ..resources.models import ResourceProperty
+
+
+class RecipeCompileError(Exception):
+    """
+    Raised when a recipe file can't be compiled. :attr:`errors` holds a
+    message for every problem found in the file.
+    """
+    def __init__(self, errors):
+        super().__init__('\n'.join(errors))
+        self.errors = errors
+
+
+class RecipeProgram:
+    """
+    A compiled recipe. The set point for every property is described by a
+    piecewise linear function of the time since the start of a recipe run,
+    stored as a sorted list of knots. Each knot is an ``(offset, value,
+    slope)`` triple, meaning that `offset` seconds into the run the set point
+    is `value` and that it then changes by `slope` per second until the next
+    knot.
+
+    :param dict timelines: Maps property ids to lists of knots
+    :param end: The number of seconds after the start of a recipe run at which
+        the tray should be harvested
+    """
+    def __init__(self, timelines, end):
+        self.timelines = {
+            property_id: sorted(knots, key=lambda knot: knot[0]) for
+            property_id, knots in timelines.items()
+        }
+        self.end = end
+        self.offsets = {
+            property_id: [knot[0] for knot in knots] for property_id, knots in
+            self.timelines.items()
+        }
+
+    @property
+    def duration(self):
+        """ The number of seconds after which the last command runs """
+        return max(
+            [self.end] + [knots[-1][0] for knots in self.timelines.values()]
+        )
+
+    def get_set_point(self, property_id, offset):
+        """
+        Returns the set point for the property with id `property_id` in
+        effect `offset` seconds after the start of a recipe run, or None if
+        there is none
+        """
+        i = bisect_right(self.offsets.get(property_id, ()), offset)
+        if not i:
+            return None
+        knot_offset, value, slope = self.timelines[property_id][i-1]
+        return value + slope * (offset - knot_offset)
+
+    def get_set_points(self, offset):
+        """
+        Returns a dictionary mapping property ids to the set points in effect
+        `offset` seconds after the start of a recipe run
+        """
+        res = {}
+        for property_id in self.timelines:
+            value = self.get_set_point(property_id, offset)
+            if value is not None:
+                res[property_id] = value
+        return res
+
+    def to_json(self):
+        return json.dumps({
+            'timelines': {
+                property_id: [list(knot) for knot in knots] for
+                property_id, knots in self.timelines.items()
+            },
+            'end': self.end,
+        })
+
+    @classmethod
+    def from_json(cls, data):
+        data = json.loads(data)
+        timelines = {}
+        if 'commands' in data:
+            # Programs compiled before ramps were supported only contain
+            # plain set point commands
+            for offset, property_id, value in data['commands']:
+                timelines.setdefault(property_id, []).append(
+                    (offset, value, 0)
+                )
+        for property_id, knots in data.get('timelines', {}).items():
+            timelines[int(property_id)] = [tuple(knot) for knot in knots]
+        return cls(timelines, data['end'])
+
+
+def get_property_ids():
+    """
+    Returns a dictionary mapping the codes of every resource property (e.g.
+    "ATM") to its id
+    """
+    return {
+        code: pk for pk, code in ResourceProperty.objects.get_codes().items()
+    }
+
+
+def parse_time_string(time_string):
+    """
+    Converts a time string of the form ``dd:hh:mm:ss`` into a number of
+    seconds. Raises :class:`ValueError` if the string is malformed.
+    """
+    time_args = time_string.split(':')
+    if len(time_args) != 4:
+        raise ValueError()
+    days, hours, minutes, seconds = [int(arg) for arg in time_args]
+    if min(days, hours, minutes, seconds) < 0:
+        raise ValueError()
+    return seconds + 60*minutes + 60*60*hours + 60*60*24*days
+
+
+def build_timeline(commands):
+    """
+    Builds the list of knots for a single property from its commands, given
+    as ``(offset, command_type, value, duration, line_number)`` tuples sorted
+    by offset. Returns a ``(knots, errors)`` pair.
+    """
+    knots = []
+    errors = []
+    pending_ramp_end = None
+    for i, (offset, command_type, value, duration, line_number) in \
+            enumerate(commands):
+        if pending_ramp_end is not None:
+            # A ramp that ends by this command runs to completion, otherwise
+            # it is interrupted by this command
+            if pending_ramp_end[0] <= offset:
+                knots.append(pending_ramp_end)
+            pending_ramp_end = None
+        if command_type == 'S':
+            knots.append((offset, value, 0))
+        elif command_type == 'I':
+            slope = 0
+            if i + 1 < len(commands):
+                next_offset, _, next_value, _, _ = commands[i + 1]
+                if next_offset > offset:
+                    slope = (next_value - value) / (next_offset - offset)
+            knots.append((offset, value, slope))
+        elif command_type == 'R':
+            if not knots:
+                errors.append(
+                    'Line {}: Ramp has no set point to start from'.format(
+                        line_number
+                    )
+                )
+                continue
+            knot_offset, knot_value, slope = knots[-1]
+            current_value = knot_value + slope * (offset - knot_offset)
+            if duration:
+                knots.append(
+                    (offset, current_value, (value - current_value) / duration)
+                )
+                pending_ramp_end = (offset + duration, value, 0)
+            else:
+                knots.append((offset, value, 0))
+    if pending_ramp_end is not None:
+        knots.append(pending_ramp_end)
+    return knots, errors
+
+
+def compile_recipe(lines, property_ids=None):
+    """
+    Compiles the lines of a recipe file (as bytes or strings) into a
+    :class:`RecipeProgram`. Raises :class:`RecipeCompileError` listing every
+    syntax error in the file if it can't be compiled.
+
+    :param dict property_ids: Maps resource property codes to property ids.
+        Defaults to the result of :func:`get_property_ids`
+    """
+    if property_ids is None:
+        property_ids = get_property_ids()
+    commands = {}
+    end = None
+    errors = []
+    for line_number, line in enumerate(lines, 1):
+        def error(message, *args):
+            errors.append(
+                'Line {}: {}'.format(line_number, message.format(*args))
+            )
+        if isinstance(line, bytes):
+            try:
+                line = line.decode('utf-8')
+            except UnicodeDecodeError:
+                error('Line is not valid UTF-8 text')
+                continue
+        args = line.split('#', 1)[0].split()
+        if not args:
+            continue
+        time_string = args.pop(0)
+        try:
+            offset = parse_time_string(time_string)
+        except ValueError:
+            error('Invalid time string "{}"', time_string)
+            continue
+        if not args:
+            error('Missing command')
+            continue
+        command = args.pop(0)
+        command_type = command[0:1]
+        if command_type in ('S', 'R', 'I'):
+            property_id = property_ids.get(command[1:4])
+            if len(command) != 4 or property_id is None:
+                error('Invalid resource property "{}"', command[1:])
+                continue
+            if not args:
+                error('Missing value for command "{}"', command)
+                continue
+            try:
+                value = float(args.pop(0))
+            except ValueError:
+                error('Invalid value for command "{}"', command)
+                continue
+            duration = None
+            if command_type == 'R':
+                if not args:
+                    error('Missing duration for command "{}"', command)
+                    continue
+                duration_string = args.pop(0)
+                try:
+                    duration = parse_time_string(duration_string)
+                except ValueError:
+                    error('Invalid duration "{}"', duration_string)
+                    continue
+            commands.setdefault(property_id, []).append(
+                (offset, command_type, value, duration, line_number)
+            )
+        elif command_type == 'G':
+            if command == 'GHAR':
+                end = offset
+                if args:
+                    error('Too many arguments for command "{}"', command)
+                break
+        else:
+            error('Invalid command type "{}"', command_type)
+            continue
+        if args:
+            error('Too many arguments for command "{}"', command)
+    timelines = {}
+    for property_id, property_commands in commands.items():
+        property_commands.sort(key=lambda command: command[0])
+        timelines[property_id], timeline_errors = build_timeline(
+            property_commands
+        )
+        errors.extend(timeline_errors)
+    if end is None:
+        errors.append('Recipe file did not include an end timestamp.')
+    if errors:
+        raise RecipeCompileError(errors)
+    return RecipeProgram(timelines, end)
+
+
+#: Maps recipe ids to ``(source, program)`` pairs, where `source` is the
+#: serialized program from which `program` was loaded
+_programs = {}
+
+
+def load_program(recipe_id, source):
+    """
+    Returns the :class:`RecipeProgram` serialized in `source` for the recipe
+    with id `recipe_id`, reusing the last program loaded for that recipe if
+    its source hasn't changed
+    """
+    cached = _programs.get(recipe_id)
+    if cached is not None and cached[0] == source:
+        return cached[1]
+    program = RecipeProgram.from_json(source)
+    _programs[recipe_id] = (source, program)
+    return program
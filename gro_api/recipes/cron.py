@@ -0,0 +1,56 @@
+import time
+import logging
+from django.db.models import F
+from django_cron import CronJobBase, Schedule
+from .models import RecipeRun, RecipeRunAdherence
+from .compiler import RecipeCompileError
+from .adherence import update_adherence
+from .set_points import compact_set_points
+
+logger = logging.getLogger(__name__)
+
+
+class UpdateRecipeAdherence(CronJobBase):
+    """
+    This job calls :func:`~gro_api.recipes.adherence.update_adherence` every
+    hour for every recipe run that has started and whose adherence report
+    isn't complete yet, so that the report of a run is ready as soon as the
+    run ends.
+    """
+    RUN_EVERY_MINS = 60
+    schedule = Schedule(run_every_mins=RUN_EVERY_MINS)
+    code = 'recipes.update_recipe_adherence'
+
+    @staticmethod
+    def do():
+        logger.info('Running cron job %s', UpdateRecipeAdherence.code)
+        complete_run_ids = RecipeRunAdherence.objects.filter(
+            processed_until__gte=F('recipe_run__end_timestamp')
+        ).values('recipe_run_id')
+        runs = RecipeRun.objects.filter(
+            start_timestamp__lte=time.time()
+        ).exclude(pk__in=complete_run_ids).select_related('recipe')
+        for run in runs:
+            try:
+                update_adherence(run)
+            except RecipeCompileError as e:
+                logger.warning(
+                    'Failed to compile recipe "%s": %s', run.recipe.name, e
+                )
+
+
+class CompactSetPoints(CronJobBase):
+    """
+    This job calls :func:`~gro_api.recipes.set_points.compact_set_points`
+    every day to delete the set point rows left past the end of recipe runs
+    that have been shortened or stopped.
+    """
+    RUN_EVERY_MINS = 24 * 60
+    schedule = Schedule(run_every_mins=RUN_EVERY_MINS)
+    code = 'recipes.compact_set_points'
+
+    @staticmethod
+    def do():
+        logger.info('Running cron job %s', CompactSetPoints.code)
+        count = compact_set_points()
+        logger.info('Deleted %d set points', count)
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0004_auto_20150902_1801'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='program',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+    ]
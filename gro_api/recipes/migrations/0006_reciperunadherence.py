@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0005_recipe_program'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecipeRunAdherence',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', primary_key=True, serialize=False, auto_created=True)),
+                ('processed_until', models.IntegerField()),
+                ('data', models.TextField(default='{}')),
+                ('recipe_run', models.OneToOneField(related_name='adherence+', to='recipes.RecipeRun')),
+            ],
+        ),
+    ]
@@ -2,6 +2,7 @@ import time
 from django.db import models
 from ..plants.models import PlantType
 from ..resources.models import ResourceProperty
+from .compiler import compile_recipe, load_program
 
 
 class Recipe(models.Model):
@@ -10,11 +11,51 @@ class Recipe(models.Model):
         PlantType, related_name='recipes', blank=True
     )
     file = models.FileField(upload_to='recipes')
+    program = models.TextField(editable=False, blank=True, default='')
+
+    def get_program(self, save=True):
+        """
+        Returns the compiled :class:`~recipes.compiler.RecipeProgram` for this
+        recipe, compiling it first if that hasn't happened yet. The compiled
+        program is stored unless `save` is False. Raises
+        :class:`~recipes.compiler.RecipeCompileError` if the recipe file is
+        invalid.
+        """
+        if not self.program:
+            self.file.open('rb')
+            try:
+                program = compile_recipe(self.file)
+            finally:
+                self.file.close()
+            if not save:
+                return program
+            self.program = program.to_json()
+            self.save(update_fields=['program'])
+        return load_program(self.pk, self.program)
 
     def __str__(self):
         return self.name
 
 
+class RecipeRunManager(models.Manager):
+    def conflicting(self, tray_ids, start_timestamp, duration):
+        """
+        Returns a queryset of the recipe runs on the trays with ids in
+        `tray_ids` that would overlap with a run starting at
+        `start_timestamp` whose last command runs `duration` seconds later
+        """
+        return self.filter(
+            models.Q(
+                start_timestamp__lt=start_timestamp,
+                end_timestamp__gt=start_timestamp
+            ) | models.Q(
+                start_timestamp__gte=start_timestamp,
+                start_timestamp__lte=start_timestamp + duration
+            ),
+            tray_id__in=list(tray_ids)
+        )
+
+
 class RecipeRun(models.Model):
     class Meta:
         ordering = ['start_timestamp']
@@ -25,6 +66,32 @@ class RecipeRun(models.Model):
     recipe = models.ForeignKey(Recipe, related_name='runs')
     tray = models.ForeignKey('layout.Tray', related_name='recipe_runs+')
 
+    objects = RecipeRunManager()
+
+    def stop(self, timestamp=None):
+        """
+        Ends this run at `timestamp` (defaults to the current time), or at its
+        start if it hasn't started yet. Runs that have already ended are left
+        unchanged.
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        end_timestamp = max(self.start_timestamp, int(timestamp))
+        if end_timestamp < self.end_timestamp:
+            self.end_timestamp = end_timestamp
+            self.save(update_fields=['end_timestamp'])
+
+
+class RecipeRunAdherence(models.Model):
+    """
+    The running totals from which the adherence report of a recipe run is
+    computed (see :mod:`~recipes.adherence`). `data` holds the totals for
+    every property as JSON and covers the run up to `processed_until`.
+    """
+    recipe_run = models.OneToOneField(RecipeRun, related_name='adherence+')
+    processed_until = models.IntegerField()
+    data = models.TextField(default='{}')
+
 
 class SetPoint(models.Model):
     class Meta:
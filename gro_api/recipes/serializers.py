@@ -1,11 +1,15 @@
 import time
 import logging
-from django.core.exceptions import ObjectDoesNotExist
+from django.contrib.contenttypes.models import ContentType
 from rest_framework.exceptions import ValidationError
-from rest_framework.serializers import IntegerField
+from rest_framework.relations import HyperlinkedRelatedField
+from rest_framework.serializers import Serializer, IntegerField
+from ..gro_api.utils import atomic
 from ..gro_api.serializers import BaseSerializer
-from ..resources.models import ResourceProperty
+from ..layout.models import Tray, get_tray_locations
+from ..resources.serializers import ResourceLocationRelatedField
 from .models import Recipe, RecipeRun, SetPoint, ActuatorOverride
+from .compiler import compile_recipe, RecipeCompileError
 
 logger = logging.getLogger(__name__)
 
@@ -28,9 +32,23 @@ class RecipeSerializer(BaseSerializer):
                     )
         return value
 
-
-class InvalidTimeString(Exception):
-    pass
+    def validate(self, data):
+        recipe_file = data.get('file', None)
+        if recipe_file is not None and self.instance is not None and \
+                self.instance.runs.exists():
+            raise ValidationError(
+                'Changing the file of a recipe that has been run is not '
+                'allowed. Upload the new file as a separate recipe instead.'
+            )
+        if recipe_file is not None:
+            try:
+                program = compile_recipe(recipe_file)
+            except RecipeCompileError as e:
+                raise ValidationError({'file': e.errors})
+            finally:
+                recipe_file.seek(0)
+            data['program'] = program.to_json()
+        return data
 
 
 class RecipeRunSerializer(BaseSerializer):
@@ -40,17 +58,6 @@ class RecipeRunSerializer(BaseSerializer):
     start_timestamp = IntegerField(required=False, allow_null=True)
     end_timestamp = IntegerField(required=False, allow_null=True)
 
-    def parse_time_string(self, time_string):
-        time_args = time_string.split(b':')
-        if len(time_args) != 4:
-            raise InvalidTimeString()
-        try:
-            time_args = [int(arg) for arg in time_args]
-        except ValueError:
-            raise InvalidTimeString()
-        return time_args.pop() + 60*time_args.pop() + 60*60*time_args.pop() + \
-                60*60*24*time_args.pop()
-
     def create(self, validated_data):
         current_time = time.time()
         recipe = validated_data['recipe']
@@ -60,94 +67,18 @@ class RecipeRunSerializer(BaseSerializer):
             raise ValidationError(
                 'Start timestamp must be a time in the future.'
             )
-        qs = RecipeRun.objects.filter(
-            tray=tray, start_timestamp__lt=start_timestamp,
-            end_timestamp__gt=start_timestamp
-        )
-        if qs.count():
-            raise ValidationError(
-                'The proposed recipe run overlaps with an existing recipe run.'
-            )
         try:
-            next_start_timestamp = RecipeRun.objects.filter(
-                tray=tray, start_timestamp__gte=start_timestamp
-            ).earliest().start_timestamp
-        except ObjectDoesNotExist:
-            next_start_timestamp = float("inf")
-        set_points = []
-        end_timestamp = None
-        for line in recipe.file:
-            line = line.strip()
-            args = line.split(b' ')
-            try:
-                comment_start = args.index(b'#')
-                args = args[0:comment_start]
-            except ValueError:
-                pass
-            if not args:
-                continue
-            time_string = args.pop(0)
-            try:
-                timedelta = self.parse_time_string(time_string)
-            except InvalidTimeString:
-                logger.warning(
-                    'Encountered invalid time string "%s" in recipe "%s"',
-                    time_string, recipe.name
-                )
-                continue
-            command_timestamp = start_timestamp + timedelta
-            if command_timestamp >= next_start_timestamp:
-                raise ValidationError(
-                    'The proposed recipe run overlaps with an existing recipe '
-                    'run.'
-                )
-            command = args.pop(0)
-            command_type = command[0:1]
-            if command_type == b'S':
-                property = ResourceProperty.objects.get_by_natural_key(
-                        command[1:2], command[2:4]
-                )
-                value = float(args.pop(0))
-                set_point = SetPoint(
-                    tray=tray, property=property, timestamp=command_timestamp,
-                    value=value
-                )
-                set_points.append(set_point)
-            elif command_type == b'G':
-                if command == b'GHAR':
-                    end_timestamp = command_timestamp
-                    set_points.extend([
-                        SetPoint(
-                            tray=tray, property=property,
-                            timestamp=end_timestamp, value=None
-                        ) for property in ResourceProperty.objects.all()
-                    ])
-                    break
-            else:
-                logger.warning(
-                    'Encountered invalid command type "%s" in recipe "%s"',
-                    command_type, recipe.name
-                )
-                continue
-            if args:
-                logger.warning(
-                    'Recipe line "%s" contained extra arguments', line
-                )
-        if not end_timestamp:
+            program = recipe.get_program()
+        except RecipeCompileError as e:
+            raise ValidationError({'recipe': e.errors})
+        if RecipeRun.objects.conflicting(
+                [tray.pk], start_timestamp, program.duration).exists():
             raise ValidationError(
-                'Recipe file did not include an end timestamp.'
+                'The proposed recipe run overlaps with an existing recipe run.'
             )
         validated_data['start_timestamp'] = start_timestamp
-        validated_data['end_timestamp'] = end_timestamp
-        instance = super().create(validated_data)
-        try:
-            for set_point in set_points:
-                set_point.recipe_run = instance
-            SetPoint.objects.bulk_create(set_points)
-        except:
-            instance.delete()
-            raise
-        return instance
+        validated_data['end_timestamp'] = start_timestamp + program.end
+        return super().create(validated_data)
 
     def update(self, instance, validated_data):
         start_timestamp = validated_data.get(
@@ -177,20 +108,93 @@ class RecipeRunSerializer(BaseSerializer):
             raise ValidationError(
                 'Extending a recipe run is not allowed.'
             )
-        if end_timestamp < instance.end_timestamp:
-            SetPoint.objects.filter(
-                recipe_run=instance,
-                timestamp__gt=validated_data['end_timestamp']
-            ).delete()
-            SetPoint.objects.bulk_create([
-                SetPoint(
-                    tray=tray, property=property, timestamp=end_timestamp,
-                    value=None, recipe_run=instance
-                ) for property in ResourceProperty.objects.all()
-            ])
+        if end_timestamp < instance.start_timestamp:
+            raise ValidationError(
+                'A recipe run can\'t end before it starts.'
+            )
+        # Shortening a run only moves its end. Set points are computed from
+        # the program of the recipe up to the end of the run, and legacy set
+        # point rows past the end are cleaned up by a cron job.
         return super().update(instance, validated_data)
 
 
+class RecipeRunScheduleSerializer(Serializer):
+    """
+    Schedules a recipe to run on a set of trays at once, given either as a
+    list of `trays` or as a layout object whose trays should all run it
+    """
+    recipe = HyperlinkedRelatedField(
+        view_name='recipe-detail', queryset=Recipe.objects.all()
+    )
+    trays = HyperlinkedRelatedField(
+        view_name='tray-detail', queryset=Tray.objects.all(), many=True,
+        required=False
+    )
+    location = ResourceLocationRelatedField(required=False)
+    start_timestamp = IntegerField(required=False, allow_null=True)
+
+    def validate(self, data):
+        if ('trays' in data) == ('location' in data):
+            raise ValidationError(
+                'Exactly one of `trays` and `location` must be given.'
+            )
+        if 'trays' in data:
+            tray_ids = set(tray.pk for tray in data['trays'])
+        else:
+            location = data['location']
+            location = (
+                ContentType.objects.get_for_model(location).pk, location.pk
+            )
+            tray_ids = set(
+                tray_id for tray_id, locations in
+                get_tray_locations().items() if location in locations
+            )
+        if not tray_ids:
+            raise ValidationError('No trays were selected.')
+        data['tray_ids'] = sorted(tray_ids)
+        return data
+
+    def create(self, validated_data):
+        current_time = time.time()
+        recipe = validated_data['recipe']
+        tray_ids = validated_data['tray_ids']
+        start_timestamp = validated_data.get('start_timestamp', None)
+        if start_timestamp is None:
+            start_timestamp = int(current_time)
+        if start_timestamp < int(current_time):
+            raise ValidationError(
+                'Start timestamp must be a time in the future.'
+            )
+        try:
+            program = recipe.get_program()
+        except RecipeCompileError as e:
+            raise ValidationError({'recipe': e.errors})
+        with atomic():
+            conflicts = set(RecipeRun.objects.conflicting(
+                tray_ids, start_timestamp, program.duration
+            ).values_list('tray_id', flat=True))
+            if conflicts:
+                raise ValidationError(
+                    'The proposed recipe runs overlap with existing recipe '
+                    'runs on trays {}.'.format(
+                        ', '.join(str(tray_id) for tray_id in sorted(conflicts))
+                    )
+                )
+            RecipeRun.objects.bulk_create([
+                RecipeRun(
+                    recipe=recipe, tray_id=tray_id,
+                    start_timestamp=start_timestamp,
+                    end_timestamp=start_timestamp + program.end
+                ) for tray_id in tray_ids
+            ])
+        # Not every database backend sets primary keys in `bulk_create`, so
+        # read the new runs back
+        return list(RecipeRun.objects.filter(
+            recipe=recipe, start_timestamp=start_timestamp,
+            tray_id__in=tray_ids
+        ).order_by('tray_id'))
+
+
 class SetPointSerializer(BaseSerializer):
     class Meta:
         model = SetPoint
@@ -0,0 +1,169 @@
+"""
+This module defines functions for reading the set points that are in effect
+for a group of trays in a bounded number of queries, regardless of how many
+trays or resource properties are involved.
+
+Set points are not stored per tray. Every :class:`~recipes.models.RecipeRun`
+refers to the compiled program of its recipe, which is shared by every run of
+that recipe, and set points are computed by evaluating that program at the
+time of interest relative to the start of the run.
+"""
+import time
+import logging
+from bisect import bisect_right
+from collections import defaultdict
+from django.db.models import F
+from ..resources.models import ResourceProperty
+from .models import RecipeRun, SetPoint
+from .compiler import RecipeCompileError
+
+logger = logging.getLogger(__name__)
+
+
+def get_programs(runs):
+    """
+    Yields ``(run, program)`` pairs for every run in `runs`, skipping runs
+    whose recipe can't be compiled
+    """
+    for run in runs:
+        try:
+            program = run.recipe.get_program()
+        except RecipeCompileError as e:
+            logger.warning(
+                'Failed to compile recipe "%s": %s', run.recipe.name, e
+            )
+            continue
+        yield run, program
+
+
+def get_current_set_points(tray_ids, timestamp=None, include_ended=False):
+    """
+    Returns a dictionary mapping the id of every tray in `tray_ids` that has a
+    set point in effect at `timestamp` (defaults to the current time) to a
+    dictionary mapping resource property ids to set point values. If
+    `include_ended` is True, every property of a tray on which a recipe run
+    has ended maps to None unless a current run sets it, like the null set
+    points for every property that used to be stored at the end of every run.
+    """
+    if timestamp is None:
+        timestamp = time.time()
+    res = defaultdict(dict)
+    if include_ended:
+        ended_tray_ids = RecipeRun.objects.filter(
+            tray_id__in=list(tray_ids), end_timestamp__lte=timestamp
+        ).values_list('tray_id', flat=True).distinct()
+        property_ids = list(ResourceProperty.objects.get_codes())
+        for tray_id in ended_tray_ids:
+            res[tray_id] = dict.fromkeys(property_ids)
+    runs = RecipeRun.objects.filter(
+        tray_id__in=list(tray_ids), start_timestamp__lte=timestamp,
+        end_timestamp__gt=timestamp
+    ).select_related('recipe').order_by('start_timestamp')
+    for run, program in get_programs(runs):
+        res[run.tray_id].update(program.get_set_points(
+            timestamp - run.start_timestamp
+        ))
+    return res
+
+
+def get_set_point_history(tray_ids, start, end):
+    """
+    Returns a dictionary mapping the id of every tray in `tray_ids` to a
+    dictionary mapping resource property ids to time-ordered lists of
+    ``(timestamp, value, slope)`` triples describing the set points for that
+    property over ``[start, end]``: from `timestamp` on, the set point is
+    `value` and changes by `slope` per second until the next triple. Each
+    list starts with the set point in effect at `start` (if any), reported at
+    `start`, and a value of None marks the end of a recipe run.
+    """
+    res = defaultdict(lambda: defaultdict(list))
+    runs = RecipeRun.objects.filter(
+        tray_id__in=list(tray_ids), start_timestamp__lte=end,
+        end_timestamp__gt=start
+    ).select_related('recipe').order_by('start_timestamp')
+    for run, program in get_programs(runs):
+        history = res[run.tray_id]
+        window_start = max(start, run.start_timestamp)
+        for property_id, knots in program.timelines.items():
+            points = history[property_id]
+            offset = window_start - run.start_timestamp
+            i = bisect_right(program.offsets[property_id], offset)
+            if i:
+                knot_offset, value, slope = knots[i-1]
+                points.append((
+                    window_start, value + slope * (offset - knot_offset),
+                    slope
+                ))
+            for knot_offset, value, slope in knots[i:]:
+                timestamp = run.start_timestamp + knot_offset
+                if timestamp > end or timestamp >= run.end_timestamp:
+                    break
+                points.append((timestamp, value, slope))
+            if run.end_timestamp <= end:
+                points.append((run.end_timestamp, None, 0))
+    for history in res.values():
+        for points in history.values():
+            points.sort(key=lambda point: point[0])
+    return res
+
+
+def get_set_points_at(tray_ids, timestamps):
+    """
+    Returns a dictionary mapping the id of every tray in `tray_ids` to a
+    dictionary mapping resource property ids to lists of the set points for
+    that property at each of the given `timestamps`, in the same order. A
+    value is None where no recipe run was setting the property. Each
+    timestamp is located with a binary search over the sorted start times of
+    the runs on the tray and then over the knots of the run's program, so the
+    cost grows with the number of timestamps rather than with the length of
+    the history.
+    """
+    timestamps = list(timestamps)
+    if not timestamps:
+        return {tray_id: {} for tray_id in tray_ids}
+    runs_by_tray = defaultdict(list)
+    runs = RecipeRun.objects.filter(
+        tray_id__in=list(tray_ids), start_timestamp__lte=max(timestamps),
+        end_timestamp__gt=min(timestamps)
+    ).select_related('recipe').order_by('start_timestamp')
+    for run, program in get_programs(runs):
+        runs_by_tray[run.tray_id].append((run, program))
+    res = {}
+    for tray_id in tray_ids:
+        tray_runs = runs_by_tray[tray_id]
+        starts = [run.start_timestamp for run, _ in tray_runs]
+        values = defaultdict(lambda: [None] * len(timestamps))
+        for i, timestamp in enumerate(timestamps):
+            j = bisect_right(starts, timestamp)
+            if not j:
+                continue
+            run, program = tray_runs[j-1]
+            if timestamp >= run.end_timestamp:
+                continue
+            offset = timestamp - run.start_timestamp
+            for property_id in program.timelines:
+                value = program.get_set_point(property_id, offset)
+                if value is not None:
+                    values[property_id][i] = value
+        res[tray_id] = dict(values)
+    return res
+
+
+def compact_set_points(batch_size=1000):
+    """
+    Deletes the legacy :class:`~recipes.models.SetPoint` rows past the end of
+    their recipe run, which are left behind when a run is shortened, in
+    batches of `batch_size` rows. Returns the number of rows deleted.
+    """
+    stale_set_points = SetPoint.objects.filter(
+        timestamp__gt=F('recipe_run__end_timestamp')
+    )
+    count = 0
+    while True:
+        batch = list(
+            stale_set_points.values_list('pk', flat=True)[:batch_size]
+        )
+        if not batch:
+            return count
+        SetPoint.objects.filter(pk__in=batch).delete()
+        count += len(batch)
@@ -0,0 +1,414 @@
+import time
+import shutil
+import tempfile
+from django.test import TestCase, override_settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+from django.core.files.uploadedfile import SimpleUploadedFile
+from ..gro_api.test import APITestCase, run_with_layouts
+from ..layout.models import Enclosure, Tray
+from ..resources.models import ResourceType, ResourceProperty, Resource
+from ..sensors.models import SensorType, Sensor, SensingPoint, DataPoint
+from .models import RecipeRun, SetPoint
+from .adherence import get_adherence_report
+from .compiler import compile_recipe, RecipeCompileError
+from .set_points import (
+    get_current_set_points, get_set_point_history, get_set_points_at,
+    compact_set_points
+)
+
+TEST_RECIPE = b"""
+00:00:00:00 SATM 20 # Start warm
+00:12:00:00 SATM 15
+01:00:00:00 GHAR
+"""
+
+class RecipeAuthMixin:
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(
+            'recipes', 'recipes@test.com', 'recipes'
+        )
+        gardeners_group = Group.objects.get(name='Gardeners')
+        cls.user.groups.add(gardeners_group)
+        layout_editors_group = Group.objects.get(name='LayoutEditors')
+        cls.user.groups.add(layout_editors_group)
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.media_settings = override_settings(MEDIA_ROOT=self.media_root)
+        self.media_settings.enable()
+        self.client.force_authenticate(user=self.user)
+
+    def tearDown(self):
+        self.client.force_authenticate()
+        self.media_settings.disable()
+        shutil.rmtree(self.media_root)
+
+    def create_recipe(self, contents=TEST_RECIPE):
+        return self.client.post(self.url_for_object('recipe'), {
+            'name': 'Test Recipe',
+            'file': SimpleUploadedFile('test_recipe.txt', contents),
+        }, format='multipart')
+
+    def create_tray(self):
+        res = self.client.post(self.url_for_object('tray'), {
+            'parent': self.url_for_object('enclosure', 1), 'x': 0, 'y': 0,
+            'z': 0, 'length': 1, 'width': 1, 'height': 1
+        })
+        self.assertEqual(res.status_code, 201)
+        return res.data
+
+
+class RecipeTestCase(RecipeAuthMixin, APITestCase):
+    @run_with_layouts('tray')
+    def test_invalid_recipe(self):
+        res = self.create_recipe(
+            b"00:00:00 SATM 20\n00:00:00:00 SAXX 20\n00:00:00:00 SATM\n"
+        )
+        self.assertEqual(res.status_code, 400)
+        # Every error in the file should be reported at once
+        self.assertEqual(len(res.data['file']), 4)
+
+    @run_with_layouts('tray')
+    def test_recipe_run(self):
+        res = self.create_recipe()
+        self.assertEqual(res.status_code, 201)
+        recipe = res.data
+        tray = self.create_tray()
+        start_timestamp = int(time.time()) + 60
+        res = self.client.post(self.url_for_object('recipeRun'), {
+            'recipe': recipe['url'],
+            'tray': tray['url'],
+            'start_timestamp': start_timestamp,
+        })
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(res.data['end_timestamp'], start_timestamp + 86400)
+        tray_id = int(tray['url'].split('/')[-2])
+        property_id = ResourceProperty.objects.get_by_natural_key('A', 'TM').pk
+        for offset, value in [(0, 20), (43199, 20), (43200, 15)]:
+            set_points = get_current_set_points(
+                [tray_id], start_timestamp + offset
+            )
+            self.assertEqual(set_points[tray_id], {property_id: value})
+        set_points = get_current_set_points([tray_id], start_timestamp + 86400)
+        self.assertFalse(set_points[tray_id])
+        history = get_set_point_history(
+            [tray_id], start_timestamp + 3600, start_timestamp + 86400
+        )
+        self.assertEqual(history[tray_id][property_id], [
+            (start_timestamp + 3600, 20, 0), (start_timestamp + 43200, 15, 0),
+            (start_timestamp + 86400, None, 0)
+        ])
+        res = self.client.get(tray['url'] + 'set_points/')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data, {})
+        res = self.client.get(self.url_for_object('tray') + 'current_set_points/')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data, {tray['url']: {}})
+        # Runs don't expand their recipe into set point rows
+        self.assertFalse(SetPoint.objects.exists())
+        # The file of a recipe that has been run can't be changed
+        res = self.client.put(recipe['url'], {
+            'name': 'Test Recipe',
+            'file': SimpleUploadedFile('test_recipe.txt', TEST_RECIPE),
+        }, format='multipart')
+        self.assertEqual(res.status_code, 400)
+        self.assertIn('not allowed', str(res.data))
+        # A second run on the same tray can't overlap the first one
+        res = self.client.post(self.url_for_object('recipeRun'), {
+            'recipe': recipe['url'],
+            'tray': tray['url'],
+            'start_timestamp': start_timestamp - 3600,
+        })
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(RecipeRun.objects.count(), 1)
+
+    @run_with_layouts('tray')
+    def test_current_set_points(self):
+        res = self.create_recipe()
+        self.assertEqual(res.status_code, 201)
+        recipe_id = int(res.data['url'].split('/')[-2])
+        idle_tray = self.create_tray()
+        tray = Tray.objects.create(parent=Enclosure.get_solo(), x=1)
+        tray = self.client.get(self.url_for_object('tray', tray.pk)).data
+        # Runs can't be started in the past through the API
+        current_time = int(time.time())
+        RecipeRun.objects.create(
+            recipe_id=recipe_id, tray_id=int(tray['url'].split('/')[-2]),
+            start_timestamp=current_time - 60,
+            end_timestamp=current_time - 60 + 86400
+        )
+        res = self.client.get(tray['url'] + 'set_points/')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data, {'ATM': 20})
+        res = self.client.get(self.url_for_object('tray') + 'current_set_points/')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data, {idle_tray['url']: {}, tray['url']: {'ATM': 20}})
+
+    @run_with_layouts('tray')
+    def test_stop_recipe_run(self):
+        res = self.create_recipe()
+        self.assertEqual(res.status_code, 201)
+        recipe = res.data
+        tray = self.create_tray()
+        tray_id = int(tray['url'].split('/')[-2])
+        current_time = int(time.time())
+        run = RecipeRun.objects.create(
+            recipe_id=int(recipe['url'].split('/')[-2]), tray_id=tray_id,
+            start_timestamp=current_time - 60,
+            end_timestamp=current_time - 60 + 86400
+        )
+        property_id = ResourceProperty.objects.get_by_natural_key('A', 'TM').pk
+        # Runs started before set points were computed have set point rows
+        SetPoint.objects.bulk_create([
+            SetPoint(
+                tray_id=tray_id, property_id=property_id, recipe_run=run,
+                timestamp=current_time - 60 + offset, value=value
+            ) for offset, value in [(0, 20), (43200, 15), (86400, None)]
+        ])
+        run_url = self.url_for_object('recipeRun', run.pk)
+        res = self.client.put(run_url, {
+            'recipe': recipe['url'], 'tray': tray['url'],
+            'start_timestamp': run.start_timestamp,
+            'end_timestamp': run.start_timestamp + 50000,
+        })
+        self.assertEqual(res.status_code, 200)
+        res = self.client.get(self.url_for_object('setPoint'))
+        self.assertEqual(len(res.data['results']), 2)
+        res = self.client.post(run_url + 'stop/')
+        self.assertEqual(res.status_code, 200)
+        self.assertLessEqual(res.data['end_timestamp'], time.time())
+        self.assertFalse(get_current_set_points([tray_id])[tray_id])
+        # Every property has a null set point once a run has ended
+        res = self.client.get(tray['url'] + 'set_points/')
+        self.assertEqual(res.data, dict.fromkeys(
+            ResourceProperty.objects.get_codes().values()
+        ))
+        self.assertIn('ATM', res.data)
+        self.assertEqual(compact_set_points(batch_size=1), 2)
+        # Set point rows only exist for old runs and can't be written
+        res = self.client.post(self.url_for_object('setPoint'), {
+            'tray': tray['url'], 'value': 20
+        })
+        self.assertIn(res.status_code, (403, 405))
+        self.assertEqual(SetPoint.objects.count(), 1)
+
+    @run_with_layouts('tray')
+    def test_historical_set_points(self):
+        res = self.create_recipe()
+        self.assertEqual(res.status_code, 201)
+        recipe_id = int(res.data['url'].split('/')[-2])
+        tray = self.create_tray()
+        tray_id = int(tray['url'].split('/')[-2])
+        property_id = ResourceProperty.objects.get_by_natural_key('A', 'TM').pk
+        for start_timestamp in (1000, 1000 + 2 * 86400):
+            RecipeRun.objects.create(
+                recipe_id=recipe_id, tray_id=tray_id,
+                start_timestamp=start_timestamp,
+                end_timestamp=start_timestamp + 86400
+            )
+        timestamps = [0, 1000, 44200, 87400, 1000 + 2 * 86400]
+        set_points = get_set_points_at([tray_id], timestamps)
+        self.assertEqual(
+            set_points[tray_id][property_id], [None, 20, 15, None, 20]
+        )
+        res = self.client.get(
+            self.url_for_object('tray') + 'historical_set_points/',
+            {'timestamp': [44200, 1000], 'tray': tray_id, 'property': 'ATM'}
+        )
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data['timestamps'], [1000, 44200])
+        self.assertEqual(res.data['trays'], {tray['url']: {'ATM': [20, 15]}})
+        res = self.client.get(
+            self.url_for_object('tray') + 'historical_set_points/',
+            {'timestamp': 1000, 'property': 'XXX'}
+        )
+        self.assertEqual(res.status_code, 400)
+
+
+class RecipeAdherenceTestCase(RecipeAuthMixin, APITestCase):
+    @run_with_layouts('tray')
+    def test_adherence(self):
+        res = self.create_recipe()
+        self.assertEqual(res.status_code, 201)
+        recipe_id = int(res.data['url'].split('/')[-2])
+        tray = self.create_tray()
+        tray_id = int(tray['url'].split('/')[-2])
+        ResourceProperty.objects.filter(
+            resource_type__code='A', code='TM'
+        ).update(min_operating_value=0, max_operating_value=100)
+        resource = Resource.objects.create(
+            index=1, resource_type=ResourceType.objects.get_by_natural_key('A'),
+            location=Enclosure.get_solo()
+        )
+        sensor = Sensor.objects.create(
+            index=1, sensor_type=SensorType.objects.first(), resource=resource
+        )
+        sensing_point = SensingPoint.objects.create(
+            index=1, sensor=sensor,
+            property=ResourceProperty.objects.get_by_natural_key('A', 'TM')
+        )
+        start_timestamp = 1000
+        run = RecipeRun.objects.create(
+            recipe_id=recipe_id, tray_id=tray_id,
+            start_timestamp=start_timestamp,
+            end_timestamp=start_timestamp + 86400
+        )
+        # The set point is 20 for the first half of the run and 15 for the
+        # second half, so a constant reading of 20 and then 25 is on target
+        # and then 10 degrees off
+        for offset, value in [(-60, 20), (43200, 25)]:
+            DataPoint.objects.create(
+                sensing_point=sensing_point,
+                timestamp=start_timestamp + offset, value=value
+            )
+        report = get_adherence_report(run, until=start_timestamp + 43200)
+        self.assertFalse(report['complete'])
+        scores = list(report['properties'].values())[0]
+        self.assertEqual(scores['time_in_tolerance'], 1)
+        report = get_adherence_report(run)
+        self.assertTrue(report['complete'])
+        scores = list(report['properties'].values())[0]
+        self.assertEqual(scores['tolerance'], 5)
+        self.assertEqual(scores['controlled_time'], 86400)
+        self.assertEqual(scores['time_in_tolerance'], 0.5)
+        self.assertEqual(scores['mean_error'], 5)
+        self.assertEqual(scores['worst_deviation'], 10)
+        self.assertEqual(
+            scores['worst_deviation_timestamp'], start_timestamp + 43200
+        )
+        res = self.client.get(
+            self.url_for_object('recipeRun', run.pk) + 'adherence/'
+        )
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data['properties']['ATM'], scores)
+
+
+class RecipePreviewTestCase(RecipeAuthMixin, APITestCase):
+    @run_with_layouts('tray')
+    def test_preview(self):
+        res = self.create_recipe()
+        self.assertEqual(res.status_code, 201)
+        recipe = res.data
+        tray = self.create_tray()
+        tray_id = int(tray['url'].split('/')[-2])
+        start_timestamp = int(time.time()) + 60
+        res = self.client.post(self.url_for_object('recipeRun'), {
+            'recipe': recipe['url'],
+            'tray': tray['url'],
+            'start_timestamp': start_timestamp,
+        })
+        self.assertEqual(res.status_code, 201)
+        res = self.client.get(recipe['url'] + 'preview/', {
+            'start_timestamp': start_timestamp + 3600, 'tray': tray_id
+        })
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(
+            res.data['timeline'], {'ATM': [[0, 20, 0], [43200, 15, 0]]}
+        )
+        self.assertEqual(len(res.data['conflicts']), 1)
+        self.assertEqual(res.data['conflicts'][0]['tray'], tray['url'])
+        res = self.client.get(recipe['url'] + 'preview/', {
+            'start_timestamp': start_timestamp + 86400, 'tray': tray_id
+        })
+        self.assertEqual(res.data['conflicts'], [])
+        # Unsaved files can be previewed as well
+        preview_url = self.url_for_object('recipe') + 'preview_file/'
+        res = self.client.post(preview_url, {
+            'file': SimpleUploadedFile('test_recipe.txt', TEST_RECIPE),
+        }, format='multipart')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data['end_timestamp'] - res.data['start_timestamp'], 86400)
+        res = self.client.post(preview_url, {
+            'file': SimpleUploadedFile('test_recipe.txt', b'00:00 SATM 1'),
+        }, format='multipart')
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(RecipeRun.objects.count(), 1)
+
+
+class RecipeRunScheduleTestCase(RecipeAuthMixin, APITestCase):
+    @run_with_layouts('tray')
+    def test_schedule(self):
+        res = self.create_recipe()
+        self.assertEqual(res.status_code, 201)
+        recipe = res.data
+        first_tray = self.create_tray()
+        second_tray = Tray.objects.create(parent=Enclosure.get_solo(), x=1)
+        schedule_url = self.url_for_object('recipeRun') + 'schedule/'
+        start_timestamp = int(time.time()) + 60
+        # Every tray in the enclosure
+        res = self.client.post(schedule_url, {
+            'recipe': recipe['url'],
+            'location': self.url_for_object('enclosure', 1),
+            'start_timestamp': start_timestamp,
+        })
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(len(res.data), 2)
+        self.assertEqual(RecipeRun.objects.count(), 2)
+        # Nothing is created if any of the runs would overlap
+        res = self.client.post(schedule_url, {
+            'recipe': recipe['url'],
+            'trays': [first_tray['url']],
+            'start_timestamp': start_timestamp + 3600,
+        })
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(RecipeRun.objects.count(), 2)
+        res = self.client.post(schedule_url, {
+            'recipe': recipe['url'],
+            'trays': [
+                first_tray['url'],
+                self.url_for_object('tray', second_tray.pk)
+            ],
+            'start_timestamp': start_timestamp + 2 * 86400,
+        })
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(RecipeRun.objects.count(), 4)
+        res = self.client.post(schedule_url, {'recipe': recipe['url']})
+        self.assertEqual(res.status_code, 400)
+
+
+class RecipeCompilerTestCase(TestCase):
+    property_ids = {'ATM': 1, 'AHU': 2}
+
+    def test_compile(self):
+        program = compile_recipe(
+            TEST_RECIPE.splitlines(), property_ids=self.property_ids
+        )
+        self.assertEqual(program.timelines, {1: [(0, 20, 0), (43200, 15, 0)]})
+        self.assertEqual(program.end, 86400)
+        self.assertEqual(
+            program.to_json(),
+            type(program).from_json(program.to_json()).to_json()
+        )
+
+    def test_ramps(self):
+        program = compile_recipe([
+            '00:00:00:00 SATM 10',
+            '00:01:00:00 RATM 20 00:01:00:00 # Warm up over an hour',
+            '00:00:00:00 IAHU 50',
+            '00:10:00:00 SAHU 60',
+            '00:12:00:00 RAHU 0 00:04:00:00',
+            '00:14:00:00 SAHU 70 # Interrupts the ramp',
+            '01:00:00:00 GHAR',
+        ], property_ids=self.property_ids)
+        self.assertEqual(program.get_set_point(1, 3600), 10)
+        self.assertEqual(program.get_set_point(1, 5400), 15)
+        self.assertEqual(program.get_set_point(1, 7200), 20)
+        self.assertEqual(program.get_set_point(1, 80000), 20)
+        self.assertEqual(program.get_set_point(2, 18000), 55)
+        self.assertEqual(program.get_set_point(2, 46800), 45)
+        self.assertEqual(program.get_set_point(2, 57600), 70)
+        with self.assertRaises(RecipeCompileError):
+            compile_recipe([
+                '00:00:00:00 RATM 20 00:01:00:00', '01:00:00:00 GHAR'
+            ], property_ids=self.property_ids)
+
+    def test_errors(self):
+        with self.assertRaises(RecipeCompileError) as cm:
+            compile_recipe([
+                '00:00:00:00 XATM 20', '00:00:00:00 SATM 20 30',
+                '00:00:00:00 SATM abc'
+            ], property_ids=self.property_ids)
+        self.assertEqual(len(cm.exception.errors), 4)
+        self.assertTrue(cm.exception.errors[0].startswith('Line 1:'))
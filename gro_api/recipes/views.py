@@ -1,8 +1,20 @@
-from rest_framework.viewsets import ModelViewSet
+import time
+from django.db.models import F
+from rest_framework import status
+from rest_framework.reverse import reverse
+from rest_framework.response import Response
+from rest_framework.viewsets import ModelViewSet, ReadOnlyModelViewSet
+from rest_framework.decorators import detail_route, list_route
+from rest_framework.exceptions import ValidationError
+from rest_framework.utils.field_mapping import get_detail_view_name
+from ..layout.models import Tray
+from ..resources.models import ResourceProperty
 from .models import Recipe, RecipeRun, SetPoint, ActuatorOverride
+from .compiler import compile_recipe, RecipeCompileError
+from .adherence import get_adherence_report
 from .serializers import (
-    RecipeSerializer, RecipeRunSerializer, SetPointSerializer,
-    ActuatorOverrideSerializer
+    RecipeSerializer, RecipeRunSerializer, RecipeRunScheduleSerializer,
+    SetPointSerializer, ActuatorOverrideSerializer
 )
 
 class RecipeViewSet(ModelViewSet):
@@ -10,18 +22,162 @@ class RecipeViewSet(ModelViewSet):
     queryset = Recipe.objects.all()
     serializer_class = RecipeSerializer
 
+    def get_preview(self, program, request):
+        """
+        Describes what running `program` would do, given the `start_timestamp`
+        (defaults to now) and `tray` ids in the query parameters of `request`
+        """
+        try:
+            start_timestamp = int(request.query_params.get(
+                'start_timestamp', time.time()
+            ))
+            tray_ids = [
+                int(pk) for pk in request.query_params.getlist('tray')
+            ]
+        except ValueError:
+            raise ValidationError(
+                '`start_timestamp` must be a timestamp and `tray` must be a '
+                'tray id'
+            )
+        property_codes = ResourceProperty.objects.get_codes()
+        conflicts = RecipeRun.objects.conflicting(
+            tray_ids, start_timestamp, program.duration
+        ).order_by('tray_id', 'start_timestamp')
+        def url_for(model, pk):
+            return reverse(
+                get_detail_view_name(model), kwargs={'pk': pk},
+                request=request
+            )
+        return {
+            'start_timestamp': start_timestamp,
+            'end_timestamp': start_timestamp + program.end,
+            'timeline': {
+                property_codes[property_id]: [list(knot) for knot in knots]
+                for property_id, knots in program.timelines.items()
+            },
+            'conflicts': [{
+                'tray': url_for(Tray, run.tray_id),
+                'recipe_run': url_for(RecipeRun, run.pk),
+                'start_timestamp': run.start_timestamp,
+                'end_timestamp': run.end_timestamp,
+            } for run in conflicts],
+        }
+
+    @detail_route(methods=["get"])
+    def preview(self, request, pk=None):
+        """
+        Preview what this recipe would do if it was started at
+        `start_timestamp` (defaults to now) without starting it. The response
+        holds a timeline for every property the recipe controls, as a list of
+        `[offset, value, slope]` knots: `offset` seconds into the run, the set
+        point is `value` and then changes by `slope` per second until the next
+        knot. It also lists the existing runs on the trays given by `tray` ids
+        that the new run would overlap with.
+        """
+        recipe = self.get_object()
+        try:
+            program = recipe.get_program(save=False)
+        except RecipeCompileError as e:
+            raise ValidationError({'file': e.errors})
+        return Response(self.get_preview(program, request))
+
+    @list_route(methods=["post"])
+    def preview_file(self, request):
+        """
+        Preview a recipe `file` without saving it. Takes the same query
+        parameters and returns the same data as the `preview` route of a saved
+        recipe, or every syntax error in the file.
+        """
+        recipe_file = request.data.get('file', None)
+        if recipe_file is None:
+            raise ValidationError({'file': ['This field is required.']})
+        try:
+            program = compile_recipe(recipe_file)
+        except RecipeCompileError as e:
+            raise ValidationError({'file': e.errors})
+        return Response(self.get_preview(program, request))
+
 
 class RecipeRunViewSet(ModelViewSet):
     """ An instance of a recipe being run on a tray """
     queryset = RecipeRun.objects.all()
     serializer_class = RecipeRunSerializer
 
+    @list_route(methods=["post"])
+    def schedule(self, request):
+        """
+        Start a `recipe` on many trays at once, given either as a list of
+        `trays` or as a layout object (`location`) whose trays should all run
+        it. All of the runs start at `start_timestamp` (defaults to now).
+        Either every run is created or, if any of them would overlap with an
+        existing run, none are.
+        ---
+        request_serializer: gro_api.recipes.serializers.RecipeRunScheduleSerializer
+        response_serializer: gro_api.recipes.serializers.RecipeRunSerializer
+        """
+        serializer = RecipeRunScheduleSerializer(
+            data=request.data, context={'request': request}
+        )
+        serializer.is_valid(raise_exception=True)
+        runs = serializer.save()
+        response_serializer = self.get_serializer(runs, many=True)
+        return Response(
+            response_serializer.data, status=status.HTTP_201_CREATED
+        )
+
+    @detail_route(methods=["post"])
+    def stop(self, request, pk=None):
+        """
+        Stop this recipe run now. A run that hasn't started yet ends at its
+        start time, so it never takes effect.
+        ---
+        response_serializer: gro_api.recipes.serializers.RecipeRunSerializer
+        """
+        instance = self.get_object()
+        instance.stop()
+        serializer = self.get_serializer(instance)
+        return Response(serializer.data)
+
+    @detail_route(methods=["get"])
+    def adherence(self, request, pk=None):
+        """
+        Get a report of how closely the tray tracked this recipe run so far,
+        comparing the set points of the run with the readings of every active
+        sensing point in the resources serving the tray. For every property
+        the recipe controls, `controlled_time` is the number of seconds for
+        which both were known, `time_in_tolerance` is the fraction of that
+        time the reading was within `tolerance` of the set point (the control
+        deadband of the actuators for the property, or 5% of its operating
+        range if no actuator controls it), `mean_error`, `mean_absolute_error`
+        and `rms_error` summarize the reading minus the set point, and
+        `worst_deviation` is the largest such error along with the time it
+        occurred. Reports are updated incrementally and are stored once the
+        run has ended.
+        """
+        instance = self.get_object()
+        try:
+            report = get_adherence_report(instance)
+        except RecipeCompileError as e:
+            raise ValidationError({'recipe': e.errors})
+        property_codes = ResourceProperty.objects.get_codes()
+        report['properties'] = {
+            property_codes[property_id]: scores for property_id, scores in
+            report['properties'].items()
+        }
+        return Response(report)
+
 
-class SetPointViewSet(ModelViewSet):
+class SetPointViewSet(ReadOnlyModelViewSet):
     """
-    A desired value for a resource property at a given time for a recipe run
+    A desired value for a resource property at a given time for a recipe run.
+    Recipe runs no longer create these; set points are computed from the
+    compiled program of the recipe instead. Only runs started before that
+    change have them, so they are read-only. Set points past the end of their
+    run are left out.
     """
-    queryset = SetPoint.objects.all()
+    queryset = SetPoint.objects.filter(
+        timestamp__lte=F('recipe_run__end_timestamp')
+    )
     serializer_class = SetPointSerializer
 
 
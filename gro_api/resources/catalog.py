@@ -0,0 +1,118 @@
+"""
+This module holds an in-process cache of the resource catalog: every
+:class:`~resources.models.ResourceType`, :class:`~resources.models.ResourceProperty`
+and :class:`~resources.models.ResourceEffect`, indexed both by primary key and
+by natural key. The catalog is loaded from fixtures and almost never changes,
+but it is read in hot loops (recipe compilation, set point responses, fixture
+loading), so reading it from memory saves a query per lookup.
+
+Changes made through the ORM to any of these models are picked up through
+signals, which clear the cache of the current process and bump a shared
+:class:`~gro_api.utils.VersionStamp` so that every other worker process
+reloads its cache the next time it is read.
+"""
+import copy
+from ..gro_api.utils import VersionStamp
+
+
+class Catalog:
+    """ The cached contents of the resource catalog """
+    def __init__(self, types, properties, effects):
+        self.types = {resource_type.pk: resource_type for resource_type in types}
+        self.type_codes = {
+            resource_type.code: resource_type for resource_type in types
+        }
+        self.properties = {prop.pk: prop for prop in properties}
+        self.property_keys = {
+            (self.types[prop.resource_type_id].code, prop.code): prop for
+            prop in properties
+        }
+        self.effects = {effect.pk: effect for effect in effects}
+        self.effect_keys = {
+            (self.types[effect.resource_type_id].code, effect.code): effect
+            for effect in effects
+        }
+
+
+class CatalogCache:
+    """
+    Loads the :class:`Catalog` the first time it is read and reloads it
+    whenever the version stamp of the catalog changes. Model instances are
+    copied on the way out so that callers can't change the cached ones.
+    """
+    stamp = VersionStamp('resource_catalog')
+
+    def __init__(self):
+        self.catalog = None
+        self.version = None
+
+    def get_catalog(self):
+        version = self.stamp.current_value
+        if self.catalog is None or version != self.version:
+            # The version is read before the catalog so that a change made
+            # while loading it is picked up by the next read
+            from .models import ResourceType, ResourceProperty, ResourceEffect
+            types = list(ResourceType.objects.all())
+            self.catalog = Catalog(
+                types, list(ResourceProperty.objects.all()),
+                list(ResourceEffect.objects.all())
+            )
+            self.version = version
+        return self.catalog
+
+    def clear(self):
+        """ Clears the cache of this process only """
+        self.catalog = None
+
+    def invalidate(self):
+        """ Clears the cache of every process """
+        self.clear()
+        self.stamp.bump()
+
+    def get_type(self, pk=None, code=None):
+        """
+        Returns the resource type with the primary key `pk` or the code `code`,
+        or None if there is no such type
+        """
+        catalog = self.get_catalog()
+        if pk is not None:
+            res = catalog.types.get(pk)
+        else:
+            res = catalog.type_codes.get(code)
+        return copy.copy(res)
+
+    def get_property(self, pk=None, key=None):
+        """
+        Returns the resource property with the primary key `pk` or the natural
+        key `key`, or None if there is no such property
+        """
+        catalog = self.get_catalog()
+        if pk is not None:
+            res = catalog.properties.get(pk)
+        else:
+            res = catalog.property_keys.get(tuple(key))
+        return copy.copy(res)
+
+    def get_effect(self, pk=None, key=None):
+        """
+        Returns the resource effect with the primary key `pk` or the natural
+        key `key`, or None if there is no such effect
+        """
+        catalog = self.get_catalog()
+        if pk is not None:
+            res = catalog.effects.get(pk)
+        else:
+            res = catalog.effect_keys.get(tuple(key))
+        return copy.copy(res)
+
+    def get_property_codes(self):
+        """
+        Returns a dictionary mapping the id of every property to its full code
+        (e.g. "ATM")
+        """
+        return {
+            prop.pk: type_code + code for (type_code, code), prop in
+            self.get_catalog().property_keys.items()
+        }
+
+catalog_cache = CatalogCache()
@@ -0,0 +1,196 @@
+"""
+This module defines :class:`ControlFrame`, which gathers everything that the
+firmware controlling a set of resources needs to run one iteration of its
+control loop: the current set points for the trays served by the resources,
+the latest reading from every sensing point, and the control settings and
+active overrides for every actuator. The frame is built in a fixed number of
+queries no matter how many resources, sensors or actuators are involved,
+except that lists of ids are split into chunks so that no query has more
+parameters than SQLite allows.
+"""
+import json
+import time
+import hashlib
+from collections import defaultdict
+from django.db.models import Max, Prefetch
+from rest_framework.reverse import reverse
+from rest_framework.utils.field_mapping import get_detail_view_name
+from ..layout.models import Tray, get_tray_locations
+from ..sensors.models import SensingPoint, DataPoint
+from ..actuators.models import Actuator, ControlProfile, ActuatorEffect
+from ..recipes.models import ActuatorOverride
+from ..recipes.set_points import get_current_set_points
+from .models import ResourceProperty, Resource
+
+
+def chunks(items, size):
+    """ Splits the sequence `items` into lists of at most `size` items """
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+class ControlFrame:
+    """
+    A snapshot of the control state of a set of resources.
+
+    :param resources: A queryset of the :class:`~resources.models.Resource`
+        instances to include in the frame
+    :param request: The request for which the frame is being built. Used to
+        generate hyperlinks
+    """
+    # The number of ids to look up per query. SQLite allows at most 999
+    # parameters in a query
+    chunk_size = 400
+
+    def __init__(self, resources, request=None):
+        self.resources = resources
+        self.request = request
+
+    def url_for(self, model, pk):
+        return reverse(
+            get_detail_view_name(model), kwargs={'pk': pk},
+            request=self.request
+        )
+
+    def get_readings(self, resources, property_codes):
+        """
+        Returns a dictionary mapping resource ids to dictionaries mapping
+        property codes to the latest reading of every sensing point measuring
+        that property in the resources in the queryset `resources`
+        """
+        active_points = SensingPoint.objects.filter(
+            sensor__resource__in=resources, is_active=True
+        )
+        sensing_points = {
+            point.pk: point for point in
+            active_points.select_related('sensor')
+        }
+        latest = DataPoint.objects.filter(
+            sensing_point__in=active_points
+        ).values('sensing_point_id').annotate(latest=Max('timestamp'))
+        latest = {row['sensing_point_id']: row['latest'] for row in latest}
+        values = {}
+        for chunk in chunks(sorted(latest.items()), self.chunk_size):
+            chunk = dict(chunk)
+            data_points = DataPoint.objects.filter(
+                sensing_point_id__in=chunk.keys(),
+                timestamp__in=set(chunk.values())
+            ).values_list('sensing_point_id', 'timestamp', 'value')
+            for point_id, timestamp, value in data_points:
+                if chunk[point_id] == timestamp:
+                    values[point_id] = (timestamp, value)
+        res = defaultdict(lambda: defaultdict(list))
+        for point_id, point in sorted(sensing_points.items()):
+            timestamp, value = values.get(point_id, (None, None))
+            code = property_codes[point.property_id]
+            res[point.sensor.resource_id][code].append({
+                'sensing_point': self.url_for(SensingPoint, point_id),
+                'timestamp': timestamp,
+                'value': value,
+            })
+        return res
+
+    def get_actuators(self, resources, property_codes, timestamp):
+        """
+        Returns a dictionary mapping resource ids to lists describing the
+        actuators installed in the resources in the queryset `resources`
+        """
+        effects = ActuatorEffect.objects.order_by('pk')
+        actuators = Actuator.objects.filter(
+            resource__in=resources
+        ).select_related('actuator_type', 'control_profile').prefetch_related(
+            Prefetch('control_profile__effects', queryset=effects)
+        ).order_by('pk')
+        overrides = ActuatorOverride.objects.filter(
+            actuator__resource__in=resources,
+            start_timestamp__lte=timestamp, end_timestamp__gt=timestamp
+        )
+        active_overrides = {}
+        for override in overrides:
+            active_overrides[override.actuator_id] = {
+                'value': override.value,
+                'start_timestamp': override.start_timestamp,
+                'end_timestamp': override.end_timestamp,
+            }
+        res = defaultdict(list)
+        for actuator in actuators:
+            profile = actuator.control_profile
+            res[actuator.resource_id].append({
+                'url': self.url_for(Actuator, actuator.pk),
+                'is_binary': actuator.actuator_type.is_binary,
+                'override': active_overrides.get(actuator.pk),
+                'control_profile': {
+                    'url': self.url_for(ControlProfile, profile.pk),
+                    'period': profile.period,
+                    'pulse_width': profile.pulse_width,
+                    'effects': {
+                        property_codes[effect.property_id]: {
+                            'effect_on_active': effect.effect_on_active,
+                            'threshold': effect.threshold,
+                        } for effect in profile.effects.all()
+                    },
+                },
+            })
+        return res
+
+    def get_data(self, timestamp=None):
+        """
+        Builds the frame as a dictionary that can be rendered directly in a
+        response
+        """
+        if timestamp is None:
+            timestamp = int(time.time())
+        resources = list(
+            self.resources.select_related('resource_type').order_by('pk')
+        )
+        property_codes = ResourceProperty.objects.get_codes()
+        trays_by_location = defaultdict(list)
+        for tray_id, locations in sorted(get_tray_locations().items()):
+            for location in locations:
+                trays_by_location[location].append(tray_id)
+        served_trays = {
+            resource.pk: trays_by_location.get(
+                (resource.location_type_id, resource.location_id), []
+            ) for resource in resources
+        }
+        tray_ids = set(
+            tray_id for trays in served_trays.values() for tray_id in trays
+        )
+        set_points = {}
+        for chunk in chunks(sorted(tray_ids), self.chunk_size):
+            set_points.update(get_current_set_points(chunk, timestamp))
+        readings = self.get_readings(self.resources, property_codes)
+        actuators = self.get_actuators(
+            self.resources, property_codes, timestamp
+        )
+        return {
+            'timestamp': timestamp,
+            'set_points': {
+                self.url_for(Tray, tray_id): {
+                    property_codes[property_id]: value for property_id, value
+                    in set_points.get(tray_id, {}).items()
+                } for tray_id in tray_ids
+            },
+            'resources': [{
+                'url': self.url_for(Resource, resource.pk),
+                'resource_type': resource.resource_type.code,
+                'trays': [
+                    self.url_for(Tray, tray_id) for tray_id in
+                    served_trays[resource.pk]
+                ],
+                'readings': readings.get(resource.pk, {}),
+                'actuators': actuators.get(resource.pk, []),
+            } for resource in resources]
+        }
+
+    @staticmethod
+    def get_etag(data):
+        """
+        Returns an entity tag for the frame `data` that only changes when the
+        control state changes (and not merely because time has passed)
+        """
+        state = dict(data)
+        state.pop('timestamp', None)
+        content = json.dumps(state, sort_keys=True).encode('utf-8')
+        return '"{}"'.format(hashlib.md5(content).hexdigest())
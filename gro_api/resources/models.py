@@ -1,11 +1,17 @@
 from django.db import models
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
+from .catalog import catalog_cache
 
 
 class ResourceTypeManager(models.Manager):
     def get_by_natural_key(self, code):
-        return self.get(code=code)
+        resource_type = catalog_cache.get_type(code=code)
+        if resource_type is None:
+            return self.get(code=code)
+        return resource_type
 
 
 class ResourceType(models.Model):
@@ -27,8 +33,18 @@ class ResourceType(models.Model):
 
 class ResourcePropertyManager(models.Manager):
     def get_by_natural_key(self, type_code, property_code):
-        resource_type = ResourceType.objects.get_by_natural_key(type_code)
-        return self.get(resource_type=resource_type, code=property_code)
+        prop = catalog_cache.get_property(key=(type_code, property_code))
+        if prop is None:
+            resource_type = ResourceType.objects.get_by_natural_key(type_code)
+            return self.get(resource_type=resource_type, code=property_code)
+        return prop
+
+    def get_codes(self):
+        """
+        Returns a dictionary mapping the id of every property to its full code
+        (e.g. "ATM"), which is the concatenation of its natural key
+        """
+        return catalog_cache.get_property_codes()
 
 
 class ResourceProperty(models.Model):
@@ -52,7 +68,10 @@ class ResourceProperty(models.Model):
     objects = ResourcePropertyManager()
 
     def natural_key(self):
-        return (self.resource_type.code, self.code)
+        resource_type = catalog_cache.get_type(pk=self.resource_type_id)
+        if resource_type is None:
+            resource_type = self.resource_type
+        return (resource_type.code, self.code)
     natural_key.dependencies = ['resources.ResourceType']
 
     def __str__(self):
@@ -61,8 +80,11 @@ class ResourceProperty(models.Model):
 
 class ResourceEffectManager(models.Manager):
     def get_by_natural_key(self, type_code, effect_code):
-        resource_type = ResourceType.objects.get_by_natural_key(type_code)
-        return self.get(resource_type=resource_type, code=effect_code)
+        effect = catalog_cache.get_effect(key=(type_code, effect_code))
+        if effect is None:
+            resource_type = ResourceType.objects.get_by_natural_key(type_code)
+            return self.get(resource_type=resource_type, code=effect_code)
+        return effect
 
 
 class ResourceEffect(models.Model):
@@ -80,7 +102,10 @@ class ResourceEffect(models.Model):
     objects = ResourceEffectManager()
 
     def natural_key(self):
-        return (self.resource_type.code, self.code)
+        resource_type = catalog_cache.get_type(pk=self.resource_type_id)
+        if resource_type is None:
+            resource_type = self.resource_type
+        return (resource_type.code, self.code)
     natural_key.dependencies = ['resources.ResourceType']
 
     def __str__(self):
@@ -101,3 +126,22 @@ class Resource(models.Model):
 
     def __str__(self):
         return self.name
+
+
+@receiver(post_save, sender=ResourceType)
+@receiver(post_delete, sender=ResourceType)
+@receiver(post_save, sender=ResourceProperty)
+@receiver(post_delete, sender=ResourceProperty)
+@receiver(post_save, sender=ResourceEffect)
+@receiver(post_delete, sender=ResourceEffect)
+def invalidate_catalog_cache(sender, raw=False, update_fields=None, **kwargs):
+    if update_fields is not None and set(update_fields) == {'resource_count'}:
+        # Creating a resource only bumps the count of its type, which isn't
+        # read from the catalog
+        return
+    if raw:
+        # Objects are being loaded from a fixture. Other processes are told
+        # once the whole fixture has been loaded.
+        catalog_cache.clear()
+    else:
+        catalog_cache.invalidate()
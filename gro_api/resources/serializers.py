@@ -1,11 +1,16 @@
+from itertools import islice
 from urllib.parse import urlparse
 from collections import OrderedDict
+from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import ObjectDoesNotExist
 from django.core.urlresolvers import get_script_prefix, resolve, Resolver404
+from django.utils import lru_cache
 from rest_framework.relations import HyperlinkedRelatedField
-from rest_framework.serializers import ReadOnlyField, ValidationError
+from rest_framework.serializers import (
+    ListSerializer, ReadOnlyField, ValidationError
+)
 from rest_framework.utils.field_mapping import get_detail_view_name
-from ..gro_api.utils import system_layout
+from ..gro_api.utils import system_layout, atomic
 from ..gro_api.serializers import BaseSerializer, DUMMY_VIEW_NAME
 from ..layout.models import Enclosure, Tray, dynamic_models
 from ..layout.schemata import all_schemata
@@ -60,9 +65,33 @@ class ResourceEffectSerializer(BaseSerializer):
         return val
 
 
+@lru_cache.lru_cache(maxsize=1024)
+def resolve_location(path, layout, lookup_url_kwarg):
+    """
+    Returns the ``(content type id, lookup value)`` pair of the layout object
+    with the url path `path` in the farm layout `layout`. Raises
+    :class:`~django.core.urlresolvers.Resolver404` if the path doesn't match
+    any url and :class:`KeyError` or :class:`AttributeError` if it isn't the
+    url of an object. Only successful resolutions are cached.
+    """
+    match = resolve(path)
+    lookup_value = match.kwargs[lookup_url_kwarg]
+    model = match.func.cls.model
+    return ContentType.objects.get_for_model(model).pk, lookup_value
+
+
 class ResourceLocationRelatedField(HyperlinkedRelatedField):
+    #: The largest number of locations listed in :attr:`choices`, which is used
+    #: to render forms in the browsable API and to describe the field in
+    #: OPTIONS requests
+    max_choices = 1000
+
     def __init__(self, **kwargs):
-        super().__init__(DUMMY_VIEW_NAME)
+        super().__init__(DUMMY_VIEW_NAME, **kwargs)
+        # Maps ``(content type id, lookup value)`` pairs to the locations
+        # already read by this field, so that bulk requests read every
+        # location once
+        self._locations = {}
 
     @property
     def queryset(self):
@@ -75,19 +104,31 @@ class ResourceLocationRelatedField(HyperlinkedRelatedField):
         # We should never be assigning an actual value to this property
         assert val is True
 
+    def iter_choices(self):
+        """
+        Yields the url and name of every possible location, reading the
+        locations of each type only once the previous ones have been consumed
+        """
+        request = self.context.get('request', None)
+        format = self.context.get('format', None)
+        current_schema = all_schemata[system_layout.current_value]
+        models = [Enclosure] + [
+            dynamic_models[entity_name] for entity_name in
+            current_schema.dynamic_entities
+        ] + [Tray]
+        for model in models:
+            view_name = get_detail_view_name(model)
+            for pk, name in model.objects.order_by('pk').values_list(
+                    'pk', 'name').iterator():
+                url = self.reverse(
+                    view_name, kwargs={self.lookup_url_kwarg: pk},
+                    request=request, format=format
+                )
+                yield str(url), name
+
     @property
     def choices(self):
-        res = OrderedDict()
-        enclosure = Enclosure.get_solo()
-        res[str(self.to_representation(enclosure))] = str(enclosure)
-        current_schema = all_schemata[system_layout.current_value]
-        for entity_name in current_schema.dynamic_entities:
-            model = dynamic_models[entity_name]
-            for obj in model.objects.all():
-                res[str(self.to_representation(obj))] = str(obj)
-        for tray in Tray.objects.all():
-            res[str(self.to_representation(tray))] = str(tray)
-        return res
+        return OrderedDict(islice(self.iter_choices(), self.max_choices))
 
     def to_internal_value(self, data):
         try:
@@ -103,18 +144,27 @@ class ResourceLocationRelatedField(HyperlinkedRelatedField):
                 data = '/' + data[len(prefix):]
 
         try:
-            match = resolve(data)
+            key = resolve_location(
+                data, system_layout.current_value, self.lookup_url_kwarg
+            )
         except Resolver404:
             self.fail('no_match')
-
-        try:
-            lookup_value = match.kwargs[self.lookup_url_kwarg]
-            lookup_kwargs = {self.lookup_field: lookup_value}
-            model = match.func.cls.model
-            return model.objects.get(**lookup_kwargs)
-        except (ObjectDoesNotExist, TypeError, ValueError):
+        except (KeyError, AttributeError):
             self.fail('does_not_exist')
 
+        if key not in self._locations:
+            content_type_id, lookup_value = key
+            model = ContentType.objects.get_for_id(
+                content_type_id
+            ).model_class()
+            try:
+                self._locations[key] = model.objects.get(
+                    **{self.lookup_field: lookup_value}
+                )
+            except (ObjectDoesNotExist, TypeError, ValueError):
+                self.fail('does_not_exist')
+        return self._locations[key]
+
     def to_representation(self, value):
         request = self.context.get('request', None)
         format = self.context.get('format', None)
@@ -126,26 +176,63 @@ class ResourceLocationRelatedField(HyperlinkedRelatedField):
         return self.get_url(value, view_name, request, format)
 
 
+class ResourceListSerializer(ListSerializer):
+    """
+    Creates many resources at once. The resources are checked against each
+    other before any of them is created, and they are all created in a single
+    transaction.
+    """
+    def validate(self, attrs_list):
+        seen = set()
+        for attrs in attrs_list:
+            location = attrs['location']
+            key = (
+                location._meta.model_name, location.pk,
+                attrs['resource_type'].pk
+            )
+            if key in seen:
+                raise ValidationError(
+                    'Two of the resources are of the same type and in the '
+                    'same location'
+                )
+            seen.add(key)
+        return attrs_list
+
+    def create(self, validated_data):
+        with atomic():
+            return super().create(validated_data)
+
+
 class ResourceSerializer(BaseSerializer):
     class Meta:
         model = Resource
         exclude = ('location_type', 'location_id')
+        list_serializer_class = ResourceListSerializer
 
     index = ReadOnlyField()
     location = ResourceLocationRelatedField()
 
-    def check_for_overlap(self, validated_data):
-        location = validated_data['location']
-        resource_type = validated_data['resource_type']
-        if any(resource.resource_type == resource_type for resource in \
+    def validate(self, attrs):
+        """
+        Ensures that there isn't another resource of the same type in the
+        location of this one
+        """
+        location = attrs['location']
+        resource_type = attrs['resource_type']
+        exclude = self.instance.pk if self.instance is not None else None
+        if any(
+                resource.resource_type_id == resource_type.pk and
+                resource.pk != exclude for resource in
                 location.resources.all()):
             raise ValidationError(
                 'A resource of this type already exists in this location'
             )
+        return attrs
 
     def create(self, validated_data):
-        self.check_for_overlap(validated_data)
         resource_type = validated_data['resource_type']
+        # Resources created in bulk have their own copy of their type
+        resource_type.refresh_from_db(fields=('resource_count',))
         resource_type.resource_count += 1
         validated_data['index'] = resource_type.resource_count
         if not validated_data.get('name', None):
@@ -153,7 +240,7 @@ class ResourceSerializer(BaseSerializer):
                 resource_type.name, validated_data['index']
             )
         instance = super().create(validated_data)
-        resource_type.save()
+        resource_type.save(update_fields=('resource_count',))
         return instance
 
     def update(self, instance, validated_data):
@@ -1,7 +1,13 @@
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import Group
+from django.db import connection
 from ..gro_api.test import APITestCase, run_with_any_layout
+from ..gro_api.utils import VersionStamp, bump_pending_stamps
+from ..layout.models import Enclosure
+from ..sensors.models import SensorType, Sensor, SensingPoint, DataPoint
 from .models import ResourceType, ResourceProperty, Resource
+from .catalog import CatalogCache
+from .frames import ControlFrame
 from .serializers import (
     ResourceTypeSerializer, ResourcePropertySerializer,
     ResourceEffectSerializer, ResourceSerializer
@@ -84,6 +90,55 @@ class ResourcePropertyTestCase(ResourceAuthMixin, APITestCase):
         self.assertEqual(res.status_code, 403)
 
 
+class CatalogCacheTestCase(ResourceAuthMixin, APITestCase):
+    @run_with_any_layout
+    def test_catalog_cache(self):
+        # Stands in for the cache of another worker process
+        other_cache = CatalogCache()
+        prop = ResourceProperty.objects.get_by_natural_key('A', 'TM')
+        self.assertEqual(other_cache.get_property(pk=prop.pk).name, prop.name)
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                ResourceProperty.objects.get_by_natural_key('A', 'TM').pk,
+                prop.pk
+            )
+            self.assertEqual(prop.natural_key(), ('A', 'TM'))
+            self.assertEqual(
+                ResourceProperty.objects.get_codes()[prop.pk], 'ATM'
+            )
+        # Changes to the cached instances don't leak into the cache
+        prop.name = 'Changed'
+        self.assertNotEqual(
+            ResourceProperty.objects.get_by_natural_key('A', 'TM').name,
+            'Changed'
+        )
+        prop.save()
+        self.assertEqual(
+            ResourceProperty.objects.get_by_natural_key('A', 'TM').name,
+            'Changed'
+        )
+        self.assertEqual(other_cache.get_property(pk=prop.pk).name, 'Changed')
+        # Other processes are told again once the transaction of the test is
+        # over, so we pretend that it is
+        self.assertIn(CatalogCache.stamp, VersionStamp.pending)
+        version = CatalogCache.stamp.current_value
+        connection.in_atomic_block = False
+        try:
+            bump_pending_stamps()
+        finally:
+            connection.in_atomic_block = True
+        self.assertFalse(VersionStamp.pending)
+        self.assertNotEqual(CatalogCache.stamp.current_value, version)
+        # Creating a resource only changes the resource count of its type,
+        # which doesn't invalidate the catalog
+        air = ResourceType.objects.get_by_natural_key('A')
+        air.resource_count += 1
+        air.save(update_fields=('resource_count',))
+        self.assertFalse(VersionStamp.pending)
+        with self.assertRaises(ResourceProperty.DoesNotExist):
+            ResourceProperty.objects.get_by_natural_key('A', 'XX')
+
+
 class ResourceTestCase(ResourceAuthMixin, APITestCase):
     @run_with_any_layout
     def test_visible_fields(self):
@@ -125,3 +180,118 @@ class ResourceTestCase(ResourceAuthMixin, APITestCase):
         data['resource_type'] = self.url_for_object('resourceType', water_id)
         res = self.client.put(res.data['url'], data=data)
         self.assertEqual(res.status_code, 400)
+
+    @run_with_any_layout
+    def test_bulk_resource_creation(self):
+        from .serializers import resolve_location
+        location = self.url_for_object('enclosure', 1)
+        data = [
+            {
+                'resource_type': self.url_for_object(
+                    'resourceType',
+                    ResourceType.objects.get_by_natural_key(code).pk
+                ),
+                'location': location,
+            } for code in ('A', 'W')
+        ]
+        hits = resolve_location.cache_info().hits
+        res = self.client.post(
+            self.url_for_object('resource') + '?many=true', data=data,
+            format='json'
+        )
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(len(res.data), 2)
+        self.assertTrue(res.data[1]['location'].endswith(location))
+        self.assertGreater(resolve_location.cache_info().hits, hits)
+        # Listing the possible locations is capped
+        field = ResourceSerializer().fields['location']
+        self.assertEqual(list(field.choices), [location])
+        field.max_choices = 0
+        self.assertEqual(field.choices, {})
+        # Nothing is created if two of the resources overlap
+        num_resources = Resource.objects.count()
+        data = [
+            {
+                'resource_type': self.url_for_object(
+                    'resourceType',
+                    ResourceType.objects.get_by_natural_key('L').pk
+                ),
+                'location': location,
+            }
+        ] * 2
+        res = self.client.post(
+            self.url_for_object('resource') + '?many=true', data=data,
+            format='json'
+        )
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(Resource.objects.count(), num_resources)
+        # `many` is a boolean
+        res = self.client.post(
+            self.url_for_object('resource') + '?many=false', data=data[0],
+            format='json'
+        )
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(Resource.objects.count(), num_resources + 1)
+
+
+class ControlFrameTestCase(ResourceAuthMixin, APITestCase):
+    @run_with_any_layout
+    def test_control_frame_etag(self):
+        frame_url = self.url_for_object('resource') + 'control_frame/'
+        res = self.client.get(frame_url)
+        self.assertEqual(res.status_code, 200)
+        etag = res['ETag']
+        res = self.client.get(frame_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, 304)
+        # Installing a new resource changes the control state
+        air_id = ResourceType.objects.get_by_natural_key('A').pk
+        data = {
+            'resource_type': self.url_for_object('resourceType', air_id),
+            'location': self.url_for_object('enclosure', 1),
+        }
+        res = self.client.post(self.url_for_object('resource'), data=data)
+        self.assertEqual(res.status_code, 201)
+        resource_url = res.data['url']
+        res = self.client.get(frame_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res['ETag'], etag)
+        resource_urls = [resource['url'] for resource in res.data['resources']]
+        self.assertIn(resource_url, resource_urls)
+        res = self.client.get(frame_url, {'resource': 'air'})
+        self.assertEqual(res.status_code, 400)
+
+    @run_with_any_layout
+    def test_control_frame_readings(self):
+        air = ResourceType.objects.get_by_natural_key('A')
+        resource = Resource.objects.create(
+            index=1, resource_type=air, location=Enclosure.get_solo()
+        )
+        sensor = Sensor.objects.create(
+            index=1, sensor_type=SensorType.objects.first(), resource=resource
+        )
+        temperature = ResourceProperty.objects.get_by_natural_key('A', 'TM')
+        sensing_points = [
+            SensingPoint.objects.create(
+                index=index, sensor=sensor, property=temperature
+            ) for index in range(1, 6)
+        ]
+        for i, sensing_point in enumerate(sensing_points[:4]):
+            for timestamp in (100, 200 + i):
+                DataPoint.objects.create(
+                    sensing_point=sensing_point, timestamp=timestamp,
+                    value=timestamp + i
+                )
+        frame = ControlFrame(Resource.objects.filter(pk=resource.pk))
+        # Looking up the latest readings in several queries gives the same
+        # readings as looking them up all at once
+        frame.chunk_size = 2
+        data = frame.get_data()
+        readings = data['resources'][0]['readings']
+        code = ResourceProperty.objects.get_codes()[temperature.pk]
+        self.assertEqual(
+            [(reading['timestamp'], reading['value']) for reading in
+             readings[code]],
+            [(200, 200), (201, 202), (202, 204), (203, 206), (None, None)]
+        )
+        frame.chunk_size = 400
+        self.assertEqual(frame.get_data(data['timestamp']), data)
@@ -1,4 +1,10 @@
+import time
+from rest_framework import status
+from rest_framework.response import Response
 from rest_framework.viewsets import ModelViewSet
+from rest_framework.decorators import list_route
+from rest_framework.fields import BooleanField
+from rest_framework.exceptions import ValidationError
 from rest_framework.permissions import DjangoModelPermissionsOrAnonReadOnly
 from ..gro_api.permissions import EnforceReadOnly
 from .models import (
@@ -8,6 +14,7 @@ from .serializers import (
     ResourceTypeSerializer, ResourcePropertySerializer,
     ResourceEffectSerializer, ResourceSerializer
 )
+from .frames import ControlFrame
 
 
 class ResourceTypeViewSet(ModelViewSet):
@@ -39,7 +46,67 @@ class ResourceEffectViewSet(ModelViewSet):
 class ResourceViewSet(ModelViewSet):
     """
     An input to the growing process of a plant, such as a reservoir of water or
-    the light shining on a tray
+    the light shining on a tray. Pass `many` in the query string to create a
+    list of resources at once.
     """
     queryset = Resource.objects.all()
     serializer_class = ResourceSerializer
+
+    def create(self, request, *args, **kwargs):
+        many = request.query_params.get('many') in BooleanField.TRUE_VALUES
+        serializer = self.get_serializer(data=request.data, many=many)
+        serializer.is_valid(raise_exception=True)
+        self.perform_create(serializer)
+        headers = self.get_success_headers(serializer.data)
+        return Response(
+            serializer.data, status=status.HTTP_201_CREATED, headers=headers
+        )
+
+    #: The longest time (in seconds) for which a control frame request will
+    #: wait for the control state to change. Waiting requests hold a worker,
+    #: so this is kept short; controllers should simply ask again.
+    max_frame_wait = 5
+    #: How often (in seconds) a waiting control frame request checks whether
+    #: the control state has changed
+    frame_poll_interval = 1
+
+    @list_route(methods=["get"])
+    def control_frame(self, request):
+        """
+        Get everything a controller needs to run one iteration of its control
+        loop: current set points for the served trays, the latest sensor
+        readings, and the control profiles, effects and active overrides of
+        all actuators. Pass a `resource` id to restrict the frame to a single
+        resource. The response carries an `ETag`; send it back in the
+        `If-None-Match` header along with `wait` (a number of seconds) to wait
+        until the control state changes (for at most 5 seconds). If it doesn't
+        change in time, the response has status 304.
+        """
+        resources = self.get_queryset()
+        try:
+            resource_id = request.query_params.get('resource', None)
+            if resource_id is not None:
+                resources = resources.filter(pk=int(resource_id))
+            wait = min(
+                float(request.query_params.get('wait', 0)),
+                self.max_frame_wait
+            )
+        except ValueError:
+            raise ValidationError(
+                '`resource` must be a resource id and `wait` must be a number '
+                'of seconds'
+            )
+        old_etag = request.META.get('HTTP_IF_NONE_MATCH', None)
+        deadline = time.time() + wait
+        frame = ControlFrame(resources, request=request)
+        while True:
+            data = frame.get_data()
+            etag = frame.get_etag(data)
+            if etag != old_etag:
+                return Response(data, headers={'ETag': etag})
+            if time.time() >= deadline:
+                return Response(
+                    status=status.HTTP_304_NOT_MODIFIED,
+                    headers={'ETag': etag}
+                )
+            time.sleep(self.frame_poll_interval)
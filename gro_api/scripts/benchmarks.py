@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the parts of the API that run on every process start or on
+every request. Run ``python -m gro_api.scripts.benchmarks`` to run all of them
+or pass the names of the benchmarks to run. Benchmarks that need Django run
+with the test settings and don't touch the database.
+"""
+import os
+import sys
+import shutil
+import argparse
+import tempfile
+import subprocess
+import timeit
+from collections import OrderedDict
+
+#: Maps the names of benchmarks to functions that run them
+benchmarks = OrderedDict()
+
+
+def benchmark(func):
+    """ Registers `func` as a benchmark """
+    benchmarks[func.__name__] = func
+    return func
+
+
+def report(name, seconds, number=1):
+    print('{:<40} {:>12.1f} us'.format(name, seconds / number * 1e6))
+
+
+def setup_django():
+    """ Sets up Django with the test settings if it isn't set up yet """
+    from django.apps import apps
+    if apps.ready:
+        return
+    os.environ.setdefault(
+        'DJANGO_SETTINGS_MODULE', 'gro_api.gro_api.test_settings'
+    )
+    from django.conf import settings
+    from .load_env import load_env
+    load_env()
+    # Our settings file monkey patches django.setup, so we have to force django
+    # to load it before calling django.setup
+    settings.INSTALLED_APPS
+    from django import setup
+    setup()
+
+
+def time_process(code, env, number):
+    """
+    Returns the shortest time it takes a new Python process to run `code`
+    with the environment variables `env`, out of `number` runs
+    """
+    env = dict(os.environ, **env)
+    # Run from the directory containing the gro_api package
+    cwd = os.path.dirname(
+        os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+    )
+    times = []
+    for i in range(number):
+        start = timeit.default_timer()
+        subprocess.check_call([sys.executable, '-c', code], env=env, cwd=cwd)
+        times.append(timeit.default_timer() - start)
+    return min(times)
+
+
+@benchmark
+def schemata_startup(number):
+    """
+    Compares importing the schemata of a new process from the schema files and
+    from the compiled schemata
+    """
+    from ..layout.schemata import load_schemata
+    temp_dir = tempfile.mkdtemp()
+    try:
+        compiled_path = os.path.join(temp_dir, 'schemata.json')
+        # The compiled schemata can't be written here, so they are compiled
+        # every time
+        missing_path = os.path.join(temp_dir, 'missing', 'schemata.json')
+        report('load_schemata (compile)', timeit.timeit(
+            lambda: load_schemata(compiled_path=missing_path), number=number
+        ), number)
+        load_schemata(compiled_path=compiled_path)
+        report('load_schemata (compiled)', timeit.timeit(
+            lambda: load_schemata(compiled_path=compiled_path),
+            number=number
+        ), number)
+        code = 'import gro_api.layout.schemata'
+        report('import schemata (compile)', time_process(
+            code, {'GRO_API_COMPILED_SCHEMATA': missing_path}, number
+        ))
+        report('import schemata (compiled)', time_process(
+            code, {'GRO_API_COMPILED_SCHEMATA': compiled_path}, number
+        ))
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+@benchmark
+def layout_descriptors(number):
+    """
+    Times the operations backed by layout-dependent descriptors (model field
+    access, serializer construction and query building) for every model of
+    every schema
+    """
+    setup_django()
+    from ..gro_api.utils import system_layout
+    from ..layout.schemata import all_schemata
+    from ..layout.tree import get_entity_names
+    from ..layout.models import get_layout_model
+    from ..layout.serializers import (
+        EnclosureSerializer, TraySerializer, dynamic_serializers
+    )
+
+    def get_serializer_class(entity_name):
+        if entity_name == 'Enclosure':
+            return EnclosureSerializer
+        if entity_name == 'Tray':
+            return TraySerializer
+        return dynamic_serializers[entity_name]
+
+    for layout, schema in sorted(all_schemata.items()):
+        with system_layout.as_value(layout):
+            entity_names = get_entity_names(schema)
+            models = [
+                get_layout_model(entity_name) for entity_name in entity_names
+            ]
+            serializer_classes = [
+                get_serializer_class(entity_name) for entity_name in
+                entity_names
+            ]
+
+            def access_fields():
+                for model in models:
+                    for field in model._meta.concrete_fields:
+                        field.attname
+                    model._meta.get_field('name')
+
+            def construct_serializers():
+                for serializer_class in serializer_classes:
+                    serializer_class().fields
+
+            def build_queries():
+                for model in models:
+                    queryset = model.objects.filter(name='benchmark')
+                    if model._meta.model_name != 'enclosure':
+                        queryset = queryset.filter(parent__pk=1)
+                    str(queryset.query)
+
+            for name, func in (
+                    ('field access', access_fields),
+                    ('serializer construction', construct_serializers),
+                    ('query building', build_queries)):
+                # Warm the per-layout caches first
+                func()
+                report('{} ({})'.format(name, layout), timeit.timeit(
+                    func, number=number
+                ), number)
+
+
+@benchmark
+def system_layout_value(number):
+    """
+    Compares reading the layout of the farm from the layout cache and from
+    the memory of the current process
+    """
+    setup_django()
+    from ..gro_api.utils import system_layout, get_layout_cache
+    cache = get_layout_cache()
+    use_mock_value = system_layout.use_mock_value
+    system_layout.use_mock_value = False
+    cache.set(system_layout.cache_key, 'tray')
+    try:
+        def read_from_cache():
+            system_layout.local_value = None
+            system_layout.current_value
+        report('current_value (cache)', timeit.timeit(
+            read_from_cache, number=number
+        ), number)
+        report('current_value (process)', timeit.timeit(
+            lambda: system_layout.current_value, number=number
+        ), number)
+    finally:
+        system_layout.use_mock_value = use_mock_value
+        system_layout.local_value = None
+        cache.delete(system_layout.cache_key)
+
+
+def run_benchmarks():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        'names', nargs='*', metavar='name',
+        help='Benchmarks to run ({}); defaults to all of them'.format(
+            ', '.join(benchmarks)
+        )
+    )
+    parser.add_argument(
+        '--number', '-n', type=int, default=10,
+        help='Number of times to run each benchmark'
+    )
+    args = parser.parse_args()
+    for name in args.names or benchmarks:
+        if name not in benchmarks:
+            parser.error('Unknown benchmark "{}"'.format(name))
+        benchmarks[name](args.number)
+
+if __name__ == '__main__':
+    run_benchmarks()
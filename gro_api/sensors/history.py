@@ -0,0 +1,34 @@
+"""
+This module reads the recorded history of sensing points in a bounded number
+of queries, regardless of how many sensing points or data points are
+involved.
+"""
+from collections import defaultdict
+from django.db.models import Max, Q
+from .models import DataPoint
+
+
+def get_data_point_history(sensing_point_ids, start, end):
+    """
+    Returns a dictionary mapping the id of every sensing point in
+    `sensing_point_ids` to a time-ordered list of ``(timestamp, value)``
+    pairs holding its readings over ``[start, end]``. Each list also starts
+    with the last reading before `start` (if any), since that reading is
+    still the current one at `start`.
+    """
+    sensing_point_ids = list(sensing_point_ids)
+    initial = DataPoint.objects.filter(
+        sensing_point_id__in=sensing_point_ids, timestamp__lt=start
+    ).values('sensing_point_id').annotate(latest=Max('timestamp'))
+    query = Q(timestamp__gte=start, timestamp__lte=end)
+    for row in initial:
+        query |= Q(
+            sensing_point_id=row['sensing_point_id'], timestamp=row['latest']
+        )
+    data_points = DataPoint.objects.filter(
+        query, sensing_point_id__in=sensing_point_ids
+    ).order_by('timestamp').values_list('sensing_point_id', 'timestamp', 'value')
+    res = defaultdict(list)
+    for point_id, timestamp, value in data_points:
+        res[point_id].append((timestamp, value))
+    return res
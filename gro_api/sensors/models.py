@@ -64,6 +64,7 @@ class DataPoint(models.Model):
     class Meta:
         ordering = ['timestamp']
         get_latest_by = 'timestamp'
+        index_together = ('sensing_point', 'timestamp')
 
     sensing_point = models.ForeignKey(SensingPoint, related_name='data_points+')
     timestamp = models.IntegerField(blank=True, default=time.time)